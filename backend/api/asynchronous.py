@@ -0,0 +1,97 @@
+"""Async read path for the viewsets, used by the ASGI deployment.
+
+With ``ASYNC_READS`` on, a viewset action that has an ``a<action>``
+coroutine is routed to a coroutine view: GET and HEAD run on the event
+loop and reach the database through the async ORM, while other methods
+and the browsable API keep to the sync action on a thread.  Under WSGI the
+setting is off and the routes stay sync, as an async view there would
+spin up an event loop per request.
+
+DRF's request handling is reused as is; only authenticating a token may
+query, so requests that send one are authenticated on a thread.  Anything
+else that would query synchronously on the event loop raises
+``SynchronousOnlyOperation``, so the async actions load everything their
+serializers read up front.
+"""
+from functools import update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.utils.decorators import classonlymethod
+from rest_framework.renderers import BrowsableAPIRenderer
+
+from .timing import phase
+
+
+class AsyncReadMixin:
+
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        action = (actions or {}).get('get')
+        if not settings.ASYNC_READS or not hasattr(cls, f'a{action}'):
+            return view
+        sync_view = sync_to_async(view)
+        action_map = {'head': action, **actions}
+
+        async def async_view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await sync_view(request, *args, **kwargs)
+            self = cls(**initkwargs)
+            self.action_map = action_map
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            return await self.adispatch(request, *args, **kwargs)
+
+        return update_wrapper(async_view, view)
+
+    async def adispatch(self, request, *args, **kwargs):
+        """``dispatch`` of a GET to the ``a<action>`` coroutine."""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            if 'HTTP_AUTHORIZATION' in request.META:
+                await sync_to_async(self.initial)(request, *args, **kwargs)
+            else:
+                self.initial(request, *args, **kwargs)
+            if isinstance(request.accepted_renderer, BrowsableAPIRenderer):
+                # Its forms query synchronously
+                handler = sync_to_async(getattr(self, self.action))
+            else:
+                handler = getattr(self, f'a{self.action}')
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(
+            request, response, *args, **kwargs)
+        if (hasattr(self.response, 'render')
+                and not isinstance(request.accepted_renderer,
+                                   BrowsableAPIRenderer)):
+            # Otherwise the handler renders it on a thread
+            with phase('render'):
+                self.response.render()
+        return self.response
+
+    async def aget_object(self):
+        """``get_object`` through the async ORM."""
+        queryset = self.filter_queryset(await self.aget_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError,
+                ValidationError):
+            raise Http404(f'No {queryset.model._meta.object_name} matches '
+                          f'the given query.')
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def aget_queryset(self):
+        return self.get_queryset()
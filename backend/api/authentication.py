@@ -0,0 +1,105 @@
+"""Token authentication that skips the token query on repeat requests.
+
+Authenticated tokens are remembered in two tiers: a bounded LRU in each
+process, trusted for ``TOKEN_AUTH_LOCAL_TIMEOUT`` seconds, and the shared
+cache for ``TOKEN_AUTH_CACHE_TIMEOUT``.  Entries are dropped when the token
+is deleted (logout) or its user is saved, which covers password changes
+and deactivation (see ``api.signals``).  Other processes drop their local
+copy within the local timeout.
+"""
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from .metrics import record_cache
+
+KEY_PREFIX = 'auth-token'
+
+
+class LRUCache:
+    """Thread-safe, size-bounded mapping whose entries expire."""
+
+    def __init__(self, max_size=None):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self):
+        return self._max_size or settings.TOKEN_AUTH_LRU_SIZE
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+local_tokens = LRUCache()
+
+
+def token_cache_key(key):
+    # Raw tokens never end up in cache keys
+    return f'{KEY_PREFIX}:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def forget_token(key):
+    cache_key = token_cache_key(key)
+    local_tokens.delete(cache_key)
+    cache.delete(cache_key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """``TokenAuthentication`` backed by the local LRU and shared cache."""
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        token = local_tokens.get(cache_key)
+        record_cache('token-local', token is not None)
+        if token is None:
+            token = cache.get(cache_key)
+            record_cache('token-shared', token is not None)
+            if token is None:
+                token = super().authenticate_credentials(key)[1]
+                cache.set(cache_key, token, settings.TOKEN_AUTH_CACHE_TIMEOUT)
+            local_tokens.set(cache_key, copy.deepcopy(token),
+                             settings.TOKEN_AUTH_LOCAL_TIMEOUT)
+        # Requests get their own copy, so nothing they load or change on
+        # the user leaks into the next one
+        token = copy.deepcopy(token)
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        return (token.user, token)
@@ -0,0 +1,188 @@
+"""Response cache for anonymous reads.
+
+Entries are keyed by the generation of the data they render, the path and
+the normalized query string, so bumping the generation (see
+``core.signals``) retires every cached page at once.  Concurrent misses for
+the same key are collapsed: one request renders while the others wait for
+its result.  Entries keep the response's validators, so conditional
+requests are answered from the cache too.
+"""
+import asyncio
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from core.generations import aget_generation, get_generation
+
+from .metrics import record_cache
+from .replicas import primary
+from .timing import phase
+
+RECIPE_RESPONSES_GENERATION = 'recipe-responses'
+CACHED_HEADERS = ('ETag', 'Last-Modified', 'Vary')
+
+
+def single_flight(key, build, timeout):
+    """Return ``cache[key]``, letting only one caller run ``build``.
+
+    ``build`` returns the value to cache or ``None`` for uncacheable
+    results.  Callers that lose the race poll for the winner's value and
+    build it themselves if it does not show up in time.
+    """
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, settings.RESPONSE_CACHE_LOCK_TIMEOUT):
+        try:
+            value = build()
+            if value is not None:
+                cache.set(key, value, timeout)
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + settings.RESPONSE_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(settings.RESPONSE_CACHE_POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    return build()
+
+
+async def asingle_flight(key, build, timeout):
+    """``single_flight`` for a coroutine ``build``."""
+    lock_key = f'{key}:lock'
+    if await cache.aadd(lock_key, 1, settings.RESPONSE_CACHE_LOCK_TIMEOUT):
+        try:
+            value = await build()
+            if value is not None:
+                await cache.aset(key, value, timeout)
+            return value
+        finally:
+            await cache.adelete(lock_key)
+
+    deadline = time.monotonic() + settings.RESPONSE_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(settings.RESPONSE_CACHE_POLL_INTERVAL)
+        value = await cache.aget(key)
+        if value is not None:
+            return value
+    return await build()
+
+
+class AnonymousResponseCacheMixin:
+    """Serve ``list`` and ``retrieve`` for anonymous users from the cache."""
+    cache_generation = RECIPE_RESPONSES_GENERATION
+    # Query parameters that do not change the anonymous response
+    cache_ignored_params = ()
+
+    def is_response_cacheable(self, request):
+        return (request.method == 'GET'
+                and not request.user.is_authenticated
+                and 'HTTP_AUTHORIZATION' not in request.META)
+
+    def get_response_cache_key(self, request):
+        return self.response_cache_key(
+            request, get_generation(self.cache_generation))
+
+    def response_cache_key(self, request, generation):
+        params = sorted(
+            (name, sorted(values))
+            for name, values in request.query_params.lists()
+            if name not in self.cache_ignored_params
+        )
+        # Bodies hold absolute URLs built from the scheme and host
+        digest = hashlib.md5(
+            f'{request.scheme}://{request.get_host()}{request.path}|'
+            f'{request.accepted_renderer.format}|{params}'
+            .encode(), usedforsecurity=False).hexdigest()
+        return f'response:{self.cache_generation}:{generation}:{digest}'
+
+    def render_for_cache(self, request, response):
+        response = self.finalize_response(request, response)
+        with phase('render'):
+            response.render()
+        if response.status_code != 200:
+            return None
+        return {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'headers': {header: response[header]
+                        for header in CACHED_HEADERS if header in response},
+        }
+
+    def cached_response(self, request, build):
+        if not self.is_response_cacheable(request):
+            return build()
+        key = self.get_response_cache_key(request)
+        entry = cache.get(key)
+        record_cache('response', entry is not None)
+        if entry is None:
+            uncached = []
+
+            def render():
+                # Rendered from the primary, as entries outlive a replica's
+                # lag (see api.replicas)
+                with primary():
+                    response = build()
+                entry = self.render_for_cache(request, response)
+                if entry is None:
+                    uncached.append(response)
+                return entry
+
+            entry = single_flight(
+                key, render, settings.RECIPE_RESPONSE_CACHE_TIMEOUT)
+            if uncached:
+                return uncached[0]
+        return self.response_from_entry(request, entry)
+
+    async def acached_response(self, request, build):
+        """``cached_response`` for a coroutine ``build``."""
+        if not self.is_response_cacheable(request):
+            return await build()
+        key = self.response_cache_key(
+            request, await aget_generation(self.cache_generation))
+        entry = await cache.aget(key)
+        record_cache('response', entry is not None)
+        if entry is None:
+            uncached = []
+
+            async def render():
+                with primary():
+                    response = await build()
+                entry = self.render_for_cache(request, response)
+                if entry is None:
+                    uncached.append(response)
+                return entry
+
+            entry = await asingle_flight(
+                key, render, settings.RECIPE_RESPONSE_CACHE_TIMEOUT)
+            if uncached:
+                return uncached[0]
+        return self.response_from_entry(request, entry)
+
+    def response_from_entry(self, request, entry):
+        response = HttpResponse(entry['content'],
+                                content_type=entry['content_type'])
+        for header, value in entry.get('headers', {}).items():
+            response[header] = value
+        return get_conditional_response(
+            request, etag=response.get('ETag'),
+            last_modified=parse_http_date_safe(
+                response.get('Last-Modified')),
+            response=response)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(AnonymousResponseCacheMixin, self).list(
+                request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request,
+            lambda: super(AnonymousResponseCacheMixin, self).retrieve(
+                request, *args, **kwargs))
@@ -0,0 +1,99 @@
+"""Validators for conditional requests.
+
+Views describe the rows a response is rendered from with a small version
+tuple (counts and ``updated_at`` maxima) that a single aggregate query
+returns, so a request can be answered with ``304 Not Modified`` before
+anything is serialized.  The strong ETag hashes that tuple with everything
+else the body depends on: the path, the query string, the renderer and the
+user.  Favorites, carts and subscriptions move ``updated_at`` on the recipe
+or author they are counted on (see ``core.counters``), which keeps the
+per-user flags covered as well.
+
+``Last-Modified`` has one-second resolution and misses deletions, so the
+ETag is the validator that counts; If-Modified-Since is ignored whenever
+If-None-Match is sent.
+"""
+import hashlib
+from datetime import datetime
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+
+def make_etag(request, version):
+    params = sorted(
+        (name, sorted(values))
+        for name, values in request.query_params.lists()
+    )
+    digest = hashlib.md5(
+        f'{request.path}|{request.accepted_renderer.format}|'
+        f'{request.user.pk}|{params}|{version}'.encode(),
+        usedforsecurity=False).hexdigest()
+    return f'"{digest}"'
+
+
+def last_modified(version):
+    timestamps = [value for value in version if isinstance(value, datetime)]
+    if not timestamps:
+        return None
+    return int(max(timestamps).timestamp())
+
+
+class ConditionalGetMixin:
+    """Add validators to ``list`` and ``retrieve`` and honour them.
+
+    Views return ``None`` from the version hooks when they cannot tell,
+    e.g. for a missing object, and the request is served as usual.
+    """
+
+    def get_list_version(self):
+        return None
+
+    def get_object_version(self):
+        return None
+
+    def check_preconditions(self, request, version):
+        """Return the 304 or 412 response the request's headers call for."""
+        return get_conditional_response(
+            request, etag=make_etag(request, version),
+            last_modified=last_modified(version))
+
+    def set_validators(self, request, response, version):
+        response['ETag'] = make_etag(request, version)
+        modified = last_modified(version)
+        if modified is not None:
+            response['Last-Modified'] = http_date(modified)
+        patch_vary_headers(response, ('Authorization',))
+
+    def conditional_response(self, request, version, build):
+        if version is None:
+            return build()
+        response = self.check_preconditions(request, version)
+        if response is None:
+            response = build()
+        if response.status_code in (200, 304):
+            self.set_validators(request, response, version)
+        return response
+
+    async def aconditional_response(self, request, version, build):
+        """``conditional_response`` for a coroutine ``build``."""
+        if version is None:
+            return await build()
+        response = self.check_preconditions(request, version)
+        if response is None:
+            response = await build()
+        if response.status_code in (200, 304):
+            self.set_validators(request, response, version)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, self.get_list_version(),
+            lambda: super(ConditionalGetMixin, self).list(
+                request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, self.get_object_version(),
+            lambda: super(ConditionalGetMixin, self).retrieve(
+                request, *args, **kwargs))
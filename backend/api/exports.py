@@ -0,0 +1,190 @@
+"""Streaming writers for the shopping cart export.
+
+Each writer takes an iterable of ``(name, amount, unit)`` rows and yields
+encoded chunks, so a response never holds the whole file in memory.
+"""
+import csv
+import io
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+CHUNK_ROWS = 500
+HEADER = ('Ingredient', 'Amount', 'Unit')
+
+
+def batched(rows, size=CHUNK_ROWS):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def stream_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # Keep the BOM so spreadsheet apps detect UTF-8
+    buffer.write('\ufeff')
+    writer.writerow(HEADER)
+    for batch in batched(rows):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def stream_txt(rows):
+    yield 'Shopping cart\n\n'.encode('utf-8')
+    for batch in batched(rows):
+        yield ''.join(
+            f'{name} ({unit}) — {amount}\n' for name, amount, unit in batch
+        ).encode('utf-8')
+
+
+def stream_json(rows):
+    separator = '\n'
+    yield b'['
+    for batch in batched(rows):
+        chunk = []
+        for name, amount, unit in batch:
+            chunk.append(separator + json.dumps(
+                {'name': name, 'amount': amount, 'measurement_unit': unit},
+                ensure_ascii=False))
+            separator = ',\n'
+        yield ''.join(chunk).encode('utf-8')
+    yield b'\n]\n'
+
+
+async def aiterate(chunks):
+    """Yield a writer's chunks to an ASGI response as they are written.
+
+    Django buffers a sync iterator whole under ASGI; here each chunk is
+    written on the request's thread, which holds the rows' cursor.
+    """
+    chunks = iter(chunks)
+    next_chunk = sync_to_async(next)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
+
+
+class PdfWriter:
+    """Minimal PDF writer that emits the document one page at a time.
+
+    Objects are numbered as they are written and their byte offsets are
+    remembered for the cross-reference table, so only the current page is
+    buffered.  Text uses the built-in Helvetica with a cp1251 encoding so
+    Cyrillic ingredient names render without embedding a font.
+    """
+    CATALOG, PAGES, FONT = 1, 2, 3
+    PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+    MARGIN = 50
+    FONT_SIZE = 12
+    LEADING = 16
+    # cp1251 code points of Ё, ё and А..я mapped to Adobe glyph names
+    CYRILLIC = (
+        '168 /afii10023 184 /afii10071 192 '
+        + ' '.join(f'/afii{10017 + index}' for index in (
+            0, 1, 2, 3, 4, 5, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17,
+            18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32))
+        + ' 224 '
+        + ' '.join(f'/afii{10065 + index}' for index in (
+            0, 1, 2, 3, 4, 5, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17,
+            18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32))
+    )
+
+    def __init__(self):
+        self.offset = 0
+        self.offsets = {}
+        self.pages = []
+        self.next_number = self.FONT + 1
+
+    @property
+    def lines_per_page(self):
+        return (self.PAGE_HEIGHT - 2 * self.MARGIN) // self.LEADING
+
+    def emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def write_object(self, number, body):
+        self.offsets[number] = self.offset
+        return self.emit(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+
+    def allocate(self):
+        number = self.next_number
+        self.next_number += 1
+        return number
+
+    def text(self, value):
+        return b'<' + value.encode('cp1251', 'replace').hex().encode() + b'>'
+
+    def page(self, lines):
+        content = b''.join(
+            [b'BT /F1 %d Tf %d TL %d %d Td\n' % (
+                self.FONT_SIZE, self.LEADING, self.MARGIN,
+                self.PAGE_HEIGHT - self.MARGIN)]
+            + [self.text(line) + b' Tj T*\n' for line in lines]
+            + [b'ET']
+        )
+        content_number, page_number = self.allocate(), self.allocate()
+        self.pages.append(page_number)
+        return self.write_object(
+            content_number,
+            b'<< /Length %d >>\nstream\n' % len(content)
+            + content + b'\nendstream'
+        ) + self.write_object(
+            page_number,
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] '
+            b'/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>'
+            % (self.PAGES, self.PAGE_WIDTH, self.PAGE_HEIGHT, self.FONT,
+               content_number)
+        )
+
+    def stream(self, lines):
+        yield self.emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        yield self.write_object(
+            self.FONT,
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+            b'/Encoding << /Type /Encoding /BaseEncoding /WinAnsiEncoding '
+            b'/Differences [' + self.CYRILLIC.encode() + b'] >> >>'
+        )
+        for page_lines in batched(lines, self.lines_per_page):
+            yield self.page(page_lines)
+        if not self.pages:
+            yield self.page([])
+
+        kids = b' '.join(b'%d 0 R' % number for number in self.pages)
+        yield self.write_object(
+            self.PAGES,
+            b'<< /Type /Pages /Kids [%s] /Count %d >>'
+            % (kids, len(self.pages)))
+        yield self.write_object(
+            self.CATALOG, b'<< /Type /Catalog /Pages %d 0 R >>' % self.PAGES)
+
+        xref_offset = self.offset
+        size = self.next_number
+        entries = [b'0000000000 65535 f \n'] + [
+            b'%010d 00000 n \n' % self.offsets[number]
+            for number in range(1, size)
+        ]
+        yield self.emit(
+            b'xref\n0 %d\n' % size + b''.join(entries)
+            + b'trailer\n<< /Size %d /Root %d 0 R >>\n' % (
+                size, self.CATALOG)
+            + b'startxref\n%d\n%%%%EOF\n' % xref_offset)
+
+
+def stream_pdf(rows):
+    lines = (f'{name} ({unit}) - {amount}' for name, amount, unit in rows)
+    return PdfWriter().stream(
+        line for chunk in (['Shopping cart', ''], lines) for line in chunk)
+
+
+WRITERS = {
+    'csv': stream_csv,
+    'txt': stream_txt,
+    'json': stream_json,
+    'pdf': stream_pdf,
+}
@@ -0,0 +1,430 @@
+"""Request metrics shared by the gunicorn workers, served on ``/metrics``.
+
+Each process writes its samples to memory-mapped files of its own in
+``METRICS_DIR``: ``counter_<pid>.db`` for counters and histograms, kept
+after the process exits so totals never go down, and ``gauge_<pid>.db``
+for gauges, which only count while the process is alive.  A file is a
+header holding the bytes used, followed by entries of a key and a double::
+
+    header   used bytes (uint32), padding
+    entries  key length (uint32), key (utf-8), padding to 8, value (double)
+
+Only the owning process writes a file, appending keys and updating values
+in place, and it writes an entry before publishing it in the header, so
+readers in other processes need no locks.  ``/metrics`` sums the files of
+every process into the Prometheus text format.  ``entrypoint.sh`` clears
+the directory before the workers start.
+
+The state of the database connection pools is sampled after each request;
+their gauges are set rather than added to, as the pool reports absolute
+sizes.
+"""
+import bisect
+import glob
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+from .queries import observe_queries
+
+HEADER = struct.Struct('=I4x')
+KEY_LENGTH = struct.Struct('=I')
+VALUE = struct.Struct('=d')
+INITIAL_SIZE = 64 * 1024
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'foodgram_http_requests_total': (
+        'counter', 'Requests by route, method and status.', None),
+    'foodgram_http_request_duration_seconds': (
+        'histogram', 'Request latency by route.', DURATION_BUCKETS),
+    'foodgram_http_response_size_bytes': (
+        'histogram', 'Response body size by route.', SIZE_BUCKETS),
+    'foodgram_db_queries_per_request': (
+        'histogram', 'SQL statements per request by route.', QUERY_BUCKETS),
+    'foodgram_db_duration_seconds': (
+        'histogram', 'SQL time per request by route.', DURATION_BUCKETS),
+    'foodgram_cache_requests_total': (
+        'counter', 'Cache lookups by cache and result.', None),
+    'foodgram_http_requests_in_flight': (
+        'gauge', 'Requests being served.', None),
+    'foodgram_db_pool_connections': (
+        'gauge', 'Pooled database connections by state.', None),
+    'foodgram_db_pool_max_connections': (
+        'gauge', 'Largest size the connection pools may grow to.', None),
+    'foodgram_db_pool_requests_waiting': (
+        'gauge', 'Requests waiting for a pooled connection.', None),
+    'foodgram_db_pool_wait_seconds_total': (
+        'counter', 'Time spent waiting for a pooled connection.', None),
+    'foodgram_db_pool_timeouts_total': (
+        'counter', 'Requests that got no pooled connection in time.', None),
+    'foodgram_db_pool_connections_lost_total': (
+        'counter', 'Pooled connections found broken and replaced.', None),
+}
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class MmapDict:
+    """Doubles by string key in a file that only this process writes."""
+
+    def __init__(self, path, reset=False):
+        self._lock = threading.Lock()
+        self._file = open(path, 'w+b' if reset else 'a+b')
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            size = INITIAL_SIZE
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._used = HEADER.unpack_from(self._map)[0] or HEADER.size
+        self._positions = {
+            key: position
+            for key, position, _ in entries(self._map, self._used)}
+
+    def add(self, key, amount):
+        with self._lock:
+            position = self._position(key)
+            value = VALUE.unpack_from(self._map, position)[0]
+            VALUE.pack_into(self._map, position, value + amount)
+
+    def set(self, key, value):
+        with self._lock:
+            VALUE.pack_into(self._map, self._position(key), value)
+
+    def _position(self, key):
+        position = self._positions.get(key)
+        if position is None:
+            position = self._insert(key)
+        return position
+
+    def _insert(self, key):
+        encoded = key.encode()
+        position = self._used + _padded(KEY_LENGTH.size + len(encoded))
+        used = position + VALUE.size
+        if used > len(self._map):
+            size = len(self._map)
+            while used > size:
+                size *= 2
+            self._map.close()
+            self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+        KEY_LENGTH.pack_into(self._map, self._used, len(encoded))
+        self._map[self._used + KEY_LENGTH.size:
+                  self._used + KEY_LENGTH.size + len(encoded)] = encoded
+        VALUE.pack_into(self._map, position, 0.0)
+        # Published last, so readers never see a half-written entry
+        HEADER.pack_into(self._map, 0, used)
+        self._used = used
+        self._positions[key] = position
+        return position
+
+
+def _padded(size):
+    return (size + 7) // 8 * 8
+
+
+def entries(buffer, used):
+    """Yield ``(key, value position, value)`` of the entries in ``buffer``."""
+    offset = HEADER.size
+    while offset < used:
+        length = KEY_LENGTH.unpack_from(buffer, offset)[0]
+        key = bytes(buffer[offset + KEY_LENGTH.size:
+                           offset + KEY_LENGTH.size + length]).decode()
+        position = offset + _padded(KEY_LENGTH.size + length)
+        yield key, position, VALUE.unpack_from(buffer, position)[0]
+        offset = position + VALUE.size
+
+
+def read(path):
+    with open(path, 'rb') as source:
+        data = source.read()
+    if len(data) < HEADER.size:
+        return []
+    return [(key, value) for key, _, value
+            in entries(data, HEADER.unpack_from(data)[0])]
+
+
+def sample_key(name, labels):
+    return _sample_key(name, tuple(sorted(labels.items())))
+
+
+@lru_cache(maxsize=4096)
+def _sample_key(name, labels):
+    # Routes, methods and statuses repeat, so keys are encoded once
+    return json.dumps([name, labels], ensure_ascii=False)
+
+
+class Store:
+    """This process's counter and gauge files."""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        pid = os.getpid()
+        self.pid = pid
+        self.directory = directory
+        self.counters = MmapDict(os.path.join(directory, f'counter_{pid}.db'))
+        # A reused pid must not inherit the gauges of a dead process
+        self.gauges = MmapDict(os.path.join(directory, f'gauge_{pid}.db'),
+                               reset=True)
+
+    def inc(self, name, labels, amount=1):
+        self.counters.add(sample_key(name, labels), amount)
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        index = bisect.bisect_left(buckets, value)
+        bound = buckets[index] if index < len(buckets) else math.inf
+        self.counters.add(
+            sample_key(f'{name}_bucket', {**labels, 'le': bound}), 1)
+        self.counters.add(sample_key(f'{name}_sum', labels), value)
+        self.counters.add(sample_key(f'{name}_count', labels), 1)
+
+    def gauge(self, name, labels, amount):
+        self.gauges.add(sample_key(name, labels), amount)
+
+    def set_gauge(self, name, labels, value):
+        self.gauges.set(sample_key(name, labels), value)
+
+
+def get_store():
+    """Return the store of this process, opening it after a fork."""
+    global _store
+    store = _store
+    if (store is None or store.pid != os.getpid()
+            or store.directory != settings.METRICS_DIR):
+        with _store_lock:
+            store = _store
+            if (store is None or store.pid != os.getpid()
+                    or store.directory != settings.METRICS_DIR):
+                store = _store = Store(settings.METRICS_DIR)
+    return store
+
+
+def record_cache(cache, hit):
+    if settings.METRICS:
+        get_store().inc('foodgram_cache_requests_total',
+                        {'cache': cache, 'result': 'hit' if hit else 'miss'})
+
+
+def record_pool(store, database, pool):
+    """Sample the state of ``pool`` and what happened since the last one."""
+    stats = pool.pop_stats()
+    labels = {'database': database}
+    idle = stats.get('pool_available', 0)
+    store.set_gauge('foodgram_db_pool_connections',
+                    {**labels, 'state': 'idle'}, idle)
+    store.set_gauge('foodgram_db_pool_connections',
+                    {**labels, 'state': 'used'},
+                    stats.get('pool_size', 0) - idle)
+    store.set_gauge('foodgram_db_pool_max_connections', labels,
+                    stats.get('pool_max', 0))
+    store.set_gauge('foodgram_db_pool_requests_waiting', labels,
+                    stats.get('requests_waiting', 0))
+    for name, value in (
+            ('foodgram_db_pool_wait_seconds_total',
+             stats.get('requests_wait_ms', 0) / 1000),
+            ('foodgram_db_pool_timeouts_total',
+             stats.get('requests_errors', 0)),
+            ('foodgram_db_pool_connections_lost_total',
+             stats.get('connections_lost', 0) + stats.get('returns_bad', 0))):
+        if value:
+            store.inc(name, labels, value)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect(directory):
+    """Sum the samples of every process by key."""
+    totals = defaultdict(float)
+    for path in glob.glob(os.path.join(directory, '*.db')):
+        kind, _, pid = os.path.basename(path)[:-3].partition('_')
+        if kind == 'gauge' and not _alive(int(pid)):
+            continue
+        for key, value in read(path):
+            totals[key] += value
+    return totals
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_label_value(value)}"'
+                          for name, value in labels) + '}'
+
+
+def _label_value(value):
+    if isinstance(value, float):
+        return _format_value(value)
+    return (str(value).replace('\\', r'\\').replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def exposition(totals):
+    """Render summed samples in the Prometheus text format."""
+    samples = defaultdict(dict)
+    for key, value in totals.items():
+        name, labels = json.loads(key)
+        samples[name][tuple(map(tuple, labels))] = value
+
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind != 'histogram':
+            for labels, value in sorted(samples[name].items()):
+                lines.append(f'{name}{_format_labels(labels)} '
+                             f'{_format_value(value)}')
+            continue
+        # Buckets are stored per bound and exposed cumulatively
+        by_labels = defaultdict(dict)
+        for labels, value in samples[f'{name}_bucket'].items():
+            bound = dict(labels)['le']
+            by_labels[tuple(item for item in labels if item[0] != 'le')][
+                bound] = value
+        for labels in sorted(samples[f'{name}_count']):
+            counts = by_labels[labels]
+            cumulative = 0
+            for bound in (*buckets, math.inf):
+                cumulative += counts.get(bound, 0)
+                lines.append(
+                    f'{name}_bucket'
+                    f'{_format_labels((*labels, ("le", float(bound))))} '
+                    f'{_format_value(cumulative)}')
+            lines.append(f'{name}_sum{_format_labels(labels)} '
+                         f'{_format_value(samples[f"{name}_sum"][labels])}')
+            lines.append(f'{name}_count{_format_labels(labels)} '
+                         f'{_format_value(samples[f"{name}_count"][labels])}')
+    return '\n'.join(lines) + '\n'
+
+
+class _QueryCounter:
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.pooled = [alias for alias in connections
+                       if connections.settings[alias]['OPTIONS'].get('pool')]
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        store = get_store()
+        store.gauge('foodgram_http_requests_in_flight', {}, 1)
+        started = time.perf_counter()
+        try:
+            with observe_queries(_QueryCounter()) as queries:
+                response = self.get_response(request)
+        finally:
+            store.gauge('foodgram_http_requests_in_flight', {}, -1)
+        return self.finish(store, request, response, queries, started)
+
+    async def __acall__(self, request):
+        store = get_store()
+        store.gauge('foodgram_http_requests_in_flight', {}, 1)
+        started = time.perf_counter()
+        try:
+            with observe_queries(_QueryCounter()) as queries:
+                response = await self.get_response(request)
+        finally:
+            store.gauge('foodgram_http_requests_in_flight', {}, -1)
+        return self.finish(store, request, response, queries, started)
+
+    def finish(self, store, request, response, queries, started):
+        duration = time.perf_counter() - started
+        match = request.resolver_match
+        route = {'route': match.view_name if match else 'unmatched'}
+        store.inc('foodgram_http_requests_total', {
+            **route, 'method': request.method,
+            'status': str(response.status_code)})
+        store.observe('foodgram_http_request_duration_seconds', route,
+                      duration)
+        store.observe('foodgram_db_queries_per_request', route,
+                      queries.count)
+        store.observe('foodgram_db_duration_seconds', route,
+                      queries.duration)
+        if response.streaming:
+            measure = (self.ameasure_stream if response.is_async
+                       else self.measure_stream)
+            response.streaming_content = measure(
+                store, route, response.streaming_content)
+        else:
+            store.observe('foodgram_http_response_size_bytes', route,
+                          len(response.content))
+        for alias in self.pooled:
+            record_pool(store, alias, connections[alias].pool)
+        return response
+
+    @staticmethod
+    def measure_stream(store, route, chunks):
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+        store.observe('foodgram_http_response_size_bytes', route, size)
+
+    @staticmethod
+    async def ameasure_stream(store, route, chunks):
+        size = 0
+        async for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+        store.observe('foodgram_http_response_size_bytes', route, size)
+
+
+def metrics_view(request):
+    # Internal: the proxy does not route /metrics, and refusing forwarded
+    # requests keeps it private should it ever do so
+    if not settings.METRICS or 'HTTP_X_FORWARDED_FOR' in request.META:
+        raise Http404
+    return HttpResponse(exposition(collect(settings.METRICS_DIR)),
+                        content_type=CONTENT_TYPE)
@@ -0,0 +1,228 @@
+import base64
+import hashlib
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import InvalidPage, Paginator
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from core.generations import aget_generation, get_generation
+
+from .replicas import primary
+
+RECIPES_GENERATION = 'recipes'
+
+
+class AsyncPaginator(Paginator):
+    async def acount(self):
+        return await self.object_list.acount()
+
+
+class CachedCountPaginator(AsyncPaginator):
+    """Paginator that reuses the COUNT(*) of an unchanged query.
+
+    The cache key combines the SQL of the query with ``generations``: the
+    recipes generation, bumped whenever recipes change, and for a user the
+    generation bumped by their favorites and carts.  Counts are taken on
+    the primary, as a lagging replica would cache an old count under the
+    new generation.
+    """
+
+    def __init__(self, *args, generations=(RECIPES_GENERATION,), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.generations = generations
+
+    def count_key(self, generations):
+        sql, params = self.object_list.query.sql_with_params()
+        digest = hashlib.md5(
+            f'{sql}{params}'.encode(), usedforsecurity=False).hexdigest()
+        return f'recipe-count:{":".join(map(str, generations))}:{digest}'
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            # Ingredient matches are counted in memory
+            return len(self.object_list)
+        try:
+            key = self.count_key(
+                [get_generation(name) for name in self.generations])
+        except EmptyResultSet:
+            return 0
+        count = cache.get(key)
+        if count is None:
+            with primary():
+                count = self.object_list.count()
+            cache.set(key, count, settings.RECIPE_COUNT_CACHE_TIMEOUT)
+        return count
+
+    async def acount(self):
+        if not isinstance(self.object_list, QuerySet):
+            return len(self.object_list)
+        try:
+            key = self.count_key(
+                [await aget_generation(name) for name in self.generations])
+        except EmptyResultSet:
+            return 0
+        count = await cache.aget(key)
+        if count is None:
+            with primary():
+                count = await self.object_list.acount()
+            await cache.aset(key, count, settings.RECIPE_COUNT_CACHE_TIMEOUT)
+        return count
+
+
+class AsyncPageNumberPagination(PageNumberPagination):
+    """Page numbers, with ``apaginate_queryset`` for the async views."""
+    django_paginator_class = AsyncPaginator
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Counted up front, so the page is not counted synchronously
+        paginator.count = await paginator.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)))
+        self.page.object_list = [
+            item async for item in self.page.object_list]
+
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        return self.page.object_list
+
+
+class RecipePagination(AsyncPageNumberPagination):
+    """Page-number pagination with an opt-in keyset (cursor) mode.
+
+    Passing ``cursor`` (empty for the first page) switches to keyset
+    pagination on ``(date_published, id)``: every page costs the same index
+    range scan and pages do not shift when new recipes are published.
+    Ranked results (search, ingredient matches) always use page numbers,
+    best match first.
+    """
+    cursor_query_param = 'cursor'
+    ordering = ('-date_published', '-id')
+    # Applied before ``ordering`` when annotated
+    rank_annotations = ('search_rank',)
+
+    def django_paginator_class(self, queryset, page_size):
+        # Called like the class it stands for, with the user's counts
+        generations = [RECIPES_GENERATION]
+        if self.request.user.is_authenticated:
+            generations.append(f'{RECIPES_GENERATION}:{self.request.user.pk}')
+        return CachedCountPaginator(queryset, page_size,
+                                    generations=generations)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.order_queryset(queryset, request)
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        return self.cursor_page(list(queryset[:self.cursor_page_size + 1]))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.order_queryset(queryset, request)
+        if not self.cursor_mode:
+            return await super().apaginate_queryset(queryset, request, view)
+        return self.cursor_page(
+            [recipe async for recipe in queryset[:self.cursor_page_size + 1]])
+
+    def order_queryset(self, queryset, request):
+        """Order ``queryset`` for the page, past the cursor in cursor mode."""
+        if not isinstance(queryset, QuerySet):
+            # Ingredient matches come ranked
+            self.cursor_mode = False
+            return queryset
+        # Ranked results have no stable keyset
+        ranks = [f'-{rank}' for rank in self.rank_annotations
+                 if rank in queryset.query.annotations]
+        self.cursor_mode = (self.cursor_query_param in request.query_params
+                            and not ranks)
+        if not self.cursor_mode:
+            return queryset.order_by(*ranks, *self.ordering)
+
+        self.request = request
+        self.cursor_page_size = self.get_page_size(request)
+        self.reverse, self.position = self.decode_cursor(request)
+        queryset = queryset.order_by(*self.ordering)
+        if self.position is None:
+            return queryset
+        date_published, pk = self.position
+        if self.reverse:
+            return queryset.filter(
+                Q(date_published__gt=date_published)
+                | Q(date_published=date_published, id__gt=pk)
+            ).reverse()
+        return queryset.filter(
+            Q(date_published__lt=date_published)
+            | Q(date_published=date_published, id__lt=pk)
+        )
+
+    def cursor_page(self, results):
+        """Trim the one-past-the-page probe and note the neighbours."""
+        has_more = len(results) > self.cursor_page_size
+        results = results[:self.cursor_page_size]
+        if self.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.position is not None
+        self.results = results
+        return results
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+        try:
+            decoded = base64.urlsafe_b64decode(encoded.encode()).decode()
+            reverse, date_published, pk = decoded.split('|')
+            return (reverse == '1',
+                    (datetime.fromisoformat(date_published), int(pk)))
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound('Invalid cursor.')
+
+    def encode_cursor(self, recipe, reverse):
+        position = '|'.join((str(int(reverse)),
+                             recipe.date_published.isoformat(),
+                             str(recipe.pk)))
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            base64.urlsafe_b64encode(position.encode()).decode())
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if not self.has_next or not self.results:
+            return None
+        return self.encode_cursor(self.results[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super().get_previous_link()
+        if not self.has_previous or not self.results:
+            return None
+        return self.encode_cursor(self.results[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
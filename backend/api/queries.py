@@ -0,0 +1,43 @@
+"""Observers of the SQL a request runs, on whichever thread runs it.
+
+``execute_wrapper`` only covers the connections of the calling thread, but
+under ASGI the ORM runs on a worker thread of ``sync_to_async``.  Every
+connection instead gets one permanent wrapper (see ``api.signals``) that
+reports to the observers in a context variable, which ``sync_to_async``
+carries over to the thread running the query.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_observers = ContextVar('query_observers', default=())
+
+
+def dispatch(execute, sql, params, many, context):
+    observers = _observers.get()
+    if not observers:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        for observer in observers:
+            observer(sql, duration)
+
+
+def install(connection):
+    # First, as execute_wrapper() pops the last wrapper on exit and the
+    # connection may open inside one
+    if dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, dispatch)
+
+
+@contextmanager
+def observe_queries(observer):
+    """Call ``observer(sql, duration)`` for each statement in the block."""
+    token = _observers.set((*_observers.get(), observer))
+    try:
+        yield observer
+    finally:
+        _observers.reset(token)
@@ -0,0 +1,132 @@
+"""Read replicas for safe requests, with read-your-writes stickiness.
+
+``ReplicaMiddleware`` picks one of ``DATABASE_REPLICAS`` for each GET,
+HEAD or OPTIONS request and ``ReplicaRouter`` sends that request's reads
+to it; writes, and every query of other requests, go to ``default``.  A
+client whose write succeeded reads from the primary for the next
+``REPLICA_STICKY_SECONDS``, so it sees its own favorites and
+subscriptions while the replicas catch up.  Clients are told apart by
+their token or session cookie, remembered in the shared cache.
+
+Tokens and sessions are always read from the primary, so a token issued
+or a session started a moment ago authenticates at once.  Anonymous
+responses and recipe counts are cached under the generation of the data
+(see ``api.caching`` and ``api.pagination``), so they are read from the
+primary too: a lagging replica would otherwise fill the new generation's
+entry with the old data.
+"""
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework.authtoken.models import Token
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Read from the primary whatever the request
+PRIMARY_MODELS = (Token, Session)
+
+_replica = ContextVar('replica', default=None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if model in PRIMARY_MODELS:
+            return None
+        return _replica.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every database holds the same rows
+        return True
+
+
+@contextmanager
+def primary():
+    """Read from the primary in the ``with`` block."""
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def sticky_key(credentials):
+    if not credentials:
+        return None
+    digest = hashlib.md5(
+        credentials.encode(), usedforsecurity=False).hexdigest()
+    return f'replica-sticky:{digest}'
+
+
+def request_key(request):
+    return sticky_key(request.META.get('HTTP_AUTHORIZATION')
+                      or request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+
+
+def written_keys(request, response):
+    """Keys of a client whose write succeeded, under its new session too."""
+    if response.status_code >= 400:
+        return []
+    keys = [request_key(request)]
+    # A login rotates the session key
+    cookie = response.cookies.get(settings.SESSION_COOKIE_NAME)
+    if cookie is not None:
+        keys.append(sticky_key(cookie.value))
+    return [key for key in keys if key is not None]
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            cache.set_many(dict.fromkeys(written_keys(request, response), 1),
+                           settings.REPLICA_STICKY_SECONDS)
+            return response
+        key = request_key(request)
+        if key is not None and cache.get(key):
+            return self.get_response(request)
+        token = _replica.set(random.choice(settings.DATABASE_REPLICAS))
+        try:
+            return self.get_response(request)
+        finally:
+            _replica.reset(token)
+
+    async def __acall__(self, request):
+        if request.method not in SAFE_METHODS:
+            response = await self.get_response(request)
+            await cache.aset_many(
+                dict.fromkeys(written_keys(request, response), 1),
+                settings.REPLICA_STICKY_SECONDS)
+            return response
+        key = request_key(request)
+        if key is not None and await cache.aget(key):
+            return await self.get_response(request)
+        token = _replica.set(random.choice(settings.DATABASE_REPLICAS))
+        try:
+            return await self.get_response(request)
+        finally:
+            _replica.reset(token)
@@ -1,9 +1,14 @@
 from rest_framework import serializers
 from core.models import (Recipe, Ingredient, RecipeIngredient,
-                         UserProfile, Subscription)
-from core.serializers import Base64ImageField
+                         UserProfile, Subscription, ShoppingListItem)
+from core import ingredient_sets, recipe_search, shopping_list
+from core.images import (AVATAR_VARIANTS, RECIPE_VARIANTS, discard_variants,
+                         schedule_variants)
+from core.serializers import Base64ImageField, ImageVariantsField
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.contrib.auth.password_validation import validate_password
+from .timing import TimedSerializerMixin
 
 User = get_user_model()
 
@@ -11,8 +16,8 @@ User = get_user_model()
 class AvatarMixin:
     def get_avatar(self, obj):
         request = self.context.get('request')
-        if hasattr(obj, 'profile') and obj.profile.avatar:
-            return request.build_absolute_uri(obj.profile.avatar.url)
+        if hasattr(obj, 'profiles') and obj.profiles.avatar:
+            return request.build_absolute_uri(obj.profiles.avatar.url)
         return None
 
 
@@ -22,7 +27,8 @@ class UserProfileSerializer(serializers.ModelSerializer):
         fields = ('avatar',)
 
 
-class UserSerializer(serializers.ModelSerializer, AvatarMixin):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer,
+                     AvatarMixin):
     is_subscribed = serializers.SerializerMethodField()
     avatar = serializers.SerializerMethodField()
 
@@ -32,6 +38,10 @@ class UserSerializer(serializers.ModelSerializer, AvatarMixin):
                   'is_subscribed', 'avatar')
 
     def get_is_subscribed(self, obj):
+        # Annotated by the viewsets to avoid a query per user
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return Subscription.objects.filter(
@@ -81,6 +91,16 @@ class AvatarSerializer(serializers.ModelSerializer):
         model = UserProfile
         fields = ('avatar',)
 
+    def update(self, instance, validated_data):
+        if 'avatar' in validated_data:
+            discard_variants(instance.avatar, instance.avatar_variants)
+            instance.avatar_variants = {}
+        profile = super().update(instance, validated_data)
+        if 'avatar' in validated_data:
+            schedule_variants(profile, 'avatar', 'avatar_variants',
+                              AVATAR_VARIANTS)
+        return profile
+
 
 class SubscriptionSerializer(UserSerializer):
     recipes = serializers.SerializerMethodField()
@@ -92,25 +112,30 @@ class SubscriptionSerializer(UserSerializer):
                   'is_subscribed', 'recipes', 'recipes_count', 'avatar')
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
-        recipes = obj.recipes.all()
-
-        if recipes_limit:
-            try:
-                recipes = recipes[:int(recipes_limit)]
-            except ValueError:
-                pass
+        # Prefetched by the views with the recipes_limit already applied
+        recipes = getattr(obj, 'top_recipes', None)
+        if recipes is None:
+            request = self.context.get('request')
+            recipes_limit = request.query_params.get('recipes_limit')
+            recipes = obj.recipes.all()
+
+            if recipes_limit:
+                try:
+                    recipes = recipes[:int(recipes_limit)]
+                except ValueError:
+                    pass
 
         serializer = RecipeShortSerializer(
             recipes, many=True, context=self.context)
         return serializer.data
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'profiles'):
+            return obj.profiles.recipes_count
         return obj.recipes.count()
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
@@ -139,26 +164,41 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         return data
 
 
-class RecipeShortSerializer(serializers.ModelSerializer):
+class ShoppingListItemSerializer(TimedSerializerMixin,
+                                 serializers.ModelSerializer):
+    id = serializers.IntegerField(source='ingredient.id')
+    name = serializers.CharField(source='ingredient.name')
+    measurement_unit = serializers.CharField(
+        source='ingredient.measurement_unit')
+    amount = serializers.IntegerField(source='total_amount')
+
+    class Meta:
+        model = ShoppingListItem
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
+class RecipeShortSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     ingredients = IngredientInRecipeSerializer(
         source='recipe_ingredients', many=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image',
+                  'is_in_shopping_cart', 'name', 'image', 'image_variants',
                   'text', 'cooking_time')
 
     def validate(self, data):
@@ -170,10 +210,10 @@ class RecipeSerializer(serializers.ModelSerializer):
 
         ingredient_ids = {ingredient.get('id') for ingredient in ingredients}
 
-        existing_ingredients = Ingredient.objects.filter(id__in=ingredient_ids)
-        if len(existing_ingredients) != len(ingredient_ids):
-            missing_ids = ingredient_ids - \
-                set(existing_ingredients.values_list('id', flat=True))
+        existing_ids = set(Ingredient.objects.filter(
+            id__in=ingredient_ids).order_by().values_list('id', flat=True))
+        if len(existing_ids) != len(ingredient_ids):
+            missing_ids = ingredient_ids - existing_ids
             raise serializers.ValidationError(
                 f"Ingredients with ids {missing_ids} do not exist."
             )
@@ -185,18 +225,38 @@ class RecipeSerializer(serializers.ModelSerializer):
 
         return data
 
+    def to_representation(self, instance):
+        author_is_subscribed = getattr(instance, 'author_is_subscribed', None)
+        if author_is_subscribed is not None:
+            instance.author.is_subscribed = author_is_subscribed
+        data = super().to_representation(instance)
+        if 'search' in self.context:
+            data['search_snippet'] = recipe_search.snippet(
+                instance, self.context['search'])
+        coverage = getattr(instance, 'ingredient_coverage', None)
+        if coverage is not None:
+            data['ingredient_coverage'] = round(coverage, 4)
+        return data
+
     def get_is_favorited(self, obj):
+        is_favorited = getattr(obj, 'is_favorited', None)
+        if is_favorited is not None:
+            return is_favorited
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return obj.favorites.filter(user=request.user).exists()
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        is_in_shopping_cart = getattr(obj, 'is_in_shopping_cart', None)
+        if is_in_shopping_cart is not None:
+            return is_in_shopping_cart
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return obj.shopping_carts.filter(user=request.user).exists()
         return False
 
+    @transaction.atomic(savepoint=False)
     def create(self, validated_data):
         ingredients_data = validated_data.pop('recipe_ingredients', [])
 
@@ -204,15 +264,73 @@ class RecipeSerializer(serializers.ModelSerializer):
             validated_data
         )
         self.create_recipe_ingredients(recipe, ingredients_data)
+        ingredient_sets.record_change(recipe.id)
+        schedule_variants(recipe, 'image', 'image_variants', RECIPE_VARIANTS)
 
         return recipe
 
+    @transaction.atomic(savepoint=False)
     def update(self, instance, validated_data):
-        ingredients_data = validated_data.pop('recipe_ingredients', [])
-
-        instance.recipe_ingredients.all().delete()
-        self.create_recipe_ingredients(instance, ingredients_data)
-        return super().update(instance, validated_data)
+        """Write only what differs; an unchanged recipe is not written."""
+        ingredients_data = validated_data.pop('recipe_ingredients', None)
+        changed = [
+            field for field, value in validated_data.items()
+            # A new image is a new file even with the same content
+            if field == 'image' or getattr(instance, field) != value
+        ]
+        ingredients_changed = (
+            ingredients_data is not None
+            and self.update_recipe_ingredients(instance, ingredients_data))
+        if not changed and not ingredients_changed:
+            return instance
+
+        for field in changed:
+            setattr(instance, field, validated_data[field])
+        if 'image' in changed:
+            discard_variants(instance.image, instance.image_variants)
+            instance.image_variants = {}
+            changed.append('image_variants')
+        # Saved even for ingredient changes, to date them
+        instance.save(update_fields=[*changed, 'updated_at'])
+        if 'image' in changed:
+            schedule_variants(instance, 'image', 'image_variants',
+                              RECIPE_VARIANTS)
+        return instance
+
+    def update_recipe_ingredients(self, recipe, ingredients_data):
+        """Turn the recipe's rows into ``ingredients_data``.
+
+        Inserts the new ingredients, deletes the dropped ones and updates
+        the changed amounts; returns whether anything changed.
+        """
+        rows = {row.ingredient_id: row
+                for row in recipe.recipe_ingredients.all()}
+        before = {pk: row.amount for pk, row in rows.items()}
+        after = {int(ingredient['id']): int(ingredient['amount'])
+                 for ingredient in ingredients_data}
+        if after == before:
+            return False
+
+        removed = before.keys() - after.keys()
+        if removed:
+            recipe.recipe_ingredients.filter(
+                ingredient_id__in=removed).delete()
+        changed = [row for pk, row in rows.items()
+                   if pk in after and after[pk] != row.amount]
+        for row in changed:
+            row.amount = after[row.ingredient_id]
+        RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        self.create_recipe_ingredients(recipe, [
+            {'id': pk, 'amount': amount}
+            for pk, amount in after.items() if pk not in rows
+        ])
+
+        # The rows read above are stale now
+        getattr(recipe, '_prefetched_objects_cache', {}).pop(
+            'recipe_ingredients', None)
+        ingredient_sets.record_change(recipe.id)
+        shopping_list.apply_recipe_change(recipe.id, before, after)
+        return True
 
     def create_recipe_ingredients(self, recipe, ingredients_data):
         RecipeIngredient.objects.bulk_create(
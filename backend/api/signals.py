@@ -0,0 +1,40 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import queries
+from .authentication import forget_token
+
+User = get_user_model()
+
+
+def forget_now_and_on_commit(key):
+    # Forgetting again after commit keeps a concurrent request that read
+    # the old row from caching it past the change
+    forget_token(key)
+    transaction.on_commit(lambda: forget_token(key))
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    forget_now_and_on_commit(instance.key)
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, created, update_fields=None,
+                       **kwargs):
+    # Covers password changes and deactivation as well as profile edits
+    if created or (update_fields is not None
+                   and set(update_fields) <= {'last_login'}):
+        return
+    for key in Token.objects.filter(user=instance).values_list(
+            'key', flat=True):
+        forget_now_and_on_commit(key)
+
+
+@receiver(connection_created)
+def observe_connection(sender, connection, **kwargs):
+    queries.install(connection)
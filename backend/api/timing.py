@@ -0,0 +1,242 @@
+"""Per-request SQL and timing instrumentation, enabled by REQUEST_TIMING.
+
+``ServerTimingMiddleware`` observes the request's SQL (see ``api.queries``)
+and reports:
+
+* ``db``: time in SQL and the number of statements,
+* ``serialize``: time in the top-level serializers' ``to_representation``
+  (see ``TimedSerializerMixin``),
+* ``render``: time in the DRF renderer,
+* ``view``: from the view being called to its response being returned,
+* ``total``: the whole request below this middleware.
+
+``db`` overlaps the others, e.g. a lazy relation loaded while serializing
+counts in both.  The numbers go into a ``Server-Timing`` header and one
+``api.timing`` log line per request; requests slower than
+``REQUEST_TIMING_SLOW_MS`` also log their slowest and most repeated
+statements to ``api.timing.slow``, by fingerprint.
+
+Only statements' durations and SQL strings are kept while the request
+runs, without parameters; fingerprints are computed for slow requests
+only.  Queries run while a streaming response is consumed are not seen.
+"""
+import hashlib
+import heapq
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .queries import observe_queries
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger(f'{__name__}.slow')
+
+_current = ContextVar('request_timing', default=None)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_ROWS = re.compile(r'\(\?\)(?:\s*,\s*\(\?\))+')
+_SPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Return ``sql`` with its literals and lists collapsed, and a hash.
+
+    Statements that differ only in their values, the length of an IN list
+    or the number of inserted rows share a fingerprint.
+    """
+    normalized = _STRING.sub('?', sql).replace('%s', '?')
+    normalized = _NUMBER.sub('?', normalized)
+    normalized = _LIST.sub('(?)', normalized)
+    normalized = _ROWS.sub('(?)', normalized)
+    normalized = _SPACE.sub(' ', normalized).strip()
+    digest = hashlib.md5(
+        normalized.encode(), usedforsecurity=False).hexdigest()[:16]
+    return normalized, digest
+
+
+class _Phase:
+    __slots__ = ('timing', 'name', 'started')
+
+    def __init__(self, timing, name):
+        self.timing = timing
+        self.name = name
+
+    def __enter__(self):
+        if self.timing is None or self.name in self.timing.active:
+            # Nested in the same phase, which the outer one already covers
+            self.timing = None
+            return
+        self.timing.active.add(self.name)
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.timing is not None:
+            self.timing.active.discard(self.name)
+            self.timing.add(self.name, time.perf_counter() - self.started)
+
+
+def phase(name):
+    """Time the ``with`` block as ``name`` in the current request, if any."""
+    return _Phase(_current.get(), name)
+
+
+class RequestTiming:
+    """What one request spent; ``record`` observes its queries."""
+
+    def __init__(self, keep):
+        self.keep = keep
+        self.phases = {}
+        self.active = set()
+        self.queries = 0
+        self.db = 0.0
+        # (duration, sequence, sql) of the slowest statements, a min-heap
+        self.slowest = []
+        self.statements = Counter()
+
+    def add(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def record(self, sql, duration):
+        self.queries += 1
+        self.db += duration
+        self.statements[sql] += 1
+        entry = (duration, self.queries, sql)
+        if len(self.slowest) < self.keep:
+            heapq.heappush(self.slowest, entry)
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def header(self):
+        entries = [f'db;dur={self.db * 1000:.1f};desc="{self.queries} '
+                   f'queries"']
+        entries.extend(f'{name};dur={duration * 1000:.1f}'
+                       for name, duration in self.phases.items())
+        return ', '.join(entries)
+
+
+def _coroutine(method):
+    async def hook(*args):
+        return method(*args)
+    return hook
+
+
+class ServerTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            # Plain hooks would each be run on a thread in an async chain
+            self.process_view = _coroutine(self.process_view)
+            self.process_template_response = _coroutine(
+                self.process_template_response)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timing = RequestTiming(settings.REQUEST_TIMING_STATEMENTS)
+        token = _current.set(timing)
+        started = time.perf_counter()
+        try:
+            with observe_queries(timing.record):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing, started)
+
+    async def __acall__(self, request):
+        timing = RequestTiming(settings.REQUEST_TIMING_STATEMENTS)
+        token = _current.set(timing)
+        started = time.perf_counter()
+        try:
+            with observe_queries(timing.record):
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing, started)
+
+    def finish(self, request, response, timing, started):
+        total = time.perf_counter() - started
+        view_started = getattr(request, '_timing_view_started', None)
+        if view_started is not None and 'view' not in timing.phases:
+            timing.add('view', time.perf_counter() - view_started)
+        timing.add('total', total)
+
+        if 'Server-Timing' in response:
+            response['Server-Timing'] += ', ' + timing.header()
+        else:
+            response['Server-Timing'] = timing.header()
+        self.log(request, response, timing, total)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._timing_view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        timing = _current.get()
+        view_started = getattr(request, '_timing_view_started', None)
+        if timing is None or view_started is None:
+            return response
+        started = time.perf_counter()
+        timing.add('view', started - view_started)
+
+        def rendered(response):
+            timing.add('render', time.perf_counter() - started)
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def log(self, request, response, timing, total):
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': timing.queries,
+            'db_ms': round(timing.db * 1000, 1),
+            **{f'{name}_ms': round(duration * 1000, 1)
+               for name, duration in timing.phases.items()},
+        }
+        logger.info(' '.join(f'{key}={value}' for key, value in
+                             fields.items()), extra={'timing': fields})
+        if total * 1000 < settings.REQUEST_TIMING_SLOW_MS:
+            return
+        slowest = [
+            {'ms': round(duration * 1000, 1),
+             **dict(zip(('sql', 'fingerprint'), fingerprint(sql)))}
+            for duration, _, sql in sorted(timing.slowest, reverse=True)
+        ]
+        repeated = [
+            {'count': count,
+             **dict(zip(('sql', 'fingerprint'), fingerprint(sql)))}
+            for sql, count in timing.statements.most_common(
+                settings.REQUEST_TIMING_STATEMENTS) if count > 1
+        ]
+        lines = [f'{request.method} {request.path} took {total * 1000:.1f}ms'
+                 f', {timing.queries} queries in {timing.db * 1000:.1f}ms']
+        lines.extend(f'  {entry["ms"]}ms [{entry["fingerprint"]}] '
+                     f'{entry["sql"]}' for entry in slowest)
+        lines.extend(f'  {entry["count"]}x [{entry["fingerprint"]}] '
+                     f'{entry["sql"]}' for entry in repeated)
+        slow_logger.warning('\n'.join(lines), extra={'timing': {
+            **fields, 'slowest': slowest, 'repeated': repeated}})
+
+
+class TimedSerializerMixin:
+    """Count the serializer's output in the request's ``serialize`` time."""
+
+    def to_representation(self, instance):
+        with phase('serialize'):
+            return super().to_representation(instance)
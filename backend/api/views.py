@@ -1,21 +1,41 @@
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, AllowAny
+from rest_framework.permissions import (IsAuthenticatedOrReadOnly, AllowAny,
+                                        IsAuthenticated)
 from rest_framework.exceptions import PermissionDenied
 from core.models import (Recipe, Ingredient, Subscription, UserProfile,
-                         ShoppingCart, Favorite, RecipeIngredient)
-import csv
-from django.db.models import Sum
-from django.http import HttpResponse
+                         ShoppingCart, Favorite, ShoppingListItem)
+from core.images import discard_variants
+from core.ingredient_catalog import (available_encodings, choose_encoding,
+                                     ingredient_catalog)
+from core.ingredient_index import ingredient_index
+from core import ingredient_sets, recipe_search, short_links
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (Count, Exists, F, Max, OuterRef, Prefetch,
+                              Window, aprefetch_related_objects,
+                              prefetch_related_objects)
+from django.db.models.functions import RowNumber
+from django.db.models.functions import Concat, Left, Lower, Substr, Upper
+from django.http import HttpResponse, StreamingHttpResponse
 from django.urls import reverse
-from rest_framework.pagination import PageNumberPagination
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from django.contrib.auth import get_user_model, authenticate
+from .asynchronous import AsyncReadMixin
+from .caching import AnonymousResponseCacheMixin
+from .conditional import ConditionalGetMixin
+from .exports import WRITERS, aiterate
+from .pagination import AsyncPageNumberPagination, RecipePagination
+from .renderers import (CSVRenderer, JSONExportRenderer, PDFRenderer,
+                        PlainTextRenderer)
 from .serializers import (RecipeShortSerializer, UserSerializer,
                           UserCreateSerializer,
                           PasswordChangeSerializer, AvatarSerializer,
                           SubscriptionSerializer, RecipeSerializer,
-                          IngredientSerializer)
+                          IngredientSerializer, ShoppingListItemSerializer)
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
 from django.shortcuts import get_object_or_404
@@ -23,72 +43,343 @@ from django.shortcuts import get_object_or_404
 User = get_user_model()
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+def get_recipes_limit(request):
+    try:
+        limit = int(request.query_params.get('recipes_limit'))
+    except (TypeError, ValueError):
+        return None
+    return max(limit, 0)
+
+
+def top_recipes_prefetch(limit):
+    """Each author's newest ``limit`` recipes as ``top_recipes``.
+
+    One query for all authors: ROW_NUMBER() over each author's recipes,
+    loading only the columns RecipeShortSerializer needs.
+    """
+    recipes = Recipe.objects.only(
+        'id', 'name', 'image', 'image_variants', 'cooking_time', 'author_id'
+    ).order_by('-date_published', '-id')
+    if limit is not None:
+        recipes = recipes.annotate(row_number=Window(
+            RowNumber(),
+            partition_by=F('author_id'),
+            order_by=(F('date_published').desc(), F('id').desc()),
+        )).filter(row_number__lte=limit)
+    return Prefetch('recipes', queryset=recipes, to_attr='top_recipes')
+
+
+def prefetch_top_recipes(authors, limit):
+    prefetch_related_objects(authors, top_recipes_prefetch(limit))
+
+
+def ingredients_version():
+    return tuple(Ingredient.objects.aggregate(
+        count=Count('id'), updated=Max('updated_at')).values())
+
+
+async def aingredients_version():
+    return tuple((await Ingredient.objects.aaggregate(
+        count=Count('id'), updated=Max('updated_at'))).values())
+
+
+def recipe_list_version_fields():
+    return {'count': Count('id'), 'updated': Max('updated_at'),
+            'authors': Max('author__profiles__updated_at')}
+
+
+def recipe_version_fields():
+    return {'updated': Max('updated_at'),
+            'author': Max('author__profiles__updated_at'),
+            'ingredients': Max('recipe_ingredients__ingredient__updated_at')}
+
+
+def subscriptions_version_fields():
+    return {'count': Count('id', distinct=True), 'last': Max('id'),
+            'authors': Max('author__profiles__updated_at'),
+            'recipes': Max('author__recipes__updated_at')}
+
+
+def profile_version(user_id):
+    try:
+        updated = UserProfile.objects.filter(user_id=user_id).values_list(
+            'updated_at', flat=True).first()
+    except (TypeError, ValueError):
+        return None
+    return None if updated is None else (updated,)
+
+
+class IngredientViewSet(AsyncReadMixin, ConditionalGetMixin,
+                        viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [AllowAny]
     pagination_class = None
 
     def get_queryset(self):
-        queryset = Ingredient.objects.all().order_by('name')
-        name = self.request.query_params.get('name', None)
-        if name:
-            # Case-insensitive search by ingredient name
-            queryset = queryset.filter(name__icontains=name)
-        return queryset
-
+        return Ingredient.objects.all().order_by('name')
+
+    def get_list_version(self):
+        return ingredients_version()
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name', None)
+        if not name:
+            since = request.query_params.get('since')
+            if since:
+                return self.catalog_delta(since)
+            if request.accepted_renderer.format == 'json':
+                return self.catalog_response(request)
+            return super().list(request, *args, **kwargs)
+        return self.search_response(
+            request, name, ingredient_index.snapshot())
+
+    async def alist(self, request, *args, **kwargs):
+        name = request.query_params.get('name', None)
+        if not name:
+            return await sync_to_async(self.list)(request, *args, **kwargs)
+        return self.search_response(
+            request, name, await ingredient_index.asnapshot())
+
+    def search_response(self, request, name, snapshot):
+        limit = request.query_params.get('limit')
+        try:
+            limit = max(int(limit), 0) if limit else None
+        except ValueError:
+            limit = None
+
+        def search():
+            # Case-insensitive search answered from the shared snapshot:
+            # prefix matches first, then substring matches
+            ingredients = ingredient_index.search(name, limit=limit)
+            serializer = self.get_serializer(ingredients, many=True)
+            return Response(serializer.data)
 
-class RecipeViewSet(viewsets.ModelViewSet):
+        # The snapshot file versions the results, so no query is needed
+        return self.conditional_response(
+            request, (snapshot.stat.st_ino, snapshot.modified), search)
+
+    def catalog_response(self, request):
+        """Serve the pre-rendered catalog in the best accepted encoding."""
+        catalog = ingredient_catalog.current()
+        encoding = choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''),
+            [encoding for encoding in available_encodings()
+             if encoding in catalog.bodies])
+        response = HttpResponse(catalog.bodies[encoding],
+                                content_type='application/json')
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['ETag'] = catalog.etag(encoding)
+        response['Last-Modified'] = http_date(catalog.modified.timestamp())
+        response['X-Catalog-Version'] = catalog.version
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return get_conditional_response(
+            request, etag=response['ETag'],
+            last_modified=int(catalog.modified.timestamp()),
+            response=response)
+
+    def catalog_delta(self, since):
+        """Rows changed and ids deleted since catalog version ``since``.
+
+        Unknown or expired versions get the whole catalog with ``full``
+        set, telling the client to drop the rows it has.
+        """
+        delta = ingredient_catalog.delta(since)
+        if delta is None:
+            catalog = ingredient_catalog.current()
+            delta = {'version': catalog.version, 'full': True,
+                     'changed': catalog.rows, 'deleted': []}
+        return Response(delta)
+
+
+class RecipeViewSet(AsyncReadMixin, AnonymousResponseCacheMixin,
+                    ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = RecipePagination
+    # These filters only apply to authenticated users
+    cache_ignored_params = ('is_favorited', 'is_in_shopping_cart')
 
     def get_queryset(self):
         queryset = Recipe.objects.all().order_by('-date_published')
         params = self.request.query_params
+        user = self.request.user
+
+        if self.action in ('list', 'retrieve', 'update', 'partial_update'):
+            queryset = queryset.select_related(
+                'author', 'author__profiles'
+            ).prefetch_related('recipe_ingredients__ingredient')
+        if self.action in ('update', 'partial_update'):
+            # Hold the row so no other edit lands between check and write
+            queryset = queryset.select_for_update(of=('self',))
+
+        if user.is_authenticated:
+            queryset = queryset.annotate(
+                is_favorited=Exists(Favorite.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+                author_is_subscribed=Exists(Subscription.objects.filter(
+                    user=user, author=OuterRef('author'))),
+            )
 
         # Filter by author
         author_id = params.get('author')
         if author_id:
             queryset = queryset.filter(author_id=author_id)
 
-        if self.request.user.is_authenticated:
+        # Ranked full-text search, ordered by rank by the pagination
+        search = params.get('search', '').strip()
+        if search and self.action == 'list':
+            queryset = recipe_search.search(
+                queryset, search,
+                limit=settings.RECIPE_SEARCH_FALLBACK_LIMIT)
+
+        if user.is_authenticated:
             # Filter by shopping cart
             is_in_shopping_cart = params.get('is_in_shopping_cart')
-            if is_in_shopping_cart is not None:
-                if is_in_shopping_cart == '1':
-                    queryset = queryset.filter(
-                        shopping_carts__user=self.request.user)
-                elif is_in_shopping_cart == '0':
-                    queryset = queryset.exclude(
-                        shopping_carts__user=self.request.user)
+            if is_in_shopping_cart in ('0', '1'):
+                queryset = queryset.filter(
+                    is_in_shopping_cart=is_in_shopping_cart == '1')
 
             # Filter by favorites
             is_favorited = params.get('is_favorited')
-            if is_favorited is not None:
-                if is_favorited == '1':
-                    queryset = queryset.filter(
-                        favorites__user=self.request.user)
-                elif is_favorited == '0':
-                    queryset = queryset.exclude(
-                        favorites__user=self.request.user)
+            if is_favorited in ('0', '1'):
+                queryset = queryset.filter(
+                    is_favorited=is_favorited == '1')
+
+        # Recipes by the ingredients they use, after the other filters as
+        # ``best`` keeps only the top matches; ranked in memory, so the
+        # pagination only fetches the page
+        ingredient_ids = [
+            int(value) for value in params.get('ingredients', '').split(',')
+            if value.strip().isdigit()
+        ]
+        if ingredient_ids and self.action == 'list':
+            match = params.get('match')
+            queryset = ingredient_sets.match_recipes(
+                queryset, ingredient_ids,
+                match if match in ingredient_sets.MATCH_MODES else 'all',
+                limit=settings.RECIPE_INGREDIENT_MATCH_LIMIT)
+
+        return queryset
+
+    def get_list_queryset(self):
+        recipes = self.filter_queryset(self.get_queryset())
+        if isinstance(recipes, ingredient_sets.RecipeMatches):
+            # The matches are among its recipes, whose version covers them
+            recipes = recipes.queryset
+        return recipes.order_by()
 
-        return queryset.distinct()
+    def get_list_version(self):
+        recipes = self.get_list_queryset()
+        return (*recipes.aggregate(**recipe_list_version_fields()).values(),
+                *ingredients_version())
+
+    async def aget_list_version(self):
+        recipes = self.get_list_queryset()
+        version = await recipes.aaggregate(**recipe_list_version_fields())
+        return (*version.values(), *await aingredients_version())
+
+    def get_object_version(self):
+        try:
+            version = Recipe.objects.filter(pk=self.kwargs['pk']).aggregate(
+                **recipe_version_fields())
+        except (TypeError, ValueError):
+            return None
+        if version['updated'] is None:
+            return None
+        return tuple(version.values())
+
+    async def aget_object_version(self):
+        try:
+            version = await Recipe.objects.filter(
+                pk=self.kwargs['pk']).aaggregate(**recipe_version_fields())
+        except (TypeError, ValueError):
+            return None
+        if version['updated'] is None:
+            return None
+        return tuple(version.values())
+
+    async def alist(self, request, *args, **kwargs):
+        params = request.query_params
+        if params.get('search', '').strip() or params.get('ingredients'):
+            # Ranking and ingredient matching query while filtering
+            return await sync_to_async(self.list)(request, *args, **kwargs)
+
+        async def page():
+            queryset = self.filter_queryset(self.get_queryset())
+            recipes = await self.paginator.apaginate_queryset(
+                queryset, request, view=self)
+            serializer = self.get_serializer(recipes, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        async def build():
+            return await self.aconditional_response(
+                request, await self.aget_list_version(), page)
+
+        return await self.acached_response(request, build)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        async def detail():
+            recipe = await self.aget_object()
+            return Response(self.get_serializer(recipe).data)
+
+        async def build():
+            return await self.aconditional_response(
+                request, await self.aget_object_version(), detail)
+
+        return await self.acached_response(request, build)
+
+    def update(self, request, *args, **kwargs):
+        """Apply the edit only if ``If-Match`` still matches the recipe."""
+        partial = kwargs.pop('partial', False)
+        with transaction.atomic():
+            recipe = self.get_object()
+            # Before the preconditions, so a stale If-Match is not a 412
+            if recipe.author_id != request.user.id:
+                raise PermissionDenied(
+                    "You do not have permission to edit this recipe.")
+            version = self.get_object_version()
+            response = self.check_preconditions(request, version)
+            if response is not None:
+                return response
+            serializer = self.get_serializer(
+                recipe, data=request.data, partial=partial)
+            serializer.is_valid(raise_exception=True)
+            updated_at = recipe.updated_at
+            self.perform_update(serializer)
+        if recipe.updated_at != updated_at:
+            version = self.get_object_version()
+        response = Response(serializer.data)
+        self.set_validators(request, response, version)
+        return response
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        recipe = serializer.save(author=self.request.user)
+        # Nobody can have saved it yet, and no one subscribes to themselves
+        recipe.is_favorited = recipe.is_in_shopping_cart = False
+        recipe.author_is_subscribed = False
+        self.prefetch_ingredients(recipe)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         if self.request.method in ['POST', 'PATCH']:
             context['ingredients'] = self.request.data.get('ingredients', [])
+        search = self.request.query_params.get('search', '').strip()
+        if search and self.action == 'list':
+            context['search'] = search
         return context
 
     def perform_update(self, serializer):
-        if self.get_object().author != self.request.user:
-            raise PermissionDenied(
-                "You do not have permission to edit this recipe.")
         serializer.save()
+        self.prefetch_ingredients(serializer.instance)
+
+    def prefetch_ingredients(self, recipe):
+        # The rows the save wrote, for the response; no query if unchanged
+        prefetch_related_objects([recipe], 'recipe_ingredients__ingredient')
 
     def perform_destroy(self, instance):
         if instance.author != self.request.user:
@@ -102,9 +393,9 @@ class RecipeViewSet(viewsets.ModelViewSet):
         url_path='get-link'
     )
     def get_link(self, request, pk=None):
-        if Recipe.objects.filter(id=pk).exists():
+        if pk.isdecimal() and int(pk) in short_links.live_recipes.current():
             short_link_url = request.build_absolute_uri(
-                reverse('short-link', args=[pk])
+                reverse('short-link', args=[short_links.encode(int(pk))])
             )
             return Response({'short-link': short_link_url})
         return Response(
@@ -113,8 +404,13 @@ class RecipeViewSet(viewsets.ModelViewSet):
             status=status.HTTP_404_NOT_FOUND
         )
 
+    @transaction.atomic
     def handle_add_or_remove(self, request, pk, model, error_message):
-        """Handle adding or removing a recipe from a specified model."""
+        """Handle adding or removing a recipe from a specified model.
+
+        Runs in one transaction with the shopping list totals that the
+        cart signals maintain.
+        """
         recipe = self.get_object()
 
         if request.method == 'POST':
@@ -156,36 +452,77 @@ class RecipeViewSet(viewsets.ModelViewSet):
             error_message='Recipe already in favorites'
         )
 
-    @action(detail=False, methods=['get'])
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated],
+        renderer_classes=[CSVRenderer, PlainTextRenderer,
+                          JSONExportRenderer, PDFRenderer]
+    )
     def download_shopping_cart(self, request):
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__shopping_carts__user=request.user
-        ).values(
-            'ingredient__name',
+        """Stream the cart as ``?format=csv|txt|json|pdf`` (CSV default)."""
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user,
+            total_amount__gt=0
+        ).annotate(
+            display_name=Concat(
+                Upper(Left('ingredient__name', 1)),
+                Lower(Substr('ingredient__name', 2))
+            ),
+        ).order_by('ingredient__name').values_list(
+            'display_name',
+            'total_amount',
             'ingredient__measurement_unit'
-        ).annotate(total_amount=Sum('amount')).order_by('ingredient__name')
+        )
+        rows = ingredients.iterator(
+            chunk_size=settings.SHOPPING_CART_EXPORT_CHUNK_SIZE)
+
+        renderer = request.accepted_renderer
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f'; charset={renderer.charset}'
+        content = WRITERS[renderer.format](rows)
+        if settings.ASYNC_READS:
+            content = aiterate(content)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_cart.{renderer.format}"')
+        return response
 
-        response = HttpResponse(content_type='text/csv; charset=utf-8-sig')
-        response['Content-Disposition'] = 'attachment; \
-            filename="shopping_cart.csv"'
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated]
+    )
+    def shopping_list(self, request):
+        items = ShoppingListItem.objects.filter(
+            user=request.user,
+            total_amount__gt=0
+        ).select_related('ingredient').order_by('ingredient__name')
+        serializer = ShoppingListItemSerializer(items, many=True)
+        return Response(serializer.data)
 
-        writer = csv.writer(response)
-        writer.writerow(['Ingredient', 'Amount', 'Unit'])
 
-        for item in ingredients:
-            writer.writerow([
-                item['ingredient__name'].capitalize(),
-                item['total_amount'],
-                item['ingredient__measurement_unit']
-            ])
+class UserViewSet(AsyncReadMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = User.objects.all()
+    serializer_class = UserSerializer
+    pagination_class = AsyncPageNumberPagination
 
-        return response
+    def get_queryset(self):
+        queryset = User.objects.select_related('profiles').order_by('id')
+        user = self.request.user
+        if self.action in ('list', 'retrieve') and user.is_authenticated:
+            queryset = queryset.annotate(is_subscribed=Exists(
+                Subscription.objects.filter(user=user, author=OuterRef('pk'))
+            ))
+        return queryset
 
+    def get_list_version(self):
+        return tuple(self.get_queryset().order_by().aggregate(
+            count=Count('id'), updated=Max('profiles__updated_at')).values())
 
-class UserViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.all()
-    serializer_class = UserSerializer
-    pagination_class = PageNumberPagination
+    def get_object_version(self):
+        return profile_version(self.kwargs['pk'])
 
     def get_permissions(self):
         # Allow list and retrieve actions for all users
@@ -205,8 +542,9 @@ class UserViewSet(viewsets.ModelViewSet):
         permission_classes=[permissions.IsAuthenticated]
     )
     def me(self, request):
-        serializer = self.get_serializer(request.user)
-        return Response(serializer.data)
+        return self.conditional_response(
+            request, profile_version(request.user.pk),
+            lambda: Response(self.get_serializer(request.user).data))
 
     @action(
         detail=False,
@@ -237,6 +575,8 @@ class UserViewSet(viewsets.ModelViewSet):
 
         if request.method == 'DELETE':
             if profile.avatar:
+                discard_variants(profile.avatar, profile.avatar_variants)
+                profile.avatar_variants = {}
                 profile.avatar.delete()
                 return Response(status=status.HTTP_204_NO_CONTENT)
             return Response(
@@ -258,13 +598,47 @@ class UserViewSet(viewsets.ModelViewSet):
     def subscriptions(self, request):
         subscriptions = request.user.subscriptions.select_related(
             'author', 'author__profiles'
-        ).prefetch_related('author__recipes')
+        )
+        version = tuple(subscriptions.order_by().aggregate(
+            **subscriptions_version_fields()).values())
+
+        def render():
+            page = self.paginate_queryset(subscriptions)
+            authors = [subscription.author for subscription in page]
+            for author in authors:
+                author.is_subscribed = True
+            prefetch_top_recipes(authors, get_recipes_limit(request))
+            serializer = SubscriptionSerializer(
+                authors, many=True, context={'request': request})
+            return self.get_paginated_response(serializer.data)
+
+        return self.conditional_response(request, version, render)
+
+    async def asubscriptions(self, request):
+        subscriptions = request.user.subscriptions.select_related(
+            'author', 'author__profiles'
+        )
+        version = tuple((await subscriptions.order_by().aaggregate(
+            **subscriptions_version_fields())).values())
+
+        async def render():
+            page = await self.paginator.apaginate_queryset(
+                subscriptions, request, view=self)
+            authors = [subscription.author for subscription in page]
+            for author in authors:
+                author.is_subscribed = True
+            await aprefetch_related_objects(
+                authors, top_recipes_prefetch(get_recipes_limit(request)))
+            serializer = SubscriptionSerializer(
+                authors, many=True, context={'request': request})
+            if all(hasattr(author, 'profiles') for author in authors):
+                data = serializer.data
+            else:
+                # Authors without a profile have their recipes counted
+                data = await sync_to_async(lambda: serializer.data)()
+            return self.get_paginated_response(data)
 
-        authors = [subscription.author for subscription in subscriptions]
-        page = self.paginate_queryset(authors)
-        serializer = SubscriptionSerializer(
-            page, many=True, context={'request': request})
-        return self.get_paginated_response(serializer.data)
+        return await self.aconditional_response(request, version, render)
 
     @action(
         detail=True,
@@ -283,8 +657,7 @@ class UserViewSet(viewsets.ModelViewSet):
 
             subscription, created = Subscription.objects.get_or_create(
                 user=request.user,
-                author=author,
-                defaults={'recipes_count': author.recipes.count()}
+                author=author
             )
 
             if not created:
@@ -293,6 +666,8 @@ class UserViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
+            author.is_subscribed = True
+            prefetch_top_recipes([author], get_recipes_limit(request))
             serializer = SubscriptionSerializer(
                 author,
                 context={'request': request}
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import os
 import sys
+import tempfile
 
 from pathlib import Path
 
@@ -63,6 +64,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.timing.ServerTimingMiddleware',
+    'api.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -107,17 +111,154 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'idk_foodgram_password'),
         'HOST': os.getenv('DB_HOST', 'db'),
         'PORT': os.getenv('DB_PORT', '5432'),
+        # Connections are checked before a request gets one
+        'CONN_HEALTH_CHECKS': True,
     }
 }
+# Each worker keeps a pool of connections (psycopg 3), so requests skip the
+# connection handshake; a request waits up to DB_POOL_TIMEOUT seconds for
+# a free one.  DB_POOL=0 keeps a persistent connection per thread instead,
+# e.g. behind PgBouncer.
+if os.getenv('DB_POOL', '1') == '1':
+    DATABASES['default']['OPTIONS'] = {'pool': {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+    }}
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(
+        os.getenv('DB_CONN_MAX_AGE', 60))
+
+# Read replicas as comma-separated host[:port], otherwise configured like
+# the primary; safe requests read from one of them, and clients read
+# their own writes from the primary for REPLICA_STICKY_SECONDS.
+DATABASE_REPLICAS = []
+for number, address in enumerate(
+        filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), 1):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'], 'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{number}')
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', 10))
+
 if 'test' in sys.argv and DEBUG:
-    DATABASES['default'] = {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': 'mydatabase'
+    # The replica is a separate database, for the tests of the routing
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': 'mydatabase'
+        },
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': 'replica'
+        },
+    }
+    DATABASE_REPLICAS = []
+
+# Memory-mapped snapshot shared by all workers for ingredient autocomplete.
+INGREDIENT_INDEX_PATH = os.getenv(
+    'INGREDIENT_INDEX_PATH',
+    os.path.join(tempfile.gettempdir(), 'foodgram-ingredients.idx')
+)
+INGREDIENT_CATALOG_DIR = os.getenv(
+    'INGREDIENT_CATALOG_DIR',
+    os.path.join(tempfile.gettempdir(), 'foodgram-catalog')
+)
+# Catalog versions kept as a base for ?since= deltas
+INGREDIENT_CATALOG_HISTORY = int(os.getenv('INGREDIENT_CATALOG_HISTORY', 20))
+
+# Cached values are invalidated through generation counters, so every
+# worker must see the same cache, with atomic add and incr. The file cache
+# is shared by the workers of one host and locks those two; point
+# CACHE_BACKEND/CACHE_LOCATION at Redis or Memcached when running on
+# several hosts. Tests use the local-memory cache.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'core.cache.AtomicFileBasedCache'),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'foodgram-cache')),
+    }
+}
+if CACHES['default']['BACKEND'] == 'core.cache.AtomicFileBasedCache':
+    # Responses, counts, tokens and locks; the file cache keeps 300
+    # entries by default
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 100_000)),
+    }
+if 'test' in sys.argv:
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 
+# Anonymous recipe responses; invalidated by generation counters.
+RECIPE_RESPONSE_CACHE_TIMEOUT = int(
+    os.getenv('RECIPE_RESPONSE_CACHE_TIMEOUT', 600))
+# Seconds a cache miss may hold the rebuild lock, and how often the
+# requests waiting on it poll for the result.
+RESPONSE_CACHE_LOCK_TIMEOUT = float(
+    os.getenv('RESPONSE_CACHE_LOCK_TIMEOUT', 5))
+RESPONSE_CACHE_POLL_INTERVAL = float(
+    os.getenv('RESPONSE_CACHE_POLL_INTERVAL', 0.05))
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploaded images
+IMAGE_MIN_SIDE = int(os.getenv('IMAGE_MIN_SIDE', 16))
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', 40_000_000))
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', 2048))
+# Variants render on a thread pool; tests render them synchronously.
+IMAGE_VARIANTS_ASYNC = (os.getenv('IMAGE_VARIANTS_ASYNC', '1') == '1'
+                        and 'test' not in sys.argv)
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', 2))
+
+# Ingredient files are loaded in chunks of this many rows; admin imports
+# run on a background thread, except in tests.
+INGREDIENT_LOAD_CHUNK_SIZE = int(os.getenv('INGREDIENT_LOAD_CHUNK_SIZE', 2000))
+INGREDIENT_LOAD_ASYNC = (os.getenv('INGREDIENT_LOAD_ASYNC', '1') == '1'
+                         and 'test' not in sys.argv)
+
+# Records per query and per transaction of export_recipes/import_recipes.
+RECIPE_TRANSFER_BATCH_SIZE = int(os.getenv('RECIPE_TRANSFER_BATCH_SIZE', 1000))
+
+# Prometheus metrics on /metrics, written by every worker to its own
+# memory-mapped files in METRICS_DIR and summed on scrape.
+METRICS = (os.getenv('METRICS', '1') == '1'
+           and 'test' not in sys.argv)
+METRICS_DIR = os.getenv(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'foodgram-metrics'))
+
+# Server-Timing headers and per-request SQL/timing logs; requests slower
+# than REQUEST_TIMING_SLOW_MS also log their slowest and most repeated
+# statements.
+REQUEST_TIMING = os.getenv('REQUEST_TIMING', '0') == '1'
+REQUEST_TIMING_SLOW_MS = float(os.getenv('REQUEST_TIMING_SLOW_MS', 500))
+REQUEST_TIMING_STATEMENTS = int(os.getenv('REQUEST_TIMING_STATEMENTS', 3))
+
+# Serve the read endpoints from coroutines (see api.asynchronous); set by
+# backend.asgi, as under WSGI every async view would run its own event loop.
+ASYNC_READS = os.getenv('ASYNC_READS', '0') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -142,7 +283,7 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -151,6 +292,33 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
 }
 
+# Rows fetched per server-side cursor round trip by the cart export.
+SHOPPING_CART_EXPORT_CHUNK_SIZE = int(
+    os.getenv('SHOPPING_CART_EXPORT_CHUNK_SIZE', 2000))
+
+# Seconds a recipe feed COUNT(*) may be reused while nothing changes.
+RECIPE_COUNT_CACHE_TIMEOUT = int(os.getenv('RECIPE_COUNT_CACHE_TIMEOUT', 300))
+
+# Best matches the in-process search fallback (non-PostgreSQL) returns.
+RECIPE_SEARCH_FALLBACK_LIMIT = int(
+    os.getenv('RECIPE_SEARCH_FALLBACK_LIMIT', 1000))
+
+# Best matches the ingredient-set ranking (?ingredients=&match=best) keeps.
+RECIPE_INGREDIENT_MATCH_LIMIT = int(
+    os.getenv('RECIPE_INGREDIENT_MATCH_LIMIT', 1000))
+
+# Seconds browsers and the proxy may keep a short link's redirect, and its
+# 404 when the recipe does not exist.
+SHORT_LINK_MAX_AGE = int(os.getenv('SHORT_LINK_MAX_AGE', 300))
+SHORT_LINK_MISS_MAX_AGE = int(os.getenv('SHORT_LINK_MISS_MAX_AGE', 60))
+
+# Authenticated tokens are kept in each process for TOKEN_AUTH_LOCAL_TIMEOUT
+# seconds, which bounds how long another worker honours a revoked token,
+# and in the shared cache for TOKEN_AUTH_CACHE_TIMEOUT.
+TOKEN_AUTH_CACHE_TIMEOUT = int(os.getenv('TOKEN_AUTH_CACHE_TIMEOUT', 300))
+TOKEN_AUTH_LOCAL_TIMEOUT = int(os.getenv('TOKEN_AUTH_LOCAL_TIMEOUT', 5))
+TOKEN_AUTH_LRU_SIZE = int(os.getenv('TOKEN_AUTH_LRU_SIZE', 10000))
+
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
 ]
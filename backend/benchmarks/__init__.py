@@ -0,0 +1,31 @@
+"""Benchmarks run against a throwaway copy of the configured database.
+
+Run them from ``backend/``, e.g. ``python -m benchmarks.token_auth``.
+"""
+import os
+from contextlib import contextmanager
+
+import django
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """Create a test database like the test runner does, then drop it."""
+    setup_django()
+    from django.db import connection
+    from django.test.utils import (setup_test_environment,
+                                   teardown_test_environment)
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
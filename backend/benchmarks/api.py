@@ -0,0 +1,256 @@
+"""End-to-end throughput and latency of the API routes under load.
+
+Seeds a throwaway database with ``generate_dataset`` and drives the routes
+of ``api.urls`` through Django's test client from ``--workers`` threads,
+``--requests`` requests per endpoint after one warm-up request.  Reports
+throughput, p50/p95/p99 latency and SQL queries per request, can save them
+as JSON and fails when a saved run regressed by more than ``--threshold``::
+
+    python -m benchmarks.api --output before.json
+    python -m benchmarks.api --compare before.json --threshold 0.2
+
+A regression is a p95 above the baseline by more than the threshold, or
+half a query per request more; cache hits make the average vary slightly
+between runs, while a real N+1 adds at least one.
+"""
+import argparse
+import json
+import platform
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from . import test_database
+
+PASSWORD = 'benchmark-password'
+
+
+@dataclass
+class Endpoint:
+    name: str
+    paths: list
+    authenticated: bool = False
+    method: str = 'get'
+    data: dict = field(default_factory=dict)
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(int(round(fraction * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def endpoints(user, author_id, recipe_ids, words, ingredient_ids):
+    return [
+        Endpoint('recipe list', ['/api/recipes/']),
+        Endpoint('recipe list, page 5', ['/api/recipes/?page=5']),
+        Endpoint('recipe list, cursor', ['/api/recipes/?cursor=']),
+        Endpoint('recipe list, author',
+                 [f'/api/recipes/?author={author_id}']),
+        Endpoint('recipe list, favorited',
+                 ['/api/recipes/?is_favorited=1'], authenticated=True),
+        Endpoint('recipe list, in cart',
+                 ['/api/recipes/?is_in_shopping_cart=1'], authenticated=True),
+        Endpoint('recipe list, search',
+                 [f'/api/recipes/?search={word}' for word in words]),
+        Endpoint('recipe list, ingredients', [
+            f'/api/recipes/?ingredients={first},{second}&match=best'
+            for first, second in zip(ingredient_ids, ingredient_ids[1:])]),
+        Endpoint('recipe detail',
+                 [f'/api/recipes/{pk}/' for pk in recipe_ids]),
+        Endpoint('recipe detail, authenticated',
+                 [f'/api/recipes/{pk}/' for pk in recipe_ids],
+                 authenticated=True),
+        Endpoint('subscriptions', ['/api/users/subscriptions/'],
+                 authenticated=True),
+        Endpoint('shopping cart download',
+                 ['/api/recipes/download_shopping_cart/'],
+                 authenticated=True),
+        Endpoint('ingredient search', [
+            f'/api/ingredients/?name={word[:3]}' for word in words]),
+        Endpoint('login', ['/api/auth/token/login/'], method='post',
+                 data={'email': user.email, 'password': PASSWORD}),
+    ]
+
+
+def run(endpoint, requests, workers, token):
+    from django.db import connection, connections
+    from rest_framework.test import APIClient
+
+    timings, queries, errors = [], [], []
+    lock = threading.Lock()
+    remaining = iter(range(requests))
+
+    def request(client, index):
+        path = endpoint.paths[index % len(endpoint.paths)]
+        count = 0
+
+        def counter(execute, sql, params, many, context):
+            nonlocal count
+            count += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = getattr(client, endpoint.method)(
+                path, endpoint.data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        elapsed = time.perf_counter() - started
+        return elapsed, count, response.status_code
+
+    def worker():
+        client = APIClient()
+        if endpoint.authenticated:
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        try:
+            while True:
+                with lock:
+                    index = next(remaining, None)
+                if index is None:
+                    return
+                elapsed, count, status = request(client, index)
+                with lock:
+                    timings.append(elapsed)
+                    queries.append(count)
+                    if status >= 400:
+                        errors.append(status)
+        finally:
+            connections.close_all()
+
+    warm_up = APIClient()
+    if endpoint.authenticated:
+        warm_up.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+    status = request(warm_up, 0)[2]
+    if status >= 400:
+        raise SystemExit(f'{endpoint.name}: {endpoint.paths[0]} answered '
+                         f'{status}')
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    timings.sort()
+    return {
+        'requests': len(timings),
+        'errors': len(errors),
+        'throughput': len(timings) / wall,
+        'p50': percentile(timings, 0.50) * 1000,
+        'p95': percentile(timings, 0.95) * 1000,
+        'p99': percentile(timings, 0.99) * 1000,
+        'queries': sum(queries) / len(queries),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print the change against ``baseline``; return the regressions."""
+    regressions = []
+    print(f'\n{"endpoint":<32}{"p95 ms":>10}{"before":>10}{"change":>9}'
+          f'{"queries":>9}{"before":>8}')
+    for name, current in results['endpoints'].items():
+        before = baseline['endpoints'].get(name)
+        if before is None:
+            continue
+        change = current['p95'] / before['p95'] - 1
+        slower = change > threshold
+        more_queries = current['queries'] >= before['queries'] + 0.5
+        flag = ' !' if slower or more_queries else ''
+        print(f'{name:<32}{current["p95"]:>10.2f}{before["p95"]:>10.2f}'
+              f'{change:>+9.0%}{current["queries"]:>9.1f}'
+              f'{before["queries"]:>8.1f}{flag}')
+        if slower:
+            regressions.append(f'{name}: p95 {change:+.0%}')
+        if more_queries:
+            regressions.append(
+                f'{name}: {before["queries"]:.1f} -> '
+                f'{current["queries"]:.1f} queries')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--recipes', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--only', help='Run endpoints containing this.')
+    parser.add_argument('--output', help='Save the results as JSON.')
+    parser.add_argument('--compare', help='JSON of an earlier run.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed p95 slowdown, 0.2 being 20%%.')
+    options = parser.parse_args()
+
+    with test_database():
+        from django.contrib.auth import get_user_model
+        from django.core.management import call_command
+        from django.db import connection
+        from django.db.models import Count
+        from rest_framework.authtoken.models import Token
+
+        from core.models import Ingredient, Recipe, RecipeIngredient
+
+        started = time.perf_counter()
+        call_command('generate_dataset', users=options.users,
+                     recipes=options.recipes, seed=options.seed,
+                     password=PASSWORD, verbosity=0)
+        print(f'{options.users} users and {options.recipes} recipes '
+              f'generated in {time.perf_counter() - started:.1f}s')
+
+        # The busiest reader and writer stand in for a typical heavy user
+        user = get_user_model().objects.annotate(
+            carts=Count('shopping_carts')).order_by('-carts', 'pk').first()
+        author_id = Recipe.objects.values('author').annotate(
+            count=Count('pk')).order_by('-count')[0]['author']
+        recipe_ids = list(Recipe.objects.order_by('-favorites_count')
+                          .values_list('pk', flat=True)[:50])
+        ingredient_ids = list(RecipeIngredient.objects.values(
+            'ingredient').annotate(count=Count('pk')).order_by(
+                '-count').values_list('ingredient', flat=True)[:10])
+        words = [name.split()[0] for name in Ingredient.objects.filter(
+            pk__in=ingredient_ids).values_list('name', flat=True)]
+        token = Token.objects.create(user=user).key
+
+        results = {
+            'meta': {
+                'date': datetime.now(timezone.utc).isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                **{name: getattr(options, name) for name in (
+                    'users', 'recipes', 'seed', 'requests', 'workers')},
+            },
+            'endpoints': {},
+        }
+        print(f'{options.requests} requests per endpoint, '
+              f'{options.workers} workers')
+        print(f'{"endpoint":<32}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}'
+              f'{"p99 ms":>9}{"queries":>9}{"errors":>8}')
+        for endpoint in endpoints(user, author_id, recipe_ids, words,
+                                  ingredient_ids):
+            if options.only and options.only not in endpoint.name:
+                continue
+            result = run(endpoint, options.requests, options.workers, token)
+            results['endpoints'][endpoint.name] = result
+            print(f'{endpoint.name:<32}{result["throughput"]:>9.1f}'
+                  f'{result["p50"]:>9.2f}{result["p95"]:>9.2f}'
+                  f'{result["p99"]:>9.2f}{result["queries"]:>9.1f}'
+                  f'{result["errors"]:>8}')
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    if options.compare:
+        with open(options.compare) as source:
+            regressions = compare(results, json.load(source),
+                                  options.threshold)
+        if regressions:
+            raise SystemExit('Regressions:\n' + '\n'.join(regressions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""Throughput of the WSGI and ASGI deployments at bounded concurrency.
+
+Seeds a throwaway database with ``generate_dataset``, then serves it with
+gunicorn the way ``entrypoint.sh`` does, once with sync workers and once
+with uvicorn workers (``ASGI=1``), and drives a mix of the read endpoints
+over keep-alive connections from each of ``--concurrency`` client threads
+for ``--duration`` seconds::
+
+    python -m benchmarks.deployments --concurrency 4 16 64
+    python -m benchmarks.deployments --slow-clients 3
+
+``--slow-clients`` adds clients that trickle their request headers for the
+whole run, as a slow mobile connection would; each one holds a sync
+worker, while the uvicorn workers keep serving the others.
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+from . import setup_django, test_database
+from .api import percentile
+
+PASSWORD = 'benchmark-password'
+MODES = {
+    'wsgi': ['benchmarks.serve:wsgi'],
+    'asgi': ['benchmarks.serve:asgi',
+             '--worker-class', 'uvicorn.workers.UvicornWorker'],
+}
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def start_server(mode, database, workers, directory):
+    port = free_port()
+    environment = {
+        **os.environ,
+        'BENCHMARK_DATABASE': database,
+        'ASYNC_READS': '1' if mode == 'asgi' else '0',
+        'CACHE_LOCATION': os.path.join(directory, f'{mode}-cache'),
+        'METRICS_DIR': os.path.join(directory, f'{mode}-metrics'),
+        'INGREDIENT_INDEX_PATH': os.path.join(directory, f'{mode}-index'),
+    }
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', *MODES[mode],
+         '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+         '--log-level', 'warning'],
+        env=environment, cwd=os.path.dirname(os.path.dirname(__file__)))
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f'{mode} server exited with {server.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server, port
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise SystemExit(f'{mode} server did not start')
+
+
+def slow_client(port, stop):
+    """Send one request a header line per second until ``stop`` is set."""
+    with socket.create_connection(('127.0.0.1', port)) as client:
+        client.sendall(b'GET /api/recipes/ HTTP/1.1\r\nHost: 127.0.0.1\r\n')
+        while not stop.wait(1):
+            try:
+                client.sendall(b'X-Slow: 1\r\n')
+            except OSError:
+                return
+
+
+def load(port, requests, concurrency, duration):
+    timings, errors = [], []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(offset):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        index = offset
+        while time.perf_counter() < deadline:
+            path, headers = requests[index % len(requests)]
+            index += concurrency
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                status = None
+            elapsed = time.perf_counter() - started
+            with lock:
+                timings.append(elapsed)
+                if status is None or status >= 400:
+                    errors.append(status)
+        connection.close()
+
+    threads = [threading.Thread(target=worker, args=(offset,))
+               for offset in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    timings.sort()
+    return {
+        'requests': len(timings),
+        'errors': len(errors),
+        'throughput': len(timings) / wall,
+        'p50': percentile(timings, 0.50) * 1000,
+        'p95': percentile(timings, 0.95) * 1000,
+    }
+
+
+def read_requests(token, recipe_ids, words):
+    from core.short_links import encode
+
+    authorization = {'Authorization': f'Token {token}'}
+    requests = [(f'/api/recipes/?page={page}', {}) for page in range(1, 6)]
+    requests += [(f'/api/recipes/{pk}/', {}) for pk in recipe_ids]
+    requests += [(f'/api/ingredients/?name={quote(word[:3])}', {})
+                 for word in words]
+    requests += [(f'/s/{encode(pk)}/', {}) for pk in recipe_ids[:5]]
+    requests += [('/api/recipes/?is_favorited=1', authorization),
+                 ('/api/users/subscriptions/', authorization)]
+    return requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--recipes', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[4, 16, 64])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--slow-clients', type=int, default=0)
+    parser.add_argument('--modes', nargs='+', choices=MODES,
+                        default=list(MODES))
+    options = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    setup_django()
+    from django.db import connection
+    if connection.vendor == 'sqlite':
+        # The servers cannot open an in-memory test database
+        connection.settings_dict['TEST']['NAME'] = os.path.join(
+            directory.name, 'benchmark.sqlite3')
+
+    with directory, test_database():
+        from django.contrib.auth import get_user_model
+        from django.core.management import call_command
+        from django.db.models import Count
+        from rest_framework.authtoken.models import Token
+
+        from core.models import Ingredient, Recipe
+
+        started = time.perf_counter()
+        call_command('generate_dataset', users=options.users,
+                     recipes=options.recipes, seed=options.seed,
+                     password=PASSWORD, verbosity=0)
+        print(f'{options.users} users and {options.recipes} recipes '
+              f'generated in {time.perf_counter() - started:.1f}s')
+
+        user = get_user_model().objects.annotate(
+            count=Count('subscriptions')).order_by('-count', 'pk').first()
+        token = Token.objects.create(user=user).key
+        recipe_ids = list(Recipe.objects.order_by('-favorites_count')
+                          .values_list('pk', flat=True)[:20])
+        words = [name.split()[0] for name in Ingredient.objects.order_by(
+            'pk').values_list('name', flat=True)[:10]]
+        requests = read_requests(token, recipe_ids, words)
+        database = connection.settings_dict['NAME']
+        connection.close()
+
+        print(f'{options.workers} workers, {options.duration:g}s per run, '
+              f'{options.slow_clients} slow clients')
+        print(f'{"mode":<6}{"clients":>8}{"req/s":>9}{"p50 ms":>9}'
+              f'{"p95 ms":>9}{"errors":>8}')
+        for mode in options.modes:
+            server, port = start_server(mode, database, options.workers,
+                                        directory.name)
+            stop = threading.Event()
+            slow = [threading.Thread(target=slow_client, args=(port, stop))
+                    for _ in range(options.slow_clients)]
+            try:
+                # Warm the caches and the ingredient index
+                load(port, requests, options.workers, 1)
+                for thread in slow:
+                    thread.start()
+                for concurrency in options.concurrency:
+                    result = load(port, requests, concurrency,
+                                  options.duration)
+                    print(f'{mode:<6}{concurrency:>8}'
+                          f'{result["throughput"]:>9.1f}'
+                          f'{result["p50"]:>9.2f}{result["p95"]:>9.2f}'
+                          f'{result["errors"]:>8}')
+            finally:
+                stop.set()
+                server.terminate()
+                server.wait()
+                for thread in slow:
+                    if thread.is_alive():
+                        thread.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Recipes by ingredient set: SQL joins against the in-memory index.
+
+Fills a throwaway database with synthetic recipes using the ingredient
+catalog in ``data/`` (popular ingredients are used far more often, like
+salt and onions), then times each ``match`` mode for random ingredient
+sets, counting the matches and fetching the first page::
+
+    python -m benchmarks.ingredient_sets --recipes 200000
+"""
+import argparse
+import json
+import random
+import time
+
+from . import test_database
+from .recipe_search import BATCH_SIZE, DATA, PAGE_SIZE, timed
+
+
+def fill(recipes, seed):
+    from django.contrib.auth import get_user_model
+
+    from core.models import Ingredient, Recipe, RecipeIngredient
+
+    generator = random.Random(seed)
+    with open(DATA, encoding='utf-8') as source:
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(**item) for item in json.load(source))
+    weights = [1 / rank for rank in range(1, len(ingredients) + 1)]
+    User = get_user_model()
+    authors = User.objects.bulk_create(
+        User(username=f'author{index}', email=f'author{index}@example.com')
+        for index in range(max(recipes // 1000, 1)))
+    for start in range(0, recipes, BATCH_SIZE):
+        batch = Recipe.objects.bulk_create(
+            Recipe(author=generator.choice(authors), name='Recipe',
+                   text='Text', image='recipes/images/benchmark.jpg',
+                   cooking_time=generator.randint(5, 120))
+            for _ in range(min(BATCH_SIZE, recipes - start)))
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+            for recipe in batch
+            for ingredient in {*generator.choices(
+                ingredients, weights, k=generator.randint(3, 12))})
+    return ingredients[:200]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipes', type=int, default=200_000)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    options = parser.parse_args()
+
+    with test_database():
+        from django.conf import settings
+        from django.db.models import Count, F, FloatField, Q
+        from django.db.models.functions import Cast
+
+        from core import ingredient_sets
+        from core.models import Recipe
+
+        started = time.perf_counter()
+        common = fill(options.recipes, options.seed)
+        print(f'{options.recipes} recipes generated in '
+              f'{time.perf_counter() - started:.1f}s')
+
+        generator = random.Random(options.seed)
+        queries = [[ingredient.id for ingredient in generator.sample(
+            common, k=generator.randint(2, 5))]
+            for _ in range(options.queries)]
+        recipes = Recipe.objects.order_by('-date_published', '-id')
+
+        def joined(mode):
+            def run(ids):
+                matches = recipes.annotate(
+                    hits=Count('recipe_ingredients', filter=Q(
+                        recipe_ingredients__ingredient_id__in=ids)),
+                    size=Count('recipe_ingredients'),
+                ).filter(hits__gte=len(ids) if mode == 'all' else 1)
+                if mode == 'best':
+                    matches = matches.order_by(
+                        (Cast('hits', FloatField()) / F('size')).desc(),
+                        '-id')
+                return matches.count(), list(matches[:PAGE_SIZE])
+            return run
+
+        def indexed(mode):
+            # As the recipe list calls it: the limit only cuts best matches
+            def run(ids):
+                found = ingredient_sets.match_recipes(
+                    recipes, ids, mode,
+                    limit=settings.RECIPE_INGREDIENT_MATCH_LIMIT)
+                return len(found), found[:PAGE_SIZE]
+            return run
+
+        started = time.perf_counter()
+        ingredient_sets.ingredient_sets.current()
+        print(f'index built in {time.perf_counter() - started:.1f}s')
+
+        print(f'{"match":<18}{"p50 ms":>10}{"max ms":>10}')
+        for mode in ingredient_sets.MATCH_MODES:
+            for label, run in (('join', joined), ('index', indexed)):
+                median, worst = timed(run(mode), queries)
+                print(f'{mode + " " + label:<18}{median:>10.2f}'
+                      f'{worst:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Recipe search: icontains against full-text search and the fallback index.
+
+Fills a throwaway database with synthetic recipes whose words come from
+the ingredient catalog in ``data/``, then times a first page of ten results
+plus the total count for each query, the way the recipe list serves it::
+
+    python -m benchmarks.recipe_search --recipes 1000000
+
+Full-text search is only measured on PostgreSQL.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from pathlib import Path
+
+from . import test_database
+
+DATA = Path(__file__).resolve().parents[2] / 'data' / 'ingredients.json'
+VERBS = ('нарезать', 'обжарить', 'запечь', 'смешать', 'отварить', 'потушить',
+         'взбить', 'охладить', 'посолить', 'подавать')
+BATCH_SIZE = 5000
+PAGE_SIZE = 10
+
+
+def vocabulary():
+    with open(DATA, encoding='utf-8') as source:
+        names = [item['name'] for item in json.load(source)]
+    return sorted({word for name in names for word in name.split()
+                   if len(word) > 3})
+
+
+def fill(recipes, seed):
+    from django.contrib.auth import get_user_model
+
+    from core.models import Recipe
+
+    generator = random.Random(seed)
+    words = vocabulary()
+    User = get_user_model()
+    authors = User.objects.bulk_create(
+        User(username=f'author{index}', email=f'author{index}@example.com')
+        for index in range(max(recipes // 1000, 1)))
+    for start in range(0, recipes, BATCH_SIZE):
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=generator.choice(authors),
+                name=' '.join(generator.choices(words, k=3)).capitalize(),
+                text=' '.join(
+                    generator.choice(VERBS) + ' ' + generator.choice(words)
+                    for _ in range(generator.randint(5, 20))),
+                image='recipes/images/benchmark.jpg',
+                cooking_time=generator.randint(5, 120),
+            )
+            for _ in range(min(BATCH_SIZE, recipes - start)))
+    return words
+
+
+def timed(run, queries):
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        run(query)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000, max(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipes', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    options = parser.parse_args()
+
+    with test_database():
+        from django.db.models import Q
+
+        from core import recipe_search
+        from core.models import Recipe
+
+        started = time.perf_counter()
+        words = fill(options.recipes, options.seed)
+        print(f'{options.recipes} recipes generated in '
+              f'{time.perf_counter() - started:.1f}s')
+
+        generator = random.Random(options.seed)
+        queries = [' '.join(generator.sample(words, k=generator.randint(1, 2)))
+                   for _ in range(options.queries)]
+        recipes = Recipe.objects.order_by('-date_published', '-id')
+
+        def icontains(query):
+            condition = Q()
+            for word in query.split():
+                condition &= Q(name__icontains=word) | Q(text__icontains=word)
+            matches = recipes.filter(condition)
+            return matches.count(), list(matches[:PAGE_SIZE])
+
+        def full_text(query):
+            matches = recipe_search.search(recipes, query)
+            return (matches.count(),
+                    list(matches.order_by('-search_rank')[:PAGE_SIZE]))
+
+        def fallback(query):
+            ranked = recipe_search.recipe_index.search(query)
+            page = [pk for pk, _ in ranked[:PAGE_SIZE]]
+            return len(ranked), list(Recipe.objects.filter(pk__in=page))
+
+        started = time.perf_counter()
+        recipe_search.recipe_index.build()
+        print(f'fallback index built in {time.perf_counter() - started:.1f}s')
+
+        cases = [('icontains', icontains), ('fallback index', fallback)]
+        if recipe_search.uses_postgres(recipes):
+            cases.insert(1, ('tsvector + GIN', full_text))
+        print(f'{"search":<18}{"p50 ms":>10}{"max ms":>10}')
+        for label, run in cases:
+            median, worst = timed(run, queries)
+            print(f'{label:<18}{median:>10.2f}{worst:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
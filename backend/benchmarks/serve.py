@@ -0,0 +1,15 @@
+"""WSGI and ASGI applications on the database ``benchmarks.deployments``
+seeded, named by ``BENCHMARK_DATABASE``; for gunicorn only.
+"""
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+from django.conf import settings  # noqa: E402
+from django.core.asgi import get_asgi_application  # noqa: E402
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+
+settings.DATABASES['default']['NAME'] = os.environ['BENCHMARK_DATABASE']
+
+wsgi = get_wsgi_application()
+asgi = get_asgi_application()
@@ -0,0 +1,85 @@
+"""Database round trips and latency of token authentication.
+
+Compares DRF's ``TokenAuthentication`` with ``CachedTokenAuthentication``
+served from the process LRU and from the shared cache alone, as another
+worker would see it::
+
+    python -m benchmarks.token_auth --requests 1000
+"""
+import argparse
+import statistics
+import time
+from unittest import mock
+
+from . import test_database
+
+
+def measure(client, path, requests, before_each=None):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    timings = []
+    queries = 0
+    for _ in range(requests):
+        if before_each:
+            before_each()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = client.get(path)
+            timings.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise SystemExit(f'{path} answered {response.status_code}')
+        queries += len(captured)
+    return queries / requests, statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--path', default='/api/users/me/')
+    options = parser.parse_args()
+
+    with test_database():
+        from django.contrib.auth import get_user_model
+        from django.core.cache import cache
+        from rest_framework.authentication import TokenAuthentication
+        from rest_framework.authtoken.models import Token
+        from rest_framework.test import APIClient
+        from rest_framework.views import APIView
+
+        from api.authentication import CachedTokenAuthentication, local_tokens
+        from core.models import UserProfile
+
+        user = get_user_model().objects.create_user(
+            username='benchmark', email='benchmark@example.com',
+            password='benchmark')
+        UserProfile.objects.create(user=user)
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user)}')
+        cache.clear()
+
+        cases = (
+            ('TokenAuthentication', TokenAuthentication, None),
+            ('cached, shared cache', CachedTokenAuthentication,
+             local_tokens.clear),
+            ('cached, process LRU', CachedTokenAuthentication, None),
+        )
+        print(f'{options.requests} x GET {options.path}')
+        print(f'{"authentication":<24}{"queries/req":>12}{"p50 ms":>10}')
+        baseline = None
+        for label, authentication, before_each in cases:
+            with mock.patch.object(APIView, 'authentication_classes',
+                                   [authentication]):
+                # Warm up, which also fills the caches
+                client.get(options.path)
+                queries, median = measure(
+                    client, options.path, options.requests, before_each)
+            if baseline is None:
+                baseline = queries
+            print(f'{label:<24}{queries:>12.2f}{median:>10.3f}')
+        print(f'round trips removed per request: {baseline - queries:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,18 @@
+import os
+import tempfile
+
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import redirect
 from import_export.admin import ImportExportModelAdmin
+from import_export.formats.base_formats import CSV, JSON
 from import_export.resources import ModelResource
 from .models import (
     Ingredient, Recipe, RecipeIngredient,
-    Favorite, ShoppingCart, Subscription,
+    Favorite, ShoppingCart, Subscription, ShoppingListItem,
 )
+from . import ingredient_loader
+from .shopping_list import tracking_recipe
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -22,11 +30,7 @@ class UserAdmin(admin.ModelAdmin):
 class IngredientResource(ModelResource):
     class Meta:
         model = Ingredient
-        exclude = ('id',)
-        skip_first_row = True
-        encoding = 'utf-8-sig'
-        import_mode = 1  # Create new entries only
-        import_id_fields = []
+        fields = ('name', 'measurement_unit')
 
 
 @admin.register(Ingredient)
@@ -35,6 +39,31 @@ class IngredientAdmin(ImportExportModelAdmin):
     list_display = ('name', 'measurement_unit')
     search_fields = ('name',)
 
+    def get_import_formats(self):
+        return [CSV, JSON]
+
+    def import_action(self, request, **kwargs):
+        """Hand uploads to the bulk loader instead of importing row by row."""
+        if not self.has_import_permission(request):
+            raise PermissionDenied
+        form = self.create_import_form(request)
+        if not (request.POST and form.is_valid()):
+            return super().import_action(request, **kwargs)
+        input_format = self.get_import_formats()[
+            int(form.cleaned_data['format'])]()
+        upload = form.cleaned_data['import_file']
+        descriptor, path = tempfile.mkstemp(
+            suffix=f'.{input_format.get_extension()}',
+            prefix='ingredients-')
+        with os.fdopen(descriptor, 'wb') as copy:
+            for chunk in upload.chunks():
+                copy.write(chunk)
+        ingredient_loader.schedule_load(path, delete=True)
+        self.message_user(
+            request, f'Loading ingredients from {upload.name} in the '
+            'background; new ones will appear shortly.')
+        return redirect('admin:core_ingredient_changelist')
+
 
 class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
@@ -44,14 +73,17 @@ class RecipeIngredientInline(admin.TabularInline):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'cooking_time', 'favorites_count')
+    list_display = ('name', 'author', 'cooking_time', 'favorites_count',
+                    'in_carts_count')
     list_filter = ('author', 'cooking_time')
     search_fields = ('name', 'author__username')
     inlines = [RecipeIngredientInline]
 
-    def favorites_count(self, obj):
-        return obj.favorites.count()
-    favorites_count.short_description = 'Added to favorites'
+    def save_related(self, request, form, formsets, change):
+        if not change:
+            return super().save_related(request, form, formsets, change)
+        with tracking_recipe(form.instance.id):
+            super().save_related(request, form, formsets, change)
 
 
 @admin.register(RecipeIngredient)
@@ -75,8 +107,16 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'recipe__name')
 
 
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'total_amount')
+    list_filter = ('user',)
+    search_fields = ('user__username', 'ingredient__name')
+
+
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
-    list_display = ('user', 'author', 'recipes_count')
+    list_display = ('user', 'author', 'author__profiles__recipes_count')
+    list_select_related = ('user', 'author__profiles')
     list_filter = ('user', 'author')
     search_fields = ('user__username', 'author__username')
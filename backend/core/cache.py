@@ -0,0 +1,59 @@
+"""File cache whose ``add`` and ``incr`` are atomic across processes.
+
+Django's file cache checks then writes in ``add`` and reads then writes in
+``incr``, so two workers can both win the same ``add`` or get the same
+value from ``incr``.  The generation counters (``core.generations``), the
+change logs keyed by them and the single-flight locks of ``api.caching``
+rely on both being atomic; here they hold an exclusive ``flock`` on a
+file in the cache directory.
+
+Culling a full cache spares the entries without a timeout, which are the
+generation counters: a culled counter restarts and retires everything
+cached under it.
+"""
+import fcntl
+import os
+import pickle
+import random
+from contextlib import contextmanager
+
+from django.core.cache.backends.filebased import FileBasedCache
+
+LOCK_FILE = 'atomic.lock'
+
+
+class AtomicFileBasedCache(FileBasedCache):
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self._dir, exist_ok=True)
+        with open(os.path.join(self._dir, LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def add(self, key, value, timeout=None, version=None):
+        with self._locked():
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        # decr and get_or_set go through these two as well
+        with self._locked():
+            return super().incr(key, delta, version)
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        if len(filelist) < self._max_entries:
+            return
+        expiring = []
+        for name in filelist:
+            try:
+                with open(name, 'rb') as entry:
+                    if pickle.load(entry) is not None:
+                        expiring.append(name)
+            except (FileNotFoundError, EOFError):
+                continue
+        if self._cull_frequency:
+            expiring = random.sample(expiring, min(
+                len(expiring), len(filelist) // self._cull_frequency))
+        for name in expiring:
+            self._delete(name)
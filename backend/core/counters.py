@@ -0,0 +1,96 @@
+"""Denormalized counters on recipes and user profiles.
+
+Counters move with F() expressions as rows are created and deleted (see
+``core.signals``); ``reconcile`` recomputes them from the underlying
+tables to repair drift, e.g. after ``bulk_create`` which sends no signals.
+Every change also moves ``updated_at``: favorites, carts and subscriptions
+have no timestamps of their own, and the validators in ``api.conditional``
+rely on the row they are counted on to date them.
+"""
+from functools import reduce
+from operator import or_
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Now
+
+from .models import Favorite, Recipe, ShoppingCart, Subscription, UserProfile
+
+User = get_user_model()
+
+# counter field: (counted model, its foreign key to the counter owner)
+RECIPE_COUNTERS = {
+    'favorites_count': (Favorite, 'recipe'),
+    'in_carts_count': (ShoppingCart, 'recipe'),
+}
+PROFILE_COUNTERS = {
+    'recipes_count': (Recipe, 'author'),
+    'subscribers_count': (Subscription, 'author'),
+}
+
+
+def change_recipe_counter(recipe_id, field, delta):
+    Recipe.objects.filter(pk=recipe_id).update(
+        updated_at=Now(), **{field: F(field) + delta})
+
+
+def change_profile_counter(user_id, field, delta):
+    updated = UserProfile.objects.filter(user_id=user_id).update(
+        updated_at=Now(), **{field: F(field) + delta})
+    if not updated and User.objects.filter(pk=user_id).exists():
+        # Users created outside the API may have no profile yet; the
+        # change being counted is already visible to the live counts.
+        UserProfile.objects.get_or_create(
+            user_id=user_id, defaults=live_profile_counts(user_id))
+
+
+def live_count(model, field, outer_field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef(outer_field)})
+        .order_by().values(field)
+        .annotate(count=Count('pk')).values('count')
+    ), Value(0))
+
+
+def live_profile_counts(user_id):
+    return {
+        name: model.objects.filter(**{field: user_id}).count()
+        for name, (model, field) in PROFILE_COUNTERS.items()
+    }
+
+
+def _reconcile(queryset, counters, outer_field, dry_run):
+    live = {
+        name: live_count(model, field, outer_field)
+        for name, (model, field) in counters.items()
+    }
+    drifted = queryset.alias(
+        **{f'live_{name}': expression for name, expression in live.items()}
+    ).filter(reduce(or_, (
+        ~Q(**{name: F(f'live_{name}')}) for name in counters
+    )))
+    ids = list(drifted.values_list('pk', flat=True))
+    if ids and not dry_run:
+        queryset.model.objects.filter(pk__in=ids).update(
+            updated_at=Now(), **live)
+    return len(ids)
+
+
+def reconcile(dry_run=False):
+    """Repair every counter; return the number of drifted rows per model."""
+    missing = User.objects.filter(profiles__isnull=True)
+    if dry_run:
+        missing_profiles = missing.count()
+    else:
+        missing_profiles = len(UserProfile.objects.bulk_create(
+            (UserProfile(user_id=pk)
+             for pk in missing.values_list('pk', flat=True)),
+            ignore_conflicts=True
+        ))
+    return {
+        'missing profiles': missing_profiles,
+        'recipes': _reconcile(
+            Recipe.objects.all(), RECIPE_COUNTERS, 'pk', dry_run),
+        'profiles': _reconcile(
+            UserProfile.objects.all(), PROFILE_COUNTERS, 'user', dry_run),
+    }
@@ -0,0 +1,258 @@
+"""Synthetic data at production scale, behind ``generate_dataset``.
+
+Users, recipes and their ingredients, favorites, carts and subscriptions are
+drawn from skewed distributions: a few prolific authors write most recipes
+(Zipf), favorites, carts and subscribers follow a Pareto tail so some
+recipes and authors are far more popular than the rest, and ingredients are
+picked by Zipf popularity from the real catalog.  The same seed always
+yields the same rows.
+
+Rows get explicit ids after the current maximum and are appended with
+``COPY`` on PostgreSQL and multi-row inserts elsewhere, skipping the ORM.
+Denormalized counters are written with the rows, as the sampled counts are
+known up front, and shopping list totals are aggregated in one statement.
+"""
+import bisect
+import io
+import random
+from array import array
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.models import Max
+
+from . import ingredient_sets, recipe_search, short_links
+from .generations import bump_generation_on_commit
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                     ShoppingCart, ShoppingListItem, Subscription,
+                     UserProfile)
+
+User = get_user_model()
+
+# Dates are spread over the SPAN before END, so output does not depend on
+# the day it was generated
+END = datetime(2026, 1, 1, tzinfo=timezone.utc)
+SPAN = timedelta(days=730)
+AUTHOR_EXPONENT = 1.1
+INGREDIENT_EXPONENT = 1.0
+INGREDIENTS_PER_RECIPE = (3, 12)
+# Pareto shapes: lower means a heavier tail and a higher mean
+FAVORITES_SHAPE = 1.3
+CARTS_SHAPE = 1.8
+SUBSCRIBERS_SHAPE = 1.2
+VERBS = ('нарезать', 'обжарить', 'запечь', 'смешать', 'отварить', 'потушить',
+         'взбить', 'охладить', 'посолить', 'подавать')
+IMAGE = 'recipes/images/dataset.jpg'
+
+
+class RowWriter:
+    """Appends rows to one table in batches, bypassing the ORM."""
+
+    def __init__(self, model, fields, batch_size):
+        self.model = model
+        self.table = model._meta.db_table
+        self.columns = [model._meta.get_field(field).column
+                        for field in fields]
+        self.batch_size = batch_size
+        self.rows = []
+        self.count = 0
+
+    def add(self, *row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(column) for column in self.columns)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                self._copy(cursor.cursor, (
+                    f'COPY {quote(self.table)} ({columns}) FROM STDIN'))
+            else:
+                placeholders = ', '.join(['%s'] * len(self.columns))
+                cursor.executemany(
+                    f'INSERT INTO {quote(self.table)} ({columns}) '
+                    f'VALUES ({placeholders})', self.rows)
+        self.count += len(self.rows)
+        self.rows = []
+
+    def _copy(self, cursor, sql):
+        data = ''.join(
+            '\t'.join(_copy_value(value) for value in row) + '\n'
+            for row in self.rows)
+        if hasattr(cursor, 'copy_expert'):
+            cursor.copy_expert(sql, io.StringIO(data))
+        else:
+            # psycopg 3
+            with cursor.copy(sql) as copy:
+                copy.write(data)
+
+
+def _copy_value(value):
+    if value is None:
+        return r'\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _datetime(value):
+    return connection.ops.adapt_datetimefield_value(value)
+
+
+def _pareto(generator, shape, limit):
+    return min(int(generator.paretovariate(shape)) - 1, limit)
+
+
+def _next_id(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+def vocabulary(names):
+    return sorted({word for name in names for word in name.split()
+                   if len(word) > 3})
+
+
+def generate(users, recipes, seed=1, batch_size=10000, password=None,
+             progress=None):
+    """Append the dataset and return the number of rows per table.
+
+    ``password`` is set for every user; by default they cannot log in.
+    ``progress(table, rows)`` is called as each table is finished.
+    """
+    generator = random.Random(seed)
+    catalog = list(Ingredient.objects.order_by('pk').values_list(
+        'pk', 'name'))
+    if not catalog:
+        raise ValueError('The ingredient catalog is empty.')
+    generator.shuffle(catalog)
+    ingredient_weights = list(accumulate(
+        1 / rank ** INGREDIENT_EXPONENT
+        for rank in range(1, len(catalog) + 1)))
+    words = vocabulary(name for _, name in catalog)
+    # One hash for everybody; hashing per user would dominate the run
+    password_hash = make_password(password)
+
+    def report(writer):
+        writer.flush()
+        if progress:
+            progress(writer.table, writer.count)
+        return writer.count
+
+    counts = {}
+    first_user = _next_id(User)
+    user_ids = range(first_user, first_user + users)
+    writer = RowWriter(User, (
+        'id', 'username', 'email', 'password', 'first_name', 'last_name',
+        'is_superuser', 'is_staff', 'is_active', 'date_joined'), batch_size)
+    joined = _datetime(END - SPAN)
+    for pk in user_ids:
+        writer.add(pk, f'dataset{pk}', f'dataset{pk}@example.com',
+                   password_hash, 'Dataset', f'User {pk}', False, False,
+                   True, joined)
+    counts['users'] = report(writer)
+
+    # Prolific authors come first
+    author_weights = list(accumulate(
+        1 / rank ** AUTHOR_EXPONENT for rank in range(1, users + 1)))
+    recipes_count = array('I', bytes(4 * users))
+    first_recipe = _next_id(Recipe)
+    recipe_writer = RowWriter(Recipe, (
+        'id', 'author', 'name', 'text', 'image', 'image_variants',
+        'cooking_time', 'date_published', 'favorites_count', 'in_carts_count',
+        'updated_at'), batch_size)
+    ingredient_writer = RowWriter(
+        RecipeIngredient, ('recipe', 'ingredient', 'amount'), batch_size)
+    favorite_writer = RowWriter(Favorite, ('user', 'recipe'), batch_size)
+    cart_writer = RowWriter(ShoppingCart, ('user', 'recipe'), batch_size)
+    for index in range(recipes):
+        pk = first_recipe + index
+        author = bisect.bisect_left(
+            author_weights, generator.random() * author_weights[-1])
+        recipes_count[author] += 1
+        favorites = _pareto(generator, FAVORITES_SHAPE, users)
+        carts = _pareto(generator, CARTS_SHAPE, users)
+        published = _datetime(END - SPAN * (recipes - index) / recipes)
+        recipe_writer.add(
+            pk, user_ids[author],
+            ' '.join(generator.choices(words, k=3)).capitalize(),
+            ' '.join(generator.choice(VERBS) + ' ' + generator.choice(words)
+                     for _ in range(generator.randint(5, 20))),
+            IMAGE, '{}', generator.randint(5, 120), published, favorites,
+            carts, published)
+        ingredients = {
+            catalog[bisect.bisect_left(
+                ingredient_weights,
+                generator.random() * ingredient_weights[-1])][0]
+            for _ in range(generator.randint(*INGREDIENTS_PER_RECIPE))
+        }
+        for ingredient_id in sorted(ingredients):
+            ingredient_writer.add(pk, ingredient_id,
+                                  generator.choice((1, 2, 5, 50, 100, 200)))
+        for position in generator.sample(range(users), favorites):
+            favorite_writer.add(user_ids[position], pk)
+        for position in generator.sample(range(users), carts):
+            cart_writer.add(user_ids[position], pk)
+    counts['recipes'] = report(recipe_writer)
+    counts['recipe ingredients'] = report(ingredient_writer)
+    counts['favorites'] = report(favorite_writer)
+    counts['carts'] = report(cart_writer)
+
+    subscribers_count = array('I', bytes(4 * users))
+    writer = RowWriter(Subscription, ('user', 'author'), batch_size)
+    for author in range(users):
+        if not recipes_count[author]:
+            continue
+        count = _pareto(generator, SUBSCRIBERS_SHAPE, users - 1)
+        subscribers = generator.sample(range(users), count + 1)
+        for position in [item for item in subscribers
+                         if item != author][:count]:
+            writer.add(user_ids[position], user_ids[author])
+            subscribers_count[author] += 1
+    counts['subscriptions'] = report(writer)
+
+    writer = RowWriter(UserProfile, (
+        'user', 'avatar', 'avatar_variants', 'recipes_count',
+        'subscribers_count', 'updated_at'), batch_size)
+    for position, pk in enumerate(user_ids):
+        writer.add(pk, None, '{}', recipes_count[position],
+                   subscribers_count[position], joined)
+    counts['profiles'] = report(writer)
+
+    counts['shopping list items'] = aggregate_shopping_lists(user_ids)
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [
+                User, Recipe, RecipeIngredient, Favorite, ShoppingCart,
+                Subscription, UserProfile, ShoppingListItem]):
+            cursor.execute(sql)
+    # Nothing above sent signals
+    for generation in ('recipes', 'recipe-responses',
+                       recipe_search.SEARCH_GENERATION,
+                       ingredient_sets.GENERATION,
+                       short_links.GENERATION):
+        bump_generation_on_commit(generation)
+    return counts
+
+
+def aggregate_shopping_lists(user_ids):
+    """Materialize the totals of the new users' carts in one statement."""
+    quote = connection.ops.quote_name
+    items, carts, amounts = (model._meta.db_table for model in (
+        ShoppingListItem, ShoppingCart, RecipeIngredient))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(items)} (user_id, ingredient_id, '
+            f'total_amount) '
+            f'SELECT c.user_id, a.ingredient_id, SUM(a.amount) '
+            f'FROM {quote(carts)} c '
+            f'JOIN {quote(amounts)} a ON a.recipe_id = c.recipe_id '
+            f'WHERE c.user_id BETWEEN %s AND %s '
+            f'GROUP BY c.user_id, a.ingredient_id',
+            [user_ids.start, user_ids.stop - 1])
+        return cursor.rowcount
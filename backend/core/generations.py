@@ -0,0 +1,53 @@
+"""Generation counters used to invalidate cached reads.
+
+Cached values embed the generation of the data they were built from, so
+bumping a generation retires every dependent entry without having to find
+and delete them one by one.
+"""
+import time
+
+from django.core.cache import cache
+
+from .transactions import on_commit_once
+
+KEY_PREFIX = 'generation'
+
+
+def first_generation():
+    """Start a counter past any value an evicted one handed out.
+
+    Counters start at the clock in nanoseconds and are bumped far less
+    often than that, so a restarted counter never repeats a generation
+    that entries may still be cached under.
+    """
+    return time.time_ns()
+
+
+def get_generation(name):
+    return cache.get_or_set(f'{KEY_PREFIX}:{name}', first_generation,
+                            timeout=None)
+
+
+async def aget_generation(name):
+    return await cache.aget_or_set(f'{KEY_PREFIX}:{name}', first_generation,
+                                   timeout=None)
+
+
+def bump_generation(name):
+    key = f'{KEY_PREFIX}:{name}'
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The counter was evicted
+        cache.add(key, first_generation(), timeout=None)
+        return cache.incr(key)
+
+
+def bump_generation_on_commit(name):
+    """Bump ``name`` once the current transaction commits.
+
+    Bumping only after commit keeps a concurrent reader from caching the
+    pre-commit state under the new generation.  Repeated calls inside one
+    transaction collapse into a single bump.
+    """
+    on_commit_once((KEY_PREFIX, name), lambda: bump_generation(name))
@@ -0,0 +1,181 @@
+"""Image upload pipeline: decoding, validation and resized variants.
+
+Uploads are re-encoded without their metadata (which also drops EXIF
+location data), capped to ``IMAGE_MAX_SIDE`` and stored under a random
+name.  Resized WebP and JPEG variants are rendered after the transaction
+commits, on a small thread pool unless ``IMAGE_VARIANTS_ASYNC`` is off,
+and recorded on the row so serializers can link them without touching
+storage.
+"""
+import base64
+import io
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models.functions import Now
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+RECIPE_VARIANTS = {'card': 320, 'detail': 1024}
+AVATAR_VARIANTS = {'avatar': 96}
+
+# Four base64 characters decode to three bytes, so chunks stay aligned.
+DECODE_CHUNK = 64 * 1024
+SPOOL_MAX_SIZE = 1024 * 1024
+
+_executor = None
+
+
+def decode_base64(encoded):
+    """Decode base64 text into a spooled file, one chunk at a time."""
+    if any(character.isspace() for character in encoded[:DECODE_CHUNK]):
+        encoded = ''.join(encoded.split())
+    spool = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        for start in range(0, len(encoded), DECODE_CHUNK):
+            spool.write(base64.b64decode(
+                encoded[start:start + DECODE_CHUNK], validate=True))
+    except ValueError:
+        spool.close()
+        raise serializers.ValidationError('Invalid base64 image data.')
+    spool.seek(0)
+    return spool
+
+
+def _flatten(image):
+    """Return an RGB copy, compositing transparency onto white."""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _encode(image, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'JPEG':
+        _flatten(image).save(buffer, 'JPEG', quality=85, optimize=True,
+                             progressive=True)
+    elif image_format == 'WEBP':
+        image.save(buffer, 'WEBP', quality=80, method=4)
+    else:
+        image.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def normalize_image(source):
+    """Validate an uploaded image and re-encode it without metadata."""
+    try:
+        image = Image.open(source)
+    except UnidentifiedImageError:
+        raise serializers.ValidationError('Upload a valid image.')
+    with image:
+        width, height = image.size
+        if width < settings.IMAGE_MIN_SIDE or height < settings.IMAGE_MIN_SIDE:
+            raise serializers.ValidationError(
+                f'Image must be at least {settings.IMAGE_MIN_SIDE}px '
+                'on each side.')
+        if width * height > settings.IMAGE_MAX_PIXELS:
+            raise serializers.ValidationError(
+                f'Image must not exceed {settings.IMAGE_MAX_PIXELS} pixels.')
+
+        has_alpha = image.mode in ('RGBA', 'LA') or (
+            image.mode == 'P' and 'transparency' in image.info)
+        # Orientation is baked into the pixels, as EXIF is not kept
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((settings.IMAGE_MAX_SIDE, settings.IMAGE_MAX_SIDE),
+                        Image.Resampling.LANCZOS)
+        if has_alpha:
+            content = _encode(image.convert('RGBA'), 'PNG')
+            extension = 'png'
+        else:
+            content = _encode(image, 'JPEG')
+            extension = 'jpg'
+    return ContentFile(content, name=f'{uuid.uuid4().hex}.{extension}')
+
+
+def render_variants(storage, name, sizes):
+    """Write every size of ``name`` as WebP and JPEG; return their paths."""
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    variants = {}
+    with storage.open(name) as source, Image.open(source) as image:
+        image.load()
+        for label, size in sizes.items():
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+            variants[label] = {
+                extension: storage.save(
+                    os.path.join(directory, 'variants',
+                                 f'{stem}-{label}.{extension}'),
+                    ContentFile(_encode(resized, image_format)))
+                for extension, image_format in (('webp', 'WEBP'),
+                                                ('jpeg', 'JPEG'))
+            }
+    return variants
+
+
+def delete_variants(storage, variants):
+    for paths in variants.values():
+        for path in paths.values():
+            storage.delete(path)
+
+
+def discard_variants(image, variants):
+    """Delete ``variants`` of ``image`` once the transaction commits."""
+    if variants:
+        transaction.on_commit(
+            partial(delete_variants, image.storage, dict(variants)))
+
+
+def build_variants(model, pk, field_name, variants_field, name, sizes):
+    storage = model._meta.get_field(field_name).storage
+    variants = render_variants(storage, name, sizes)
+    # Skip the write if the image was replaced while rendering
+    updated = model.objects.filter(
+        pk=pk, **{field_name: name}
+    ).update(updated_at=Now(), **{variants_field: variants})
+    if not updated:
+        delete_variants(storage, variants)
+
+
+def _run_in_background(task):
+    try:
+        task()
+    except Exception:
+        logger.exception('Rendering image variants failed')
+    finally:
+        connections.close_all()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_VARIANT_WORKERS,
+            thread_name_prefix='image-variants')
+    return _executor
+
+
+def schedule_variants(instance, field_name, variants_field, sizes):
+    """Render the variants of a freshly saved image after commit."""
+    image = getattr(instance, field_name)
+    if not image:
+        return
+    task = partial(build_variants, type(instance), instance.pk, field_name,
+                   variants_field, image.name, sizes)
+    if settings.IMAGE_VARIANTS_ASYNC:
+        transaction.on_commit(
+            lambda: _get_executor().submit(_run_in_background, task))
+    else:
+        transaction.on_commit(task)
@@ -0,0 +1,212 @@
+"""Pre-rendered ingredient catalog served by ``GET /api/ingredients/``.
+
+Each catalog version is rendered once to JSON and compressed with gzip and,
+when the ``brotli`` package is installed, brotli.  Files are named after a
+hash of the JSON, so versions are content-addressed and every worker serves
+the same bytes; the ``current`` file names the version being served.  The
+JSON of the last ``INGREDIENT_CATALOG_HISTORY`` versions is kept so
+``?since=`` deltas can be computed by diffing against the current rows.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from .models import Ingredient
+from .transactions import on_commit_once
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CURRENT = 'current'
+VERSION_PATTERN = re.compile(r'[0-9a-f]{16}')
+# Preferred first
+ENCODINGS = ('br', 'gzip')
+
+
+def _compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=11)
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+def available_encodings():
+    return tuple(encoding for encoding in ENCODINGS
+                 if encoding != 'br' or brotli is not None)
+
+
+def choose_encoding(accept_encoding, available):
+    """Return the preferred encoding the client accepts, or ``None``."""
+    accepted = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for encoding in available:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def _write_atomic(path, content):
+    temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporary_path, 'wb') as output:
+        output.write(content)
+    os.replace(temporary_path, path)
+
+
+class _Version:
+    """One catalog version loaded into memory."""
+
+    def __init__(self, directory, version, stat):
+        self.directory = directory
+        self.version = version
+        self.stat = stat
+        self.modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+        self.bodies = {}
+        path = os.path.join(directory, f'{version}.json')
+        with open(path, 'rb') as source:
+            self.bodies[None] = source.read()
+        for encoding in available_encodings():
+            try:
+                with open(f'{path}.{encoding}', 'rb') as source:
+                    self.bodies[encoding] = source.read()
+            except FileNotFoundError:
+                pass
+        self._rows = None
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = json.loads(self.bodies[None])
+        return self._rows
+
+    def etag(self, encoding):
+        if encoding is None:
+            return f'"{self.version}"'
+        return f'"{self.version}-{encoding}"'
+
+
+class IngredientCatalog:
+    """Process-wide handle on the shared catalog files."""
+
+    def __init__(self, directory=None):
+        self._directory = directory
+        self._current = None
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        return self._directory or settings.INGREDIENT_CATALOG_DIR
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def build(self):
+        """Render the catalog from the database and make it current."""
+        rows = list(Ingredient.objects.order_by('name', 'id').values(
+            'id', 'name', 'measurement_unit'))
+        # Byte for byte what the JSON renderer would produce
+        content = json.dumps(rows, ensure_ascii=False,
+                             separators=(',', ':')).encode('utf-8')
+        version = hashlib.sha256(content).hexdigest()[:16]
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(f'{version}.json')
+        _write_atomic(path, content)
+        for encoding in available_encodings():
+            _write_atomic(f'{path}.{encoding}',
+                          _compress(content, encoding))
+        if self._read_pointer() != version:
+            _write_atomic(self.path(CURRENT), version.encode())
+        self._prune(version)
+        return version
+
+    def _read_pointer(self):
+        try:
+            with open(self.path(CURRENT)) as pointer_file:
+                return pointer_file.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _prune(self, current):
+        versions = sorted(
+            (entry for entry in os.scandir(self.directory)
+             if entry.name.endswith('.json')
+             and entry.name[:-5] != current),
+            key=lambda entry: entry.stat().st_mtime_ns, reverse=True)
+        for index, entry in enumerate(versions):
+            # Old versions only serve as a base for deltas
+            for encoding in ENCODINGS:
+                self._remove(f'{entry.path}.{encoding}')
+            if index >= settings.INGREDIENT_CATALOG_HISTORY:
+                self._remove(entry.path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def schedule_rebuild(self):
+        """Rebuild once the current transaction commits."""
+        on_commit_once(('ingredient-catalog', self.directory), self.build)
+
+    def current(self):
+        pointer = self.path(CURRENT)
+        for _ in range(2):
+            try:
+                stat = os.stat(pointer)
+                with self._lock:
+                    loaded = self._current
+                    if (loaded is None
+                            or loaded.directory != self.directory
+                            or loaded.stat.st_ino != stat.st_ino
+                            or loaded.stat.st_mtime_ns != stat.st_mtime_ns):
+                        loaded = self._current = _Version(
+                            self.directory, self._read_pointer(), stat)
+                return loaded
+            except FileNotFoundError:
+                # First use, or the version was pruned by a newer build
+                self.build()
+        raise FileNotFoundError(pointer)
+
+    def delta(self, since):
+        """Return rows changed and ids deleted since version ``since``.
+
+        Returns ``None`` when ``since`` is unknown or no longer kept.
+        """
+        current = self.current()
+        if since == current.version:
+            return {'version': since, 'changed': [], 'deleted': []}
+        if not VERSION_PATTERN.fullmatch(since):
+            return None
+        try:
+            with open(self.path(f'{since}.json'), 'rb') as source:
+                previous = {row['id']: row for row in json.load(source)}
+        except FileNotFoundError:
+            return None
+        rows = {row['id']: row for row in current.rows}
+        return {
+            'version': current.version,
+            'changed': [row for pk, row in rows.items()
+                        if previous.get(pk) != row],
+            'deleted': sorted(previous.keys() - rows.keys()),
+        }
+
+
+ingredient_catalog = IngredientCatalog()
@@ -0,0 +1,181 @@
+"""Prefix index over the ingredient catalog used by autocomplete.
+
+The catalog is written once to a snapshot file sorted by lowercased name and
+memory-mapped by every worker, so gunicorn workers share a single copy
+through the page cache instead of each holding their own.
+
+Snapshot layout::
+
+    header   magic, record count
+    offsets  count + 1 native unsigned ints, absolute record offsets
+    records  key \\x1f id \\x1f name \\x1f measurement_unit \\x1e
+"""
+import bisect
+import mmap
+import os
+import struct
+import threading
+from array import array
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import Ingredient
+from .transactions import on_commit_once
+
+MAGIC = b'FGI1'
+HEADER = struct.Struct('=4sI')
+FIELD_SEP = b'\x1f'
+RECORD_SEP = b'\x1e'
+
+
+def normalize(value):
+    """Return the lookup key for an ingredient name or query."""
+    return value.strip().lower().encode('utf-8')
+
+
+def _clean(value):
+    return value.replace('\x1f', ' ').replace('\x1e', ' ')
+
+
+class _Snapshot:
+    """Read-only view over one memory-mapped snapshot file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self.stat = os.fstat(snapshot_file.fileno())
+            self.buffer = mmap.mmap(
+                snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not an ingredient index snapshot.')
+        start = HEADER.size
+        end = start + (self.count + 1) * array('I').itemsize
+        self.offsets = memoryview(self.buffer)[start:end].cast('I')
+
+    @property
+    def modified(self):
+        return datetime.fromtimestamp(self.stat.st_mtime, timezone.utc)
+
+    def key(self, index):
+        start = self.offsets[index]
+        return self.buffer[start:self.buffer.find(FIELD_SEP, start)]
+
+    def record(self, index):
+        raw = self.buffer[self.offsets[index]:self.offsets[index + 1] - 1]
+        _, pk, name, unit = raw.decode('utf-8').split('\x1f')
+        return {'id': int(pk), 'name': name, 'measurement_unit': unit}
+
+    def prefix_matches(self, prefix):
+        index = bisect.bisect_left(range(self.count), prefix, key=self.key)
+        while index < self.count and self.key(index).startswith(prefix):
+            yield index
+            index += 1
+
+    def substring_matches(self, needle):
+        """Yield records whose key contains ``needle`` past its start."""
+        if not self.count:
+            return
+        end = self.offsets[self.count]
+        position = self.buffer.find(needle, self.offsets[0], end)
+        while position != -1:
+            index = bisect.bisect_right(self.offsets, position) - 1
+            start = self.offsets[index]
+            key_end = self.buffer.find(FIELD_SEP, start)
+            # The earliest hit decides: a key that starts with the needle
+            # is a prefix match, and hits past the key are in other fields.
+            if start < position and position + len(needle) <= key_end:
+                yield index
+            position = self.buffer.find(
+                needle, self.offsets[index + 1], end)
+
+
+class IngredientIndex:
+    """Process-wide handle on the shared ingredient snapshot."""
+
+    def __init__(self, path=None):
+        self._path = path
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self._path or settings.INGREDIENT_INDEX_PATH
+
+    def build(self):
+        """Write a fresh snapshot from the database and load it."""
+        rows = sorted(
+            (normalize(name), pk, _clean(name), _clean(unit))
+            for pk, name, unit in Ingredient.objects.order_by().values_list(
+                'id', 'name', 'measurement_unit')
+        )
+        offsets = array('I')
+        records = bytearray()
+        data_start = HEADER.size + (len(rows) + 1) * offsets.itemsize
+        for key, pk, name, unit in rows:
+            offsets.append(data_start + len(records))
+            records += FIELD_SEP.join(
+                (key, str(pk).encode(), name.encode('utf-8'),
+                 unit.encode('utf-8'))
+            ) + RECORD_SEP
+        offsets.append(data_start + len(records))
+
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        temporary_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as snapshot_file:
+            snapshot_file.write(HEADER.pack(MAGIC, len(rows)))
+            snapshot_file.write(offsets.tobytes())
+            snapshot_file.write(records)
+        # Readers keep their mapping of the old inode until they reload.
+        os.replace(temporary_path, self.path)
+        with self._lock:
+            self._snapshot = _Snapshot(self.path)
+        return len(rows)
+
+    def schedule_rebuild(self):
+        """Rebuild once the current transaction commits.
+
+        Repeated calls inside one transaction, such as an admin import,
+        collapse into a single rebuild.
+        """
+        on_commit_once(('ingredient-index', self.path), self.build)
+
+    def snapshot(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.build()
+            return self._snapshot
+        with self._lock:
+            current = self._snapshot
+            if (current is None
+                    or current.stat.st_ino != stat.st_ino
+                    or current.stat.st_mtime_ns != stat.st_mtime_ns):
+                current = self._snapshot = _Snapshot(self.path)
+        return current
+
+    async def asnapshot(self):
+        if not os.path.exists(self.path):
+            # Only the first use builds from the database
+            await sync_to_async(self.build)()
+        return self.snapshot()
+
+    def search(self, query, limit=None):
+        """Return prefix matches followed by substring matches."""
+        needle = normalize(query)
+        if not needle:
+            return []
+        snapshot = self.snapshot()
+        results = []
+        for matches in (snapshot.prefix_matches(needle),
+                        snapshot.substring_matches(needle)):
+            for index in matches:
+                if limit is not None and len(results) >= limit:
+                    return results
+                results.append(snapshot.record(index))
+        return results
+
+
+ingredient_index = IngredientIndex()
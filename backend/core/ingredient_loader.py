@@ -0,0 +1,158 @@
+"""Bulk ingredient loader behind ``load_ingredients`` and the admin import.
+
+Rows are streamed from CSV (``name,measurement_unit``, header optional) or
+a JSON array of objects and written in chunks: one query finds the chunk's
+ingredients that already exist and one multi-row INSERT adds the rest.
+``(name, measurement_unit)`` is unique and is the whole row, so there is
+nothing to update on a conflict: loading a file twice changes nothing and
+rows inserted concurrently are ignored rather than duplicated.
+"""
+import csv
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .ingredient_catalog import ingredient_catalog
+from .ingredient_index import ingredient_index
+from .models import Ingredient
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('name', 'measurement_unit')
+
+_executor = None
+
+
+def read_csv(source):
+    for number, row in enumerate(csv.reader(source)):
+        if not row:
+            continue
+        if number == 0 and [cell.strip().lower() for cell in row] == list(
+                FIELDS):
+            continue
+        yield tuple(row[:2]) if len(row) >= 2 else (None, None)
+
+
+def read_json(source, block_size=64 * 1024):
+    """Yield the rows of a JSON array of objects without loading it whole."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    opened = False
+    while True:
+        block = source.read(block_size)
+        buffer += block
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not opened and buffer[position:position + 1] == '[':
+                opened = True
+                position += 1
+                continue
+            if buffer[position:position + 1] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Incomplete object, wait for the next block
+                break
+            if not opened or not isinstance(item, dict):
+                raise ValueError('Expected a JSON array of objects.')
+            yield item.get('name'), item.get('measurement_unit')
+        buffer = buffer[position:]
+        if not block:
+            raise ValueError('Unexpected end of the JSON array.')
+
+
+def clean(name, measurement_unit):
+    """Return the row stripped, or ``None`` when it cannot be stored."""
+    if not isinstance(name, str) or not isinstance(measurement_unit, str):
+        return None
+    name, measurement_unit = name.strip(), measurement_unit.strip()
+    for field, value in zip(FIELDS, (name, measurement_unit)):
+        if not value or len(value) > Ingredient._meta.get_field(
+                field).max_length:
+            return None
+    return name, measurement_unit
+
+
+def write_chunk(rows, counts):
+    unique = dict.fromkeys(rows)
+    counts['skipped'] += len(rows) - len(unique)
+    existing = set(Ingredient.objects.filter(
+        name__in={name for name, _ in unique}
+    ).values_list(*FIELDS))
+    new = [Ingredient(name=name, measurement_unit=measurement_unit)
+           for name, measurement_unit in unique
+           if (name, measurement_unit) not in existing]
+    Ingredient.objects.bulk_create(new, ignore_conflicts=True)
+    counts['inserted'] += len(new)
+    counts['unchanged'] += len(unique) - len(new)
+
+
+def load(path, chunk_size=None):
+    """Load ingredients from ``path`` and return the row counts.
+
+    Returns a dict of ``inserted``, ``unchanged`` (already present) and
+    ``skipped`` (invalid or repeated) rows.
+    """
+    chunk_size = chunk_size or settings.INGREDIENT_LOAD_CHUNK_SIZE
+    reader = read_json if path.endswith('.json') else read_csv
+    counts = {'inserted': 0, 'unchanged': 0, 'skipped': 0}
+    with open(path, encoding='utf-8-sig', newline='') as source:
+        rows = reader(source)
+        while chunk := list(islice(rows, chunk_size)):
+            cleaned = [row for row in (clean(*row) for row in chunk) if row]
+            counts['skipped'] += len(chunk) - len(cleaned)
+            with transaction.atomic():
+                write_chunk(cleaned, counts)
+    if counts['inserted']:
+        # bulk_create sends no signals
+        ingredient_index.schedule_rebuild()
+        ingredient_catalog.schedule_rebuild()
+    return counts
+
+
+def _load_file(path, delete):
+    try:
+        counts = load(path)
+    finally:
+        if delete:
+            os.remove(path)
+    logger.info('Loaded ingredients from %s: %s', path, counts)
+    return counts
+
+
+def _load_in_background(path, delete):
+    try:
+        _load_file(path, delete)
+    except Exception:
+        logger.exception('Loading ingredients from %s failed', path)
+    finally:
+        connections.close_all()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # One worker, so loads never race each other
+        _executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='ingredient-load')
+    return _executor
+
+
+def schedule_load(path, delete=False):
+    """Load ``path`` after commit, on a background thread unless testing.
+
+    ``delete`` removes the file once loaded, e.g. an uploaded copy.
+    """
+    if settings.INGREDIENT_LOAD_ASYNC:
+        transaction.on_commit(lambda: _get_executor().submit(
+            _load_in_background, path, delete))
+    else:
+        transaction.on_commit(lambda: _load_file(path, delete))
@@ -0,0 +1,196 @@
+"""In-memory index for finding recipes by the ingredients they use.
+
+Each ingredient maps to a sorted array of the ids of recipes that use it,
+and each recipe id to its number of ingredients, so ``all``/``any``
+matches are set operations over posting lists and ``best`` coverage
+ranking needs no join or GROUP BY.
+
+Every worker keeps its own copy.  A committed change to a recipe's
+ingredients bumps the ``recipe-ingredients`` generation and logs the
+recipe id in the cache under the new generation; workers replay the ids
+they missed, reloading only those recipes, and rebuild from scratch when
+the log has gaps or they fell too far behind.
+"""
+import bisect
+import heapq
+import threading
+from array import array
+
+from django.core.cache import cache
+
+from .generations import bump_generation, get_generation
+from .models import RecipeIngredient
+from .transactions import on_commit_once
+
+GENERATION = 'recipe-ingredients'
+CHANGE_KEY = 'recipe-ingredients:change'
+# Changes replayed one by one; beyond that a rebuild is cheaper
+MAX_REPLAY = 500
+CHANGE_TIMEOUT = 24 * 60 * 60
+MATCH_MODES = ('all', 'any', 'best')
+
+
+def record_change(recipe_id):
+    """Have every worker reload ``recipe_id`` once the transaction commits."""
+    on_commit_once(('ingredient-sets', recipe_id),
+                   lambda: _publish(recipe_id))
+
+
+def _publish(recipe_id):
+    generation = bump_generation(GENERATION)
+    cache.set(f'{CHANGE_KEY}:{generation}', recipe_id, CHANGE_TIMEOUT)
+
+
+def _discard(posting, recipe_id):
+    index = bisect.bisect_left(posting, recipe_id)
+    if index < len(posting) and posting[index] == recipe_id:
+        del posting[index]
+
+
+class IngredientSetIndex:
+    def __init__(self):
+        self.generation = None
+        self.postings = {}
+        self.sizes = array('H')
+        self._lock = threading.Lock()
+
+    def build(self, generation=None):
+        postings = {}
+        sizes = array('H')
+        rows = RecipeIngredient.objects.order_by('recipe_id').values_list(
+            'recipe_id', 'ingredient_id').iterator(chunk_size=20000)
+        for recipe_id, ingredient_id in rows:
+            # Rows come in recipe order, so every posting stays sorted
+            postings.setdefault(ingredient_id, array('I')).append(recipe_id)
+            if recipe_id >= len(sizes):
+                sizes.extend(bytes(2 * (recipe_id + 1 - len(sizes))))
+            sizes[recipe_id] += 1
+        self.postings = postings
+        self.sizes = sizes
+        self.generation = generation
+
+    def reload(self, recipe_ids):
+        """Re-read the ingredients of ``recipe_ids`` into the index."""
+        for recipe_id in recipe_ids:
+            for posting in self.postings.values():
+                _discard(posting, recipe_id)
+            if recipe_id < len(self.sizes):
+                self.sizes[recipe_id] = 0
+        rows = RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids).values_list('recipe_id', 'ingredient_id')
+        for recipe_id, ingredient_id in rows:
+            bisect.insort(
+                self.postings.setdefault(ingredient_id, array('I')),
+                recipe_id)
+            if recipe_id >= len(self.sizes):
+                self.sizes.extend(
+                    bytes(2 * (recipe_id + 1 - len(self.sizes))))
+            self.sizes[recipe_id] += 1
+
+    def current(self):
+        generation = get_generation(GENERATION)
+        with self._lock:
+            behind = (generation - self.generation
+                      if self.generation is not None else None)
+            if behind is None or not 0 <= behind <= MAX_REPLAY:
+                self.build(generation)
+            elif behind:
+                keys = [f'{CHANGE_KEY}:{number}' for number in
+                        range(self.generation + 1, generation + 1)]
+                changes = cache.get_many(keys)
+                if len(changes) == len(keys):
+                    self.reload(set(changes.values()))
+                    self.generation = generation
+                else:
+                    self.build(generation)
+        return self
+
+    def match(self, ingredient_ids, mode='all', limit=None):
+        """Return ``[(recipe_id, coverage)]`` for the given ingredients.
+
+        ``all`` and ``any`` return the newest recipes first; ``best``
+        returns every recipe using any of the ingredients, ranked by the
+        fraction of its ingredients among them.
+        """
+        postings = [self.postings.get(pk, array('I'))
+                    for pk in set(ingredient_ids)]
+        if not postings:
+            return []
+        if mode == 'best':
+            hits = {}
+            for posting in postings:
+                for recipe_id in posting:
+                    hits[recipe_id] = hits.get(recipe_id, 0) + 1
+            ranked = (
+                (recipe_id, count / self.sizes[recipe_id])
+                for recipe_id, count in hits.items()
+            )
+            key = lambda item: (item[1], item[0])  # noqa: E731
+            if limit is None:
+                return sorted(ranked, key=key, reverse=True)
+            return heapq.nlargest(limit, ranked, key=key)
+
+        if mode == 'any':
+            recipe_ids = set().union(*postings)
+        else:
+            postings.sort(key=len)
+            recipe_ids = set(postings[0]).intersection(*postings[1:])
+        recipe_ids = sorted(recipe_ids, reverse=True)[:limit]
+        return [(recipe_id, None) for recipe_id in recipe_ids]
+
+
+ingredient_sets = IngredientSetIndex()
+
+
+class RecipeMatches:
+    """Ranked matches that load only the recipes of the page asked for.
+
+    Counting and slicing work on the in-memory ranking, so at most a page
+    of ids reaches the database; the recipes of a slice come from
+    ``queryset``, in ranked order.
+    """
+    # For the paginator, which warns about unordered lists
+    ordered = True
+
+    def __init__(self, queryset, matches):
+        self.queryset = queryset
+        self.matches = matches
+
+    def __len__(self):
+        return len(self.matches)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        matches = self.matches[index]
+        recipes = {recipe.pk: recipe for recipe in self.queryset.filter(
+            pk__in=[pk for pk, _ in matches])}
+        page = []
+        for pk, coverage in matches:
+            # Deleted since the index was read
+            if pk not in recipes:
+                continue
+            if coverage is not None:
+                recipes[pk].ingredient_coverage = coverage
+            page.append(recipes[pk])
+        return page
+
+
+def match_recipes(queryset, ingredient_ids, mode='all', limit=None):
+    """Return the ``RecipeMatches`` of ``queryset`` for the ingredient set.
+
+    With ``best`` only the ``limit`` best matches that pass the filters of
+    ``queryset`` are kept, and pages set their ``ingredient_coverage``;
+    ``all`` and ``any`` keep every match.  The filters are applied by
+    reading the ids ``queryset`` selects rather than by sending it the
+    matches.
+    """
+    if not queryset.query.has_filters():
+        return RecipeMatches(queryset, ingredient_sets.current().match(
+            ingredient_ids, mode, limit if mode == 'best' else None))
+    matches = ingredient_sets.current().match(ingredient_ids, mode)
+    kept = set(queryset.order_by().values_list('pk', flat=True))
+    matches = [match for match in matches if match[0] in kept]
+    if mode == 'best':
+        matches = matches[:limit]
+    return RecipeMatches(queryset, matches)
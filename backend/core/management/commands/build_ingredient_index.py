@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core.ingredient_catalog import ingredient_catalog
+from core.ingredient_index import ingredient_index
+
+
+class Command(BaseCommand):
+    help = 'Build the shared ingredient autocomplete snapshot and catalog.'
+
+    def handle(self, *args, **options):
+        count = ingredient_index.build()
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count} ingredients into {ingredient_index.path}'))
+        version = ingredient_catalog.build()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered catalog version {version} into '
+            f'{ingredient_catalog.directory}'))
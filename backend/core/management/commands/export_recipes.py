@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import recipe_transfer
+
+
+class Command(BaseCommand):
+    help = ('Stream every recipe with its authors (including password '
+            'hashes) and ingredients to an NDJSON file, compressed when it '
+            'ends in .zst or .gz.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='e.g. recipes.ndjson.zst')
+        parser.add_argument(
+            '--batch-size', type=int,
+            help='Rows fetched per query (RECIPE_TRANSFER_BATCH_SIZE).')
+
+    def handle(self, *args, path, batch_size, **options):
+        try:
+            with recipe_transfer.open_dump(path, 'w') as output:
+                counts = recipe_transfer.export(output, batch_size)
+        except (ImportError, OSError) as error:
+            raise CommandError(f'Cannot export to {path}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {counts["recipe"]} recipes, {counts["user"]} authors '
+            f'and {counts["ingredient"]} ingredients to {path}'))
@@ -0,0 +1,55 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core import dataset, ingredient_loader
+
+DEFAULT_INGREDIENTS = os.path.join(
+    settings.BASE_DIR.parent, 'data', 'ingredients.json')
+
+
+class Command(BaseCommand):
+    help = ('Append a deterministic synthetic dataset of users, recipes, '
+            'favorites, carts and subscriptions with skewed popularity.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Rows per COPY or INSERT.')
+        parser.add_argument(
+            '--password',
+            help='Password of every generated user; unusable by default.')
+        parser.add_argument(
+            '--ingredients', default=DEFAULT_INGREDIENTS,
+            help='Catalog loaded first if present (load_ingredients).')
+
+    def handle(self, *args, users, recipes, seed, batch_size, password,
+               ingredients, **options):
+        if users < 1 or recipes < 0:
+            raise CommandError('Need at least one user.')
+        if os.path.exists(ingredients):
+            ingredient_loader.load(ingredients)
+
+        started = time.perf_counter()
+
+        def progress(table, rows):
+            if options['verbosity']:
+                self.stdout.write(f'{table}: {rows} rows '
+                                  f'({time.perf_counter() - started:.1f}s)')
+
+        try:
+            with transaction.atomic():
+                counts = dataset.generate(
+                    users, recipes, seed, batch_size, password, progress)
+        except ValueError as error:
+            raise CommandError(error)
+        if options['verbosity']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Generated {sum(counts.values())} rows in '
+                f'{time.perf_counter() - started:.1f}s'))
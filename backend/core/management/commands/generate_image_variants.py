@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from core.images import AVATAR_VARIANTS, RECIPE_VARIANTS, build_variants
+from core.models import Recipe, UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Render missing resized variants of recipe images and avatars.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true', dest='rerender',
+            help='Re-render variants that already exist.')
+
+    def handle(self, *args, rerender, **options):
+        targets = (
+            (Recipe, 'image', 'image_variants', RECIPE_VARIANTS),
+            (UserProfile, 'avatar', 'avatar_variants', AVATAR_VARIANTS),
+        )
+        for model, field_name, variants_field, sizes in targets:
+            rows = model.objects.exclude(**{field_name: ''}).exclude(
+                **{f'{field_name}__isnull': True})
+            if not rerender:
+                rows = rows.filter(**{variants_field: {}})
+            rendered = 0
+            for pk, name in rows.values_list('pk', field_name).iterator():
+                try:
+                    build_variants(model, pk, field_name, variants_field,
+                                   name, sizes)
+                except OSError as error:
+                    self.stderr.write(f'{name}: {error}')
+                    continue
+                rendered += 1
+            self.stdout.write(self.style.SUCCESS(
+                f'Rendered variants for {rendered} '
+                f'{model._meta.verbose_name_plural.lower()}'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import recipe_transfer
+
+
+class Command(BaseCommand):
+    help = ('Import a dump written by export_recipes in batches, resuming '
+            'from its checkpoint file if a previous run was interrupted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='e.g. recipes.ndjson.zst')
+        parser.add_argument(
+            '--batch-size', type=int,
+            help='Lines per transaction (RECIPE_TRANSFER_BATCH_SIZE).')
+        parser.add_argument(
+            '--checkpoint',
+            help='Progress file, by default the dump path + .checkpoint.')
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignore the checkpoint and import from the first line.')
+
+    def handle(self, *args, path, batch_size, checkpoint, restart,
+               **options):
+        def progress(line, counts):
+            if options['verbosity'] > 1:
+                self.stdout.write(
+                    f'{line} lines, {counts["recipes created"]} recipes')
+
+        importer = recipe_transfer.Importer(
+            path, checkpoint, batch_size, progress)
+        try:
+            counts = importer.run(resume=not restart)
+        except (ImportError, OSError, ValueError, KeyError) as error:
+            raise CommandError(
+                f'Cannot import {path}: {error!r}; rerun to resume from '
+                f'{importer.checkpoint}')
+        self.stdout.write(self.style.SUCCESS(', '.join(
+            f'{name} {count}' for name, count in sorted(counts.items()))))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import ingredient_loader
+
+
+class Command(BaseCommand):
+    help = ('Load ingredients from a CSV file or a JSON array, skipping the '
+            'ones already present.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='e.g. data/ingredients.csv or data/ingredients.json')
+        parser.add_argument(
+            '--chunk-size', type=int,
+            help='Rows written per query (INGREDIENT_LOAD_CHUNK_SIZE).')
+
+    def handle(self, *args, path, chunk_size, **options):
+        try:
+            counts = ingredient_loader.load(path, chunk_size)
+        except (OSError, ValueError, UnicodeDecodeError) as error:
+            raise CommandError(f'Cannot load {path}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Inserted {counts["inserted"]}, unchanged {counts["unchanged"]}, '
+            f'skipped {counts["skipped"]} ingredients from {path}'))
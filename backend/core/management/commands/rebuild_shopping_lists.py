@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core import shopping_list
+
+
+class Command(BaseCommand):
+    help = ('Verify the materialized shopping list totals against the live '
+            'cart aggregation and rebuild them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only report drift; exit with an error if any is found.')
+        parser.add_argument(
+            '--user', type=int, action='append', dest='user_ids',
+            help='Limit to the given user id (repeatable).')
+
+    def handle(self, *args, verify, user_ids, **options):
+        drift = shopping_list.find_drift(user_ids)
+        for (user_id, ingredient_id), (stored, live) in sorted(
+                drift.items()):
+            self.stdout.write(
+                f'user {user_id}, ingredient {ingredient_id}: '
+                f'stored {stored}, live {live}')
+
+        if verify:
+            if drift:
+                raise CommandError(f'{len(drift)} shopping list rows drifted.')
+            self.stdout.write(
+                self.style.SUCCESS('Shopping lists are in sync.'))
+            return
+
+        with transaction.atomic():
+            count = shopping_list.rebuild(user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {count} shopping list rows, '
+            f'{len(drift)} had drifted.'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import counters
+
+
+class Command(BaseCommand):
+    help = ('Recompute the favorite, cart, recipe and subscriber counters '
+            'and repair any that drifted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report how many rows drifted.')
+
+    def handle(self, *args, dry_run, **options):
+        with transaction.atomic():
+            drift = counters.reconcile(dry_run=dry_run)
+        verb = 'Found' if dry_run else 'Repaired'
+        for name, count in drift.items():
+            self.stdout.write(f'{verb} {count} {name}')
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-17 03:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_alter_shoppingcart_recipe'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-date_published', '-id'], name='recipe_feed_idx'),
+        ),
+    ]
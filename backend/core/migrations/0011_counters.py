@@ -0,0 +1,64 @@
+# Generated by Django 5.1.4 on 2026-10-17 04:00
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def live_count(model, field, outer_field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef(outer_field)})
+        .order_by().values(field)
+        .annotate(count=Count('pk')).values('count')
+    ), Value(0))
+
+
+def populate_counters(apps, schema_editor):
+    get_model = apps.get_model
+    get_model('core', 'Recipe').objects.update(
+        favorites_count=live_count(
+            get_model('core', 'Favorite'), 'recipe', 'pk'),
+        in_carts_count=live_count(
+            get_model('core', 'ShoppingCart'), 'recipe', 'pk'),
+    )
+    get_model('core', 'UserProfile').objects.update(
+        recipes_count=live_count(
+            get_model('core', 'Recipe'), 'author', 'user'),
+        subscribers_count=live_count(
+            get_model('core', 'Subscription'), 'author', 'user'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='subscription',
+            name='recipes_count',
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Added to favorites'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Added to shopping carts'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='recipes_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Number of Recipes'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='subscribers_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Number of Subscribers'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
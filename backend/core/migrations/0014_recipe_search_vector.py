@@ -0,0 +1,57 @@
+# Generated by Django 5.1.4 on 2026-10-17 06:05
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# The configuration must match core.recipe_search.SEARCH_CONFIG
+CREATE_TRIGGER = """
+CREATE FUNCTION core_recipe_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce(NEW.text, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_recipe_search_vector
+BEFORE INSERT OR UPDATE OF name, text ON core_recipe
+FOR EACH ROW EXECUTE FUNCTION core_recipe_search_vector();
+
+UPDATE core_recipe SET search_vector =
+    setweight(to_tsvector('russian', coalesce(name, '')), 'A')
+    || setweight(to_tsvector('russian', coalesce(text, '')), 'B');
+
+CREATE INDEX recipe_search_idx ON core_recipe USING gin (search_vector);
+"""
+
+DROP_TRIGGER = """
+DROP INDEX IF EXISTS recipe_search_idx;
+DROP TRIGGER IF EXISTS core_recipe_search_vector ON core_recipe;
+DROP FUNCTION IF EXISTS core_recipe_search_vector();
+"""
+
+
+def run_on_postgres(sql):
+    # Other backends search through the in-process fallback index
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(run_on_postgres(CREATE_TRIGGER),
+                             run_on_postgres(DROP_TRIGGER)),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.4 on 2026-10-17 06:40
+
+from django.db import migrations
+from django.db.models import Count, F, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    """Fold repeated ``(name, measurement_unit)`` rows into the oldest."""
+    Ingredient = apps.get_model('core', 'Ingredient')
+    RecipeIngredient = apps.get_model('core', 'RecipeIngredient')
+    ShoppingListItem = apps.get_model('core', 'ShoppingListItem')
+    groups = Ingredient.objects.values('name', 'measurement_unit').annotate(
+        keep=Min('id'), copies=Count('id')).filter(copies__gt=1)
+    for group in groups:
+        copies = Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(pk=group['keep'])
+        for model, owner, amount in (
+                (RecipeIngredient, 'recipe_id', 'amount'),
+                (ShoppingListItem, 'user_id', 'total_amount')):
+            for row in model.objects.filter(ingredient__in=copies):
+                # Amounts of an owner already using the kept row add up
+                merged = model.objects.filter(
+                    ingredient_id=group['keep'],
+                    **{owner: getattr(row, owner)}
+                ).update(**{amount: F(amount) + getattr(row, amount)})
+                if merged:
+                    row.delete()
+                else:
+                    row.ingredient_id = group['keep']
+                    row.save(update_fields=['ingredient'])
+        copies.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='ingredient',
+            unique_together={('name', 'measurement_unit')},
+        ),
+    ]
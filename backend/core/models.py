@@ -1,3 +1,4 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.core.validators import MinValueValidator
 from django.contrib.auth import get_user_model
@@ -6,7 +7,29 @@ from django.utils.timezone import now
 User = get_user_model()
 
 
-class UserProfile(models.Model):
+class CounterFieldsMixin:
+    """Keep denormalized counters out of regular saves.
+
+    Counters are only changed through F() updates, so saving an instance
+    loaded earlier must not write back a stale value.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+class UserProfile(CounterFieldsMixin, models.Model):
+    counter_fields = ('recipes_count', 'subscribers_count')
+
     user = models.OneToOneField(
         User,
         on_delete=models.CASCADE,
@@ -19,6 +42,26 @@ class UserProfile(models.Model):
         null=True,
         verbose_name='Avatar'
     )
+    avatar_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Avatar Variants'
+    )
+    recipes_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Number of Recipes'
+    )
+    subscribers_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Number of Subscribers'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Updated At'
+    )
 
     class Meta:
         verbose_name = 'User Profile'
@@ -37,8 +80,13 @@ class Ingredient(models.Model):
         max_length=64,
         verbose_name='Measurement Unit'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Updated At'
+    )
 
     class Meta:
+        unique_together = ('name', 'measurement_unit')
         verbose_name = 'Ingredient'
         verbose_name_plural = 'Ingredients'
         ordering = ['name']
@@ -47,7 +95,15 @@ class Ingredient(models.Model):
         return f'{self.name} ({self.measurement_unit})'
 
 
-class Recipe(models.Model):
+class RecipeManager(models.Manager):
+    def get_queryset(self):
+        # The search vector is only ever read by the database
+        return super().get_queryset().defer('search_vector')
+
+
+class Recipe(CounterFieldsMixin, models.Model):
+    counter_fields = ('favorites_count', 'in_carts_count')
+
     author = models.ForeignKey(
         User,
         related_name='recipes',
@@ -62,6 +118,12 @@ class Recipe(models.Model):
         upload_to='recipes/images/',
         verbose_name='Image'
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Image Variants'
+    )
     text = models.TextField(
         verbose_name='Description'
     )
@@ -73,11 +135,37 @@ class Recipe(models.Model):
         default=now,
         verbose_name='Date Published'
     )
+    favorites_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Added to favorites'
+    )
+    in_carts_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Added to shopping carts'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Updated At'
+    )
+    # Maintained by a trigger on PostgreSQL, see core.recipe_search
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False
+    )
+
+    objects = RecipeManager()
 
     class Meta:
         verbose_name = 'Recipe'
         verbose_name_plural = 'Recipes'
         ordering = ['-date_published']
+        indexes = [
+            # Keyset pagination of the feed
+            models.Index(fields=['-date_published', '-id'],
+                         name='recipe_feed_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -156,6 +244,35 @@ class ShoppingCart(models.Model):
         return f'{self.user.username} has {self.recipe.name} in cart'
 
 
+class ShoppingListItem(models.Model):
+    """Running total of an ingredient across a user's shopping cart."""
+    user = models.ForeignKey(
+        User,
+        related_name='shopping_list_items',
+        on_delete=models.CASCADE,
+        verbose_name='User'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        related_name='shopping_list_items',
+        on_delete=models.CASCADE,
+        verbose_name='Ingredient'
+    )
+    total_amount = models.IntegerField(
+        default=0,
+        verbose_name='Total Amount'
+    )
+
+    class Meta:
+        unique_together = ('user', 'ingredient')
+        verbose_name = 'Shopping List Item'
+        verbose_name_plural = 'Shopping List Items'
+
+    def __str__(self):
+        return (f'{self.user.username} needs {self.total_amount} '
+                f'{self.ingredient.name}')
+
+
 class Subscription(models.Model):
     user = models.ForeignKey(
         User,
@@ -169,10 +286,6 @@ class Subscription(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Author'
     )
-    recipes_count = models.IntegerField(
-        default=0,
-        verbose_name='Number of Recipes'
-    )
 
     class Meta:
         unique_together = ('user', 'author')
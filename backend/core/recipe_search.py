@@ -0,0 +1,171 @@
+"""Ranked full-text search over recipe names and descriptions.
+
+On PostgreSQL ``Recipe.search_vector`` is kept current by a trigger (see
+migration 0014) and GIN-indexed: matches come from a ``websearch`` query,
+are ranked with ``ts_rank`` and highlighted with ``ts_headline``.
+
+Other databases, i.e. the SQLite test configuration, fall back to an
+in-process inverted index over the same two fields.  It is built on the
+first search and rebuilt when the ``recipe-search`` generation moves, so
+every worker follows writes made by the others.  The fallback matches whole
+words only, without stemming.
+"""
+import html
+import math
+import re
+import threading
+from array import array
+
+from django.contrib.postgres.search import (SearchHeadline, SearchQuery,
+                                            SearchRank)
+from django.db import connections
+from django.db.models import Case, F, FloatField, Value, When
+
+from .generations import get_generation
+from .models import Recipe
+
+SEARCH_GENERATION = 'recipe-search'
+# Must match the text search configuration used by the trigger
+SEARCH_CONFIG = 'russian'
+# Field weights, as ts_rank applies them to weights A and B
+NAME_WEIGHT = 1.0
+TEXT_WEIGHT = 0.4
+SNIPPET_WORDS = 24
+# Matches are delimited with control characters, which survive escaping
+# the snippet and are then swapped for <mark> tags
+START_SEL, STOP_SEL = '\x02', '\x03'
+
+WORD = re.compile(r'\w+')
+
+
+def tokenize(value):
+    return WORD.findall(value.lower())
+
+
+class RecipeIndex:
+    """Inverted index: word -> recipe ids with their weighted counts."""
+
+    def __init__(self):
+        self.generation = None
+        self.postings = {}
+        self.document_count = 0
+        self._lock = threading.Lock()
+
+    def build(self, generation=None):
+        postings = {}
+        document_count = 0
+        rows = Recipe.objects.order_by('id').values_list(
+            'id', 'name', 'text').iterator(chunk_size=10000)
+        for pk, name, text in rows:
+            document_count += 1
+            weights = {}
+            for word in tokenize(name):
+                weights[word] = weights.get(word, 0) + NAME_WEIGHT
+            for word in tokenize(text):
+                weights[word] = weights.get(word, 0) + TEXT_WEIGHT
+            for word, weight in weights.items():
+                ids, scores = postings.get(word) or postings.setdefault(
+                    word, (array('I'), array('f')))
+                ids.append(pk)
+                scores.append(weight)
+        self.postings = postings
+        self.document_count = document_count
+        self.generation = generation
+
+    def current(self):
+        generation = get_generation(SEARCH_GENERATION)
+        with self._lock:
+            if self.generation != generation:
+                self.build(generation)
+        return self
+
+    def idf(self, matches):
+        return math.log(1 + self.document_count / matches)
+
+    def search(self, query, limit=None):
+        """Return ``[(recipe_id, score)]`` matching every word, best first."""
+        words = set(tokenize(query))
+        if not words:
+            return []
+        postings = [self.postings.get(word) for word in words]
+        if not all(postings):
+            return []
+        postings.sort(key=lambda posting: len(posting[0]))
+        scores = None
+        for ids, weights in postings:
+            # Rarer words weigh more
+            factor = self.idf(len(ids))
+            if scores is None:
+                scores = {pk: weight * factor
+                          for pk, weight in zip(ids, weights)}
+            else:
+                scores = {pk: scores[pk] + weight * factor
+                          for pk, weight in zip(ids, weights)
+                          if pk in scores}
+            if not scores:
+                return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return ranked if limit is None else ranked[:limit]
+
+
+recipe_index = RecipeIndex()
+
+
+def uses_postgres(queryset):
+    return connections[queryset.db].vendor == 'postgresql'
+
+
+def search(queryset, query, limit=None):
+    """Filter ``queryset`` to recipes matching ``query``.
+
+    Matches are annotated with ``search_rank``, and on PostgreSQL with a
+    highlighted ``search_snippet`` too.  ``limit`` caps the matches the
+    fallback index passes to the database.
+    """
+    if uses_postgres(queryset):
+        search_query = SearchQuery(query, config=SEARCH_CONFIG,
+                                   search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query),
+            search_snippet=SearchHeadline(
+                'text', search_query, config=SEARCH_CONFIG,
+                start_sel=START_SEL, stop_sel=STOP_SEL,
+                max_words=SNIPPET_WORDS, min_words=SNIPPET_WORDS // 2),
+        )
+
+    ranked = recipe_index.current().search(query, limit)
+    return queryset.filter(pk__in=[pk for pk, _ in ranked]).annotate(
+        search_rank=Case(
+            *(When(pk=pk, then=Value(score)) for pk, score in ranked),
+            default=Value(0.0), output_field=FloatField()))
+
+
+def headline(text, query):
+    """Excerpt of ``text`` around the first match, like ``ts_headline``."""
+    words = set(tokenize(query))
+    tokens = list(WORD.finditer(text))
+    first = next((index for index, match in enumerate(tokens)
+                  if match.group().lower() in words), 0)
+    start = max(first - SNIPPET_WORDS // 4, 0)
+    window = tokens[start:start + SNIPPET_WORDS]
+    if not window:
+        return ''
+    parts = []
+    position = window[0].start()
+    for match in window:
+        parts.append(text[position:match.start()])
+        word = match.group()
+        if word.lower() in words:
+            word = f'{START_SEL}{word}{STOP_SEL}'
+        parts.append(word)
+        position = match.end()
+    return ''.join(parts)
+
+
+def snippet(recipe, query):
+    """HTML excerpt of the recipe text with the matches in <mark>."""
+    value = getattr(recipe, 'search_snippet', None)
+    if value is None:
+        value = headline(recipe.text, query)
+    return (html.escape(value).replace(START_SEL, '<mark>')
+            .replace(STOP_SEL, '</mark>'))
@@ -0,0 +1,296 @@
+"""Streaming NDJSON export and import of recipes.
+
+A dump is one JSON object per line, tagged with its ``type``: the authors,
+then the ingredient catalog, then the recipes with their ingredients.  Media
+are referenced by storage name; the files themselves are copied separately.
+Files ending in ``.zst`` are zstandard-compressed (needs the ``zstandard``
+package) and ``.gz`` gzip-compressed.
+
+Both directions work in batches of ``RECIPE_TRANSFER_BATCH_SIZE`` and keep
+nothing proportional to the number of recipes or users in memory: recipes
+name their author by username, resolved one batch at a time, and
+ingredient ids are remapped through the catalog.  Each imported batch is
+one transaction, after which the number of lines done is written to a
+checkpoint file, so an interrupted import resumes where it stopped.
+"""
+import gzip
+import io
+import json
+import os
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.db.models.functions import Now
+from django.utils.dateparse import parse_datetime
+
+from . import ingredient_sets, recipe_search, short_links
+from .generations import bump_generation_on_commit
+from .ingredient_catalog import ingredient_catalog
+from .ingredient_index import ingredient_index
+from .models import Ingredient, Recipe, RecipeIngredient, UserProfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+User = get_user_model()
+
+FORMAT_VERSION = 1
+USER_FIELDS = ('username', 'email', 'first_name', 'last_name', 'password',
+               'date_joined')
+RECIPE_FIELDS = ('name', 'text', 'cooking_time', 'image', 'image_variants',
+                 'date_published')
+
+
+def open_dump(path, mode):
+    """Open ``path`` as text for ``'r'`` or ``'w'``, compressed by suffix."""
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('Install zstandard to use .zst dumps.')
+        raw = open(path, f'{mode}b')
+        if mode == 'w':
+            stream = zstandard.ZstdCompressor().stream_writer(raw)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    if path.endswith('.gz'):
+        return gzip.open(path, f'{mode}t', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def _write(output, record):
+    output.write(json.dumps(record, ensure_ascii=False, cls=DjangoJSONEncoder))
+    output.write('\n')
+
+
+def export(output, batch_size=None):
+    """Write every recipe with its authors and ingredients to ``output``.
+
+    Returns the number of records written per type.
+    """
+    batch_size = batch_size or settings.RECIPE_TRANSFER_BATCH_SIZE
+    counts = Counter()
+    _write(output, {'type': 'meta', 'format': FORMAT_VERSION})
+
+    authors = User.objects.filter(
+        Exists(Recipe.objects.filter(author=OuterRef('pk')))
+    ).order_by('pk').values(
+        'pk', *USER_FIELDS, 'profiles__avatar', 'profiles__avatar_variants')
+    for author in authors.iterator(chunk_size=batch_size):
+        _write(output, {
+            'type': 'user', 'id': author['pk'],
+            **{field: author[field] for field in USER_FIELDS},
+            'avatar': author['profiles__avatar'] or None,
+            'avatar_variants': author['profiles__avatar_variants'] or {},
+        })
+        counts['user'] += 1
+
+    ingredients = Ingredient.objects.order_by('pk').values_list(
+        'pk', 'name', 'measurement_unit')
+    for pk, name, measurement_unit in ingredients.iterator(
+            chunk_size=batch_size):
+        _write(output, {'type': 'ingredient', 'id': pk, 'name': name,
+                        'measurement_unit': measurement_unit})
+        counts['ingredient'] += 1
+
+    last = 0
+    while True:
+        recipes = list(Recipe.objects.filter(pk__gt=last).order_by(
+            'pk').values('pk', 'author__username', *RECIPE_FIELDS)[
+                :batch_size])
+        if not recipes:
+            break
+        last = recipes[-1]['pk']
+        amounts = defaultdict(list)
+        rows = RecipeIngredient.objects.filter(
+            recipe_id__in=[recipe['pk'] for recipe in recipes]
+        ).order_by('pk').values_list('recipe_id', 'ingredient_id', 'amount')
+        for recipe_id, ingredient_id, amount in rows:
+            amounts[recipe_id].append([ingredient_id, amount])
+        for recipe in recipes:
+            _write(output, {
+                'type': 'recipe', 'id': recipe['pk'],
+                'author': recipe['author__username'],
+                **{field: recipe[field] for field in RECIPE_FIELDS},
+                'ingredients': amounts[recipe['pk']],
+            })
+        counts['recipe'] += len(recipes)
+    return counts
+
+
+class Importer:
+    """Reads a dump line by line and writes it in batches."""
+
+    def __init__(self, path, checkpoint=None, batch_size=None,
+                 progress=None):
+        self.path = path
+        self.checkpoint = checkpoint or f'{path}.checkpoint'
+        self.batch_size = batch_size or settings.RECIPE_TRANSFER_BATCH_SIZE
+        self.progress = progress
+        self.counts = Counter()
+        # Source ingredient id -> local id; bounded by the catalog
+        self.ingredients = {}
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint) as source:
+                return json.load(source)['line']
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, line):
+        temporary_path = f'{self.checkpoint}.tmp'
+        with open(temporary_path, 'w') as output:
+            json.dump({'line': line}, output)
+        os.replace(temporary_path, self.checkpoint)
+
+    def run(self, resume=True):
+        """Import the dump; return counts of what was created or skipped."""
+        done = self.read_checkpoint() if resume else 0
+        # The batch after a checkpoint may have committed just before an
+        # interruption, so its recipes are checked against the database
+        self.verify = done > 0
+        with open_dump(self.path, 'r') as source:
+            lines = enumerate(source, start=1)
+            while batch := list(islice(lines, self.batch_size)):
+                groups = defaultdict(list)
+                for number, line in batch:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    # Ingredients are re-read to rebuild the id map
+                    if (number > done
+                            or record['type'] in ('meta', 'ingredient')):
+                        groups[record['type']].append(record)
+                for meta in groups['meta']:
+                    if meta['format'] > FORMAT_VERSION:
+                        raise ValueError(
+                            f'Unsupported dump format {meta["format"]}.')
+                with transaction.atomic():
+                    self.import_users(groups['user'])
+                    self.import_ingredients(groups['ingredient'])
+                    self.import_recipes(groups['recipe'])
+                line = batch[-1][0]
+                if line > done:
+                    self.write_checkpoint(line)
+                if self.progress:
+                    self.progress(line, self.counts)
+        try:
+            os.remove(self.checkpoint)
+        except FileNotFoundError:
+            pass
+        if self.counts['ingredients created']:
+            ingredient_index.schedule_rebuild()
+            ingredient_catalog.schedule_rebuild()
+        return self.counts
+
+    def import_users(self, records):
+        if not records:
+            return
+        existing = set(User.objects.filter(
+            username__in=[record['username'] for record in records]
+        ).values_list('username', flat=True))
+        new = [record for record in records
+               if record['username'] not in existing]
+        users = User.objects.bulk_create(
+            User(**{field: record[field] for field in USER_FIELDS})
+            for record in new)
+        UserProfile.objects.bulk_create(
+            UserProfile(user_id=user.pk, avatar=record['avatar'],
+                        avatar_variants=record['avatar_variants'])
+            for user, record in zip(users, new))
+        self.counts['users created'] += len(new)
+        self.counts['users matched'] += len(records) - len(new)
+
+    def import_ingredients(self, records):
+        if not records:
+            return
+        keys = {(record['name'], record['measurement_unit']): record['id']
+                for record in records}
+        local = self.local_ingredients(keys)
+        missing = keys.keys() - local.keys()
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=name, measurement_unit=measurement_unit)
+             for name, measurement_unit in missing),
+            ignore_conflicts=True)
+        if missing:
+            local = self.local_ingredients(keys)
+        for key, source_id in keys.items():
+            self.ingredients[source_id] = local[key]
+        self.counts['ingredients created'] += len(missing)
+
+    @staticmethod
+    def local_ingredients(keys):
+        return {
+            (name, measurement_unit): pk
+            for pk, name, measurement_unit in Ingredient.objects.filter(
+                name__in={name for name, _ in keys}
+            ).values_list('pk', 'name', 'measurement_unit')
+            if (name, measurement_unit) in keys
+        }
+
+    def import_recipes(self, records):
+        if not records:
+            return
+        authors = dict(User.objects.filter(
+            username__in={record['author'] for record in records}
+        ).values_list('username', 'pk'))
+        for record in records:
+            record['date_published'] = parse_datetime(
+                record['date_published'])
+        importable = [record for record in records
+                      if record['author'] in authors]
+        self.counts['recipes skipped'] += len(records) - len(importable)
+        if self.verify:
+            self.verify = False
+            present = set(Recipe.objects.filter(
+                author_id__in=authors.values(),
+                date_published__in={
+                    record['date_published'] for record in importable},
+            ).values_list('author_id', 'name', 'date_published'))
+            kept = [record for record in importable
+                    if (authors[record['author']], record['name'],
+                        record['date_published']) not in present]
+            self.counts['recipes skipped'] += len(importable) - len(kept)
+            importable = kept
+        if not importable:
+            return
+
+        recipes = Recipe.objects.bulk_create(
+            Recipe(author_id=authors[record['author']],
+                   **{field: record[field] for field in RECIPE_FIELDS})
+            for record in importable)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe_id=recipe.pk, ingredient_id=ingredient_id,
+                             amount=amount)
+            for recipe, record in zip(recipes, importable)
+            for ingredient_id, amount in {
+                self.ingredients[source_id]: amount
+                for source_id, amount in record['ingredients']
+                if source_id in self.ingredients
+            }.items())
+        self.count_recipes(recipe.author_id for recipe in recipes)
+        self.counts['recipes created'] += len(recipes)
+
+        # bulk_create sends no signals
+        for generation in ('recipes', 'recipe-responses',
+                           recipe_search.SEARCH_GENERATION,
+                           ingredient_sets.GENERATION,
+                           short_links.GENERATION):
+            bump_generation_on_commit(generation)
+
+    @staticmethod
+    def count_recipes(author_ids):
+        # One UPDATE per distinct number of new recipes, not per author
+        by_delta = defaultdict(list)
+        for author_id, delta in Counter(author_ids).items():
+            by_delta[delta].append(author_id)
+        for delta, author_ids in by_delta.items():
+            UserProfile.objects.filter(user_id__in=author_ids).update(
+                updated_at=Now(), recipes_count=F('recipes_count') + delta)
@@ -1,12 +1,33 @@
 from rest_framework import serializers
-import base64
-from django.core.files.base import ContentFile
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from .images import decode_base64, normalize_image
 
 
 class Base64ImageField(serializers.ImageField):
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name=f'avatar.{ext}')
-        return super().to_internal_value(data)
+            header, imgstr = data.split(';base64,')
+            ext = header.split('/')[-1]
+            data = File(decode_base64(imgstr), name=f'upload.{ext}')
+        image = super().to_internal_value(data)
+        image.seek(0)
+        return normalize_image(image)
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Render stored variant paths as ``{label: {format: url}}``."""
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+
+        def build_url(path):
+            url = default_storage.url(path)
+            return request.build_absolute_uri(url) if request else url
+
+        return {
+            label: {extension: build_url(path)
+                    for extension, path in paths.items()}
+            for label, paths in (value or {}).items()
+        }
@@ -0,0 +1,122 @@
+"""Incremental maintenance of the materialized shopping list totals.
+
+``ShoppingListItem`` holds, per user and ingredient, the sum of the amounts
+of every recipe in the user's cart.  Changes are applied as deltas with
+F() expressions so concurrent cart updates never overwrite each other.
+Rows that drop to zero are kept and filtered out on read, which avoids
+racing a concurrent insert of the same row.
+"""
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db.models import Case, F, Sum, Value, When
+
+from .models import RecipeIngredient, ShoppingCart, ShoppingListItem
+
+
+def recipe_amounts(recipe_id):
+    return dict(RecipeIngredient.objects.filter(
+        recipe_id=recipe_id).values_list('ingredient_id', 'amount'))
+
+
+def apply_deltas(user_ids, deltas):
+    """Add ``deltas`` ({ingredient_id: amount}) to each user's list."""
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas or not user_ids:
+        return
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id)
+         for user_id in user_ids
+         for ingredient_id, delta in deltas.items() if delta > 0),
+        ignore_conflicts=True
+    )
+    ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas
+    ).update(total_amount=F('total_amount') + Case(
+        *(When(ingredient_id=ingredient_id, then=Value(delta))
+          for ingredient_id, delta in deltas.items()),
+        default=Value(0)
+    ))
+
+
+def add_recipe(user_id, recipe_id):
+    apply_deltas([user_id], recipe_amounts(recipe_id))
+
+
+def remove_recipe(user_id, recipe_id):
+    apply_deltas([user_id], {
+        ingredient_id: -amount
+        for ingredient_id, amount in recipe_amounts(recipe_id).items()
+    })
+
+
+def apply_recipe_change(recipe_id, before, after):
+    """Propagate a change of a recipe's ingredients to every cart."""
+    deltas = Counter(after)
+    deltas.subtract(before)
+    if not any(deltas.values()):
+        return
+    user_ids = list(ShoppingCart.objects.filter(
+        recipe_id=recipe_id).values_list('user_id', flat=True))
+    apply_deltas(user_ids, deltas)
+
+
+@contextmanager
+def tracking_recipe(recipe_id):
+    """Apply whatever ingredient changes happen inside the block."""
+    before = recipe_amounts(recipe_id)
+    yield
+    apply_recipe_change(recipe_id, before, recipe_amounts(recipe_id))
+
+
+def live_totals(user_ids=None):
+    """Aggregate the totals from the cart itself."""
+    rows = RecipeIngredient.objects.filter(
+        recipe__shopping_carts__isnull=False)
+    if user_ids is not None:
+        rows = rows.filter(recipe__shopping_carts__user_id__in=user_ids)
+    return {
+        (row['recipe__shopping_carts__user_id'], row['ingredient_id']):
+            row['total_amount']
+        for row in rows.values(
+            'recipe__shopping_carts__user_id', 'ingredient_id'
+        ).annotate(total_amount=Sum('amount')).order_by().iterator()
+    }
+
+
+def stored_totals(user_ids=None):
+    rows = ShoppingListItem.objects.filter(total_amount__gt=0)
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    return {
+        (user_id, ingredient_id): total_amount
+        for user_id, ingredient_id, total_amount in rows.values_list(
+            'user_id', 'ingredient_id', 'total_amount').iterator()
+    }
+
+
+def find_drift(user_ids=None):
+    """Return {(user_id, ingredient_id): (stored, live)} mismatches."""
+    live = live_totals(user_ids)
+    stored = stored_totals(user_ids)
+    return {
+        key: (stored.get(key, 0), live.get(key, 0))
+        for key in live.keys() | stored.keys()
+        if stored.get(key, 0) != live.get(key, 0)
+    }
+
+
+def rebuild(user_ids=None, batch_size=1000):
+    """Replace the stored totals with the live aggregation."""
+    items = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+    items.delete()
+    totals = live_totals(user_ids)
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                          total_amount=total_amount)
+         for (user_id, ingredient_id), total_amount in totals.items()),
+        batch_size=batch_size
+    )
+    return len(totals)
@@ -0,0 +1,164 @@
+"""Short links to recipes, resolved without touching the database.
+
+A short code is the recipe id run through a fixed reversible permutation
+of 40-bit numbers and written in base62, so codes say nothing about how
+many recipes there are and decoding needs no lookup table.  Codes are
+seven characters long and start with a letter, which keeps them apart
+from the numeric ``/s/<id>/`` links handed out before.
+
+Whether the recipe still exists comes from a bitmap of live recipe ids
+that every worker keeps in memory.  As in ``ingredient_sets``, creating
+or deleting a recipe bumps the ``recipe-ids`` generation and logs the id
+in the cache under the new generation; workers replay the ids they
+missed and rebuild when the log has gaps or they fell too far behind.
+"""
+import threading
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from .generations import aget_generation, bump_generation, get_generation
+from .models import Recipe
+from .transactions import on_commit_once
+
+GENERATION = 'recipe-ids'
+CHANGE_KEY = 'recipe-ids:change'
+# Changes replayed one by one; beyond that a rebuild is cheaper
+MAX_REPLAY = 500
+CHANGE_TIMEOUT = 24 * 60 * 60
+
+DIGITS = ('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+          'abcdefghijklmnopqrstuvwxyz')
+LETTERS = DIGITS[10:]
+CODE_LENGTH = 7
+BITS = 40
+MASK = (1 << BITS) - 1
+# Odd, so invertible modulo 2 ** BITS
+MULTIPLIERS = (0x9E3779B97F, 0xC2B2AE3D27)
+INVERSES = tuple(pow(multiplier, -1, 1 << BITS)
+                 for multiplier in MULTIPLIERS)
+SHIFT = BITS // 2
+
+
+def _mix(value, multiplier):
+    value = value * multiplier & MASK
+    # Its own inverse, as the shift is at least half the width
+    return value ^ value >> SHIFT
+
+
+def _unmix(value, inverse):
+    return (value ^ value >> SHIFT) * inverse & MASK
+
+
+def encode(recipe_id):
+    """Return the short code of ``recipe_id``."""
+    value = recipe_id
+    for multiplier in MULTIPLIERS:
+        value = _mix(value, multiplier)
+    digits = []
+    for _ in range(CODE_LENGTH - 1):
+        value, digit = divmod(value, len(DIGITS))
+        digits.append(DIGITS[digit])
+    digits.append(LETTERS[value])
+    return ''.join(reversed(digits))
+
+
+def decode(code):
+    """Return the recipe id of ``code``, or None if it is not a code."""
+    if len(code) != CODE_LENGTH or code[0] not in LETTERS:
+        return None
+    value = LETTERS.index(code[0])
+    for character in code[1:]:
+        digit = DIGITS.find(character)
+        if digit < 0:
+            return None
+        value = value * len(DIGITS) + digit
+    if value > MASK:
+        return None
+    for inverse in reversed(INVERSES):
+        value = _unmix(value, inverse)
+    return value
+
+
+def record_change(recipe_id):
+    """Have every worker recheck ``recipe_id`` once the transaction commits."""
+    on_commit_once(('short-links', recipe_id),
+                   lambda: _publish(recipe_id))
+
+
+def _publish(recipe_id):
+    generation = bump_generation(GENERATION)
+    cache.set(f'{CHANGE_KEY}:{generation}', recipe_id, CHANGE_TIMEOUT)
+
+
+def _recipes():
+    # Replicas may not have the rows of the generation yet
+    return Recipe.objects.using(DEFAULT_DB_ALIAS)
+
+
+def _mark(bits, recipe_id, live):
+    byte, bit = divmod(recipe_id, 8)
+    if byte >= len(bits):
+        if not live:
+            return
+        bits.extend(bytes(byte + 1 - len(bits)))
+    if live:
+        bits[byte] |= 1 << bit
+    else:
+        bits[byte] &= ~(1 << bit) & 0xFF
+
+
+class LiveRecipes:
+    def __init__(self):
+        self.generation = None
+        self.bits = bytearray()
+        self._lock = threading.Lock()
+
+    def build(self, generation=None):
+        bits = bytearray()
+        for recipe_id in _recipes().order_by('-pk').values_list(
+                'pk', flat=True).iterator(chunk_size=20000):
+            # The highest id first sizes the bitmap once
+            _mark(bits, recipe_id, True)
+        self.bits = bits
+        self.generation = generation
+
+    def reload(self, recipe_ids):
+        """Re-read whether each of ``recipe_ids`` exists."""
+        live = set(_recipes().filter(pk__in=recipe_ids).values_list(
+            'pk', flat=True))
+        for recipe_id in recipe_ids:
+            _mark(self.bits, recipe_id, recipe_id in live)
+
+    def current(self):
+        generation = get_generation(GENERATION)
+        with self._lock:
+            behind = (generation - self.generation
+                      if self.generation is not None else None)
+            if behind is None or not 0 <= behind <= MAX_REPLAY:
+                self.build(generation)
+            elif behind:
+                keys = [f'{CHANGE_KEY}:{number}' for number in
+                        range(self.generation + 1, generation + 1)]
+                changes = cache.get_many(keys)
+                if len(changes) == len(keys):
+                    self.reload(set(changes.values()))
+                    self.generation = generation
+                else:
+                    self.build(generation)
+        return self
+
+    async def acurrent(self):
+        """``current`` that only leaves the event loop to catch up."""
+        if await aget_generation(GENERATION) == self.generation:
+            return self
+        return await sync_to_async(self.current)()
+
+    def __contains__(self, recipe_id):
+        byte, bit = divmod(recipe_id, 8)
+        return (0 <= byte < len(self.bits)
+                and bool(self.bits[byte] >> bit & 1))
+
+
+live_recipes = LiveRecipes()
@@ -0,0 +1,173 @@
+from django.contrib.auth import get_user_model
+from django.db.models import QuerySet
+from django.db.models.functions import Now
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import (counters, ingredient_sets, recipe_search, shopping_list,
+               short_links)
+from .generations import bump_generation_on_commit
+from .images import discard_variants
+from .ingredient_catalog import ingredient_catalog
+from .ingredient_index import ingredient_index
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                     ShoppingCart, Subscription, UserProfile)
+
+User = get_user_model()
+
+
+def origin_model(origin):
+    """Return the model whose deletion triggered a cascade."""
+    return origin.model if isinstance(origin, QuerySet) else type(origin)
+
+
+def origin_deletes(origin, model, pk):
+    """Return whether the deletion of ``origin`` takes row ``pk`` along."""
+    if origin_model(origin) is not model:
+        return False
+    if isinstance(origin, QuerySet):
+        # The origin's rows go last, so they are still there to match
+        return origin.filter(pk=pk).exists()
+    return origin.pk == pk
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def refresh_ingredient_snapshots(sender, **kwargs):
+    ingredient_index.schedule_rebuild()
+    ingredient_catalog.schedule_rebuild()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def retire_recipe_counts(sender, **kwargs):
+    bump_generation_on_commit('recipes')
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def retire_user_recipe_counts(sender, instance, **kwargs):
+    # Only the user's own favorite and cart filters count these
+    bump_generation_on_commit(f'recipes:{instance.user_id}')
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def refresh_recipe_search(sender, **kwargs):
+    # Only the fallback index reads it; PostgreSQL uses a trigger
+    bump_generation_on_commit(recipe_search.SEARCH_GENERATION)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def refresh_live_recipes(sender, instance, signal, created=False, **kwargs):
+    if created or signal is post_delete:
+        short_links.record_change(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_variants(sender, instance, **kwargs):
+    discard_variants(instance.image, instance.image_variants)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def refresh_ingredient_sets(sender, instance, **kwargs):
+    # Bulk writes send no signal; RecipeSerializer records those itself
+    recipe_id = instance.pk if sender is Recipe else instance.recipe_id
+    ingredient_sets.record_change(recipe_id)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def retire_recipe_responses(sender, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    bump_generation_on_commit('recipe-responses')
+
+
+@receiver(post_save, sender=User)
+def touch_profile(sender, instance, created, update_fields=None, **kwargs):
+    # Profiles date the user fields rendered next to them
+    if created or (update_fields is not None
+                   and set(update_fields) <= {'last_login'}):
+        return
+    UserProfile.objects.filter(user=instance).update(updated_at=Now())
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    if created:
+        shopping_list.add_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_list(sender, instance, origin=None, **kwargs):
+    # Deleting a recipe updates every cart at once below, and a deleted
+    # user's list goes away with them.
+    if origin_model(origin) not in (Recipe, User):
+        shopping_list.remove_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(sender, instance, **kwargs):
+    shopping_list.apply_recipe_change(
+        instance.id, shopping_list.recipe_amounts(instance.id), {})
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def count_recipe_addition(sender, instance, created, **kwargs):
+    if created:
+        field = ('favorites_count' if sender is Favorite
+                 else 'in_carts_count')
+        counters.change_recipe_counter(instance.recipe_id, field, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def count_recipe_removal(sender, instance, origin=None, **kwargs):
+    # The recipe's own deletion takes its counters with it
+    if origin_model(origin) is not Recipe:
+        field = ('favorites_count' if sender is Favorite
+                 else 'in_carts_count')
+        counters.change_recipe_counter(instance.recipe_id, field, -1)
+
+
+@receiver(post_save, sender=Recipe)
+def count_recipe_creation(sender, instance, created, **kwargs):
+    if created:
+        counters.change_profile_counter(
+            instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def count_recipe_deletion(sender, instance, origin=None, **kwargs):
+    if origin_model(origin) is not User:
+        counters.change_profile_counter(
+            instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Subscription)
+def count_subscription(sender, instance, created, **kwargs):
+    if created:
+        counters.change_profile_counter(
+            instance.author_id, 'subscribers_count', 1)
+
+
+@receiver(post_delete, sender=Subscription)
+def count_unsubscription(sender, instance, origin=None, **kwargs):
+    if not origin_deletes(origin, User, instance.author_id):
+        counters.change_profile_counter(
+            instance.author_id, 'subscribers_count', -1)
@@ -0,0 +1,1937 @@
+import asyncio
+import base64
+import gzip
+import importlib
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.utils import ConnectionHandler
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from api.authentication import LRUCache, local_tokens
+from api.caching import single_flight
+from api.metrics import (MmapDict, Store, collect, exposition, record_pool,
+                         sample_key)
+from api.pagination import RecipePagination
+from api.queries import observe_queries
+from api.serializers import IngredientSerializer
+from api.timing import fingerprint
+
+from . import (counters, ingredient_loader, recipe_transfer, shopping_list,
+               short_links)
+from .cache import AtomicFileBasedCache
+from .generations import bump_generation, get_generation
+from .ingredient_catalog import brotli, ingredient_catalog
+from .ingredient_index import IngredientIndex, ingredient_index
+from .ingredient_sets import ingredient_sets
+from .recipe_search import recipe_index
+from .short_links import live_recipes
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                     ShoppingCart, ShoppingListItem, Subscription,
+                     UserProfile)
+
+try:
+    import psycopg
+    import psycopg_pool
+except ImportError:
+    psycopg = psycopg_pool = None
+
+User = get_user_model()
+
+
+def create_user(username, **extra):
+    user = User.objects.create_user(
+        username=username, email=f'{username}@example.com',
+        password='Sup3r-secret', **extra)
+    UserProfile.objects.create(user=user)
+    return user
+
+
+def create_recipe(author, ingredients, name='Recipe', **extra):
+    recipe = Recipe.objects.create(
+        author=author, name=name, text=f'{name} text', cooking_time=10,
+        image='recipes/images/recipe.png', **extra)
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=amount)
+        for ingredient, amount in ingredients
+    )
+    return recipe
+
+
+class IngredientIndexTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index = IngredientIndex(os.path.join(directory.name, 'idx'))
+        for name in ('Сахар', 'сахарная пудра', 'тростниковый сахар',
+                     'соль', 'Sugar syrup', 'brown sugar'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+        self.index.build()
+
+    def names(self, query, limit=None):
+        return [item['name'] for item in self.index.search(query, limit)]
+
+    def test_prefix_matches_come_before_substring_matches(self):
+        self.assertEqual(
+            self.names('сах'),
+            ['Сахар', 'сахарная пудра', 'тростниковый сахар'])
+        self.assertEqual(self.names('SUGAR'), ['Sugar syrup', 'brown sugar'])
+
+    def test_limit_caps_results(self):
+        self.assertEqual(self.names('сах', limit=2),
+                         ['Сахар', 'сахарная пудра'])
+
+    def test_no_matches(self):
+        self.assertEqual(self.names('перец'), [])
+        self.assertEqual(self.names('  '), [])
+
+    def test_other_handle_reloads_rebuilt_snapshot(self):
+        reader = IngredientIndex(self.index.path)
+        self.assertEqual(len(reader.search('соль')), 1)
+        Ingredient.objects.create(name='соль морская', measurement_unit='г')
+        self.index.build()
+        self.assertEqual(len(reader.search('соль')), 2)
+
+
+def use_temporary_path(test_case, setting, name):
+    """Point ``setting`` at a fresh temporary path for one test."""
+    directory = tempfile.TemporaryDirectory()
+    test_case.addCleanup(directory.cleanup)
+    path = os.path.join(directory.name, name)
+    settings_override = override_settings(**{setting: path})
+    settings_override.enable()
+    test_case.addCleanup(settings_override.disable)
+    return path
+
+
+class IngredientSearchApiTests(APITestCase):
+    def setUp(self):
+        use_temporary_path(self, 'INGREDIENT_INDEX_PATH', 'idx')
+        with self.captureOnCommitCallbacks(execute=True):
+            for name in ('мука', 'мука ржаная', 'рисовая мука', 'молоко'):
+                Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def test_search_is_served_without_queries(self):
+        ingredient_index.snapshot()
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                '/api/ingredients/', {'name': 'мук', 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['name'] for item in response.data],
+                         ['мука', 'мука ржаная'])
+        self.assertEqual(set(response.data[0]),
+                         {'id', 'name', 'measurement_unit'})
+
+    def test_index_follows_ingredient_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.filter(name='молоко').get().delete()
+            Ingredient.objects.create(name='мускатный орех',
+                                      measurement_unit='г')
+        response = self.client.get('/api/ingredients/', {'name': 'м'})
+        self.assertEqual(
+            [item['name'] for item in response.data],
+            ['мука', 'мука ржаная', 'мускатный орех', 'рисовая мука'])
+
+
+class RecipeQueryCountTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('reader')
+        self.ingredients = [
+            Ingredient.objects.create(name=f'ingredient {index}',
+                                      measurement_unit='г')
+            for index in range(3)
+        ]
+        self.client.force_authenticate(self.user)
+
+    def add_recipes(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            for index in range(count):
+                author = create_user(f'author{Recipe.objects.count()}')
+                recipe = create_recipe(
+                    author,
+                    [(ingredient, 10) for ingredient in self.ingredients],
+                    name=f'Recipe {index}')
+                Favorite.objects.create(user=self.user, recipe=recipe)
+                ShoppingCart.objects.create(user=self.user, recipe=recipe)
+                Subscription.objects.create(user=self.user, author=author)
+
+    def test_list_query_count_is_constant(self):
+        self.add_recipes(2)
+        # recipe and ingredient versions, count, recipes with authors,
+        # recipe ingredients, ingredients
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/recipes/')
+        self.add_recipes(6)
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(len(response.data['results']), 8)
+        recipe = response.data['results'][0]
+        self.assertTrue(recipe['is_favorited'])
+        self.assertTrue(recipe['is_in_shopping_cart'])
+        self.assertTrue(recipe['author']['is_subscribed'])
+        self.assertEqual(len(recipe['ingredients']), 3)
+
+    def test_retrieve_query_count_is_constant(self):
+        self.add_recipes(1)
+        recipe = Recipe.objects.get()
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/recipes/{recipe.id}/')
+        self.assertTrue(response.data['is_favorited'])
+        self.assertTrue(response.data['author']['is_subscribed'])
+        self.assertEqual(
+            {item['name'] for item in response.data['ingredients']},
+            {ingredient.name for ingredient in self.ingredients})
+
+    def test_filters_use_annotations(self):
+        self.add_recipes(2)
+        other = create_recipe(create_user('other'),
+                              [(self.ingredients[0], 1)], name='Other')
+        response = self.client.get('/api/recipes/', {'is_favorited': 0})
+        self.assertEqual([item['id'] for item in response.data['results']],
+                         [other.id])
+        self.assertFalse(response.data['results'][0]['is_favorited'])
+        response = self.client.get('/api/recipes/',
+                                   {'is_in_shopping_cart': 1})
+        self.assertEqual(response.data['count'], 2)
+
+
+class RecipePaginationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        page_size = mock.patch.object(RecipePagination, 'page_size', 3)
+        page_size.start()
+        self.addCleanup(page_size.stop)
+        self.author = create_user('author')
+        self.ingredient = Ingredient.objects.create(
+            name='salt', measurement_unit='g')
+        published = timezone.now()
+        # Pairs of recipes share a timestamp to exercise the id tie-breaker
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipes = [
+                create_recipe(self.author, [(self.ingredient, 1)],
+                              name=f'Recipe {index}',
+                              date_published=published - timedelta(
+                                  minutes=index // 2))
+                for index in range(7)
+            ]
+        self.feed = sorted(
+            self.recipes, key=lambda recipe: (recipe.date_published,
+                                              recipe.id), reverse=True)
+
+    def walk(self, url, params=None, direction='next'):
+        ids = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertNotIn('count', data)
+            ids.extend(item['id'] for item in data['results'])
+            if not data[direction]:
+                return ids, data
+            response = self.client.get(data[direction])
+
+    def test_cursor_walks_feed_in_order(self):
+        ids, last = self.walk('/api/recipes/', {'cursor': ''})
+        self.assertEqual(ids, [recipe.id for recipe in self.feed])
+
+        response = self.client.get(last['previous'])
+        self.assertEqual([item['id'] for item in response.json()['results']],
+                         [recipe.id for recipe in self.feed[3:6]])
+
+    def test_cursor_is_stable_under_inserts(self):
+        first = self.client.get('/api/recipes/', {'cursor': ''})
+        create_recipe(self.author, [(self.ingredient, 1)], name='Fresh')
+        ids, _ = self.walk(first.json()['next'])
+        self.assertEqual(ids, [recipe.id for recipe in self.feed[3:]])
+
+    def test_cursor_with_filters(self):
+        reader = create_user('reader')
+        for recipe in self.feed[::2]:
+            Favorite.objects.create(user=reader, recipe=recipe)
+        self.client.force_authenticate(reader)
+        ids, _ = self.walk('/api/recipes/',
+                           {'cursor': '', 'is_favorited': 1})
+        self.assertEqual(ids, [recipe.id for recipe in self.feed[::2]])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_number_count_is_cached_until_recipes_change(self):
+        # Anonymous pages are cached whole, so read as a user
+        reader = create_user('reader')
+        self.client.force_authenticate(reader)
+        # versions, count, recipes with authors, recipe ingredients,
+        # ingredients
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.data['count'], 7)
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.data['count'], 7)
+
+        # Other users' favorites leave the reader's counts alone
+        with CaptureQueriesContext(connection) as counted:
+            self.client.get('/api/recipes/', {'is_favorited': 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.author, recipe=self.recipes[0])
+        with self.assertNumQueries(len(counted) - 1):
+            self.client.get('/api/recipes/', {'is_favorited': 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=reader, recipe=self.recipes[0])
+        response = self.client.get('/api/recipes/', {'is_favorited': 1})
+        self.assertEqual(response.data['count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_recipe(self.author, [(self.ingredient, 1)], name='Fresh')
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.data['count'], 8)
+
+
+class ShoppingCartExportTests(APITestCase):
+    url = '/api/recipes/download_shopping_cart/'
+
+    def setUp(self):
+        self.user = create_user('buyer')
+        flour = Ingredient.objects.create(name='wheat FLOUR',
+                                          measurement_unit='g')
+        eggs = Ingredient.objects.create(name='eggs', measurement_unit='pcs')
+        author = create_user('baker')
+        for amount in (100, 250):
+            recipe = create_recipe(author, [(flour, amount), (eggs, 2)])
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        ShoppingCart.objects.create(
+            user=author, recipe=create_recipe(author, [(flour, 1)]))
+        self.client.force_authenticate(self.user)
+
+    def download(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_is_default(self):
+        response, body = self.download()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('shopping_cart.csv', response['Content-Disposition'])
+        self.assertEqual(
+            body.decode('utf-8-sig').splitlines(),
+            ['Ingredient,Amount,Unit', 'Eggs,4,pcs', 'Wheat flour,350,g'])
+
+    def test_txt_and_json(self):
+        _, body = self.download(format='txt')
+        self.assertIn('Wheat flour (g) — 350', body.decode())
+        response, body = self.download(format='json')
+        self.assertEqual(response['Content-Type'],
+                         'application/json; charset=utf-8')
+        self.assertEqual(json.loads(body), [
+            {'name': 'Eggs', 'amount': 4, 'measurement_unit': 'pcs'},
+            {'name': 'Wheat flour', 'amount': 350, 'measurement_unit': 'g'},
+        ])
+
+    def test_pdf_pages_and_xref(self):
+        ShoppingCart.objects.filter(user=self.user).delete()
+        author = create_user('prolific')
+        recipe = create_recipe(author, [
+            (Ingredient.objects.create(name=f'cheese {index}',
+                                       measurement_unit='г'), 1)
+            for index in range(120)
+        ])
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        response, body = self.download(format='pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(body.startswith(b'%PDF-1.4'))
+        self.assertIn(b'/Count 3', body)
+        self.assertIn('Cheese 1 (г) - 1'.encode('cp1251').hex().encode(), body)
+        xref = int(body.rsplit(b'startxref\n', 1)[1].split()[0])
+        self.assertTrue(body[xref:].startswith(b'xref\n'))
+        for number, entry in enumerate(
+                body[xref:].split(b'\n')[3:], start=1):
+            if entry.startswith(b'trailer'):
+                break
+            offset = int(entry.split()[0])
+            self.assertTrue(body[offset:].startswith(b'%d 0 obj' % number))
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(None)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+
+class RecipeWriteTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        use_temporary_path(self, 'MEDIA_ROOT', 'media')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author = create_user('cook')
+            self.flour, self.milk, self.eggs = (
+                Ingredient.objects.create(name=name, measurement_unit='g')
+                for name in ('flour', 'milk', 'eggs'))
+        self.client.force_authenticate(self.author)
+        self.data = {
+            'ingredients': [{'id': self.flour.id, 'amount': 200},
+                            {'id': self.milk.id, 'amount': 300}],
+            'name': 'Pancakes', 'text': 'Fry', 'cooking_time': 5}
+
+    def write(self, method, url, data):
+        with self.captureOnCommitCallbacks(execute=True), \
+                CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+        writes = [query['sql'].split()[0] for query in queries.captured_queries
+                  if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        return response, len(queries.captured_queries), writes
+
+    def test_query_counts(self):
+        # Before: 12 for the create, 22 for an unchanged recipe and 23 for
+        # one changed amount
+        response, count, writes = self.write('post', '/api/recipes/', {
+            **self.data, 'image': encode_image(size=(32, 32))})
+        self.assertEqual(response.status_code, 201)
+        # ingredients, recipe, author's count, rows, then the response's
+        # rows and ingredients
+        self.assertEqual(count, 6)
+        self.assertEqual(writes, ['INSERT', 'UPDATE', 'INSERT'])
+
+        url = f'/api/recipes/{response.data["id"]}/'
+        response, count, writes = self.write('patch', url, self.data)
+        self.assertEqual(response.status_code, 200)
+        # savepoint, recipe, rows, ingredients, version, ingredients,
+        # release
+        self.assertEqual((count, writes), (7, []))
+
+        self.data['ingredients'][1]['amount'] = 250
+        response, count, writes = self.write('patch', url, self.data)
+        self.assertEqual(response.data['ingredients'][1]['amount'], 250)
+        # The amount, the carts to update and the recipe's date, then the
+        # response's rows and ingredients and the new version
+        self.assertEqual(count, 13)
+        self.assertEqual(writes, ['UPDATE', 'UPDATE'])
+
+    def test_ingredient_changes_are_applied_as_a_diff(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = create_recipe(self.author, [(self.flour, 200),
+                                                 (self.milk, 300)],
+                                   'Pancakes')
+            buyer = create_user('buyer')
+            ShoppingCart.objects.create(user=buyer, recipe=recipe)
+        flour_row = RecipeIngredient.objects.get(ingredient=self.flour)
+        url = f'/api/recipes/{recipe.id}/'
+        etag = self.client.get(url)['ETag']
+        responses = get_generation('recipe-responses')
+
+        self.data['ingredients'] = [{'id': self.flour.id, 'amount': 250},
+                                    {'id': self.eggs.id, 'amount': 2}]
+        response, _, writes = self.write('patch', url, self.data)
+        # The dropped row, the new one, the changed amount, the cart
+        # totals (insert of the new ingredient, update of all) and the date
+        self.assertEqual(sorted(writes), ['DELETE', 'INSERT', 'INSERT',
+                                          'UPDATE', 'UPDATE', 'UPDATE'])
+        self.assertEqual(
+            [(item['name'], item['amount'])
+             for item in response.data['ingredients']],
+            [('flour', 250), ('eggs', 2)])
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(url)['ETag'], response['ETag'])
+        self.assertNotEqual(get_generation('recipe-responses'), responses)
+        # The kept row is updated in place
+        flour_row.refresh_from_db()
+        self.assertEqual(flour_row.amount, 250)
+        self.assertEqual(dict(ShoppingListItem.objects.filter(
+            user=buyer, total_amount__gt=0).values_list(
+                'ingredient__name', 'total_amount')),
+            {'flour': 250, 'eggs': 2})
+
+    def test_only_the_author_can_edit(self):
+        recipe = create_recipe(self.author, [(self.flour, 200)], 'Bread')
+        self.client.force_authenticate(create_user('other'))
+        response = self.client.patch(f'/api/recipes/{recipe.id}/',
+                                     self.data, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(RecipeIngredient.objects.get().amount, 200)
+
+
+class ShoppingListTests(APITestCase):
+    def setUp(self):
+        self.user = create_user('buyer')
+        self.author = create_user('cook')
+        self.flour = Ingredient.objects.create(name='flour',
+                                               measurement_unit='g')
+        self.milk = Ingredient.objects.create(name='milk',
+                                              measurement_unit='ml')
+        self.pancakes = create_recipe(
+            self.author, [(self.flour, 200), (self.milk, 300)], 'Pancakes')
+        self.bread = create_recipe(self.author, [(self.flour, 500)], 'Bread')
+        self.client.force_authenticate(self.user)
+
+    def totals(self, user=None):
+        return dict(ShoppingListItem.objects.filter(
+            user=user or self.user, total_amount__gt=0
+        ).values_list('ingredient__name', 'total_amount'))
+
+    def test_cart_changes_update_totals(self):
+        for recipe in (self.pancakes, self.bread):
+            response = self.client.post(
+                f'/api/recipes/{recipe.id}/shopping_cart/')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.totals(), {'flour': 700, 'milk': 300})
+
+        self.client.delete(f'/api/recipes/{self.pancakes.id}/shopping_cart/')
+        self.assertEqual(self.totals(), {'flour': 500})
+
+        response = self.client.get('/api/recipes/shopping_list/')
+        self.assertEqual(response.data, [{
+            'id': self.flour.id, 'name': 'flour',
+            'measurement_unit': 'g', 'amount': 500}])
+
+    def test_recipe_edit_updates_every_cart(self):
+        other = create_user('other')
+        for user in (self.user, other):
+            ShoppingCart.objects.create(user=user, recipe=self.pancakes)
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(
+            f'/api/recipes/{self.pancakes.id}/',
+            {'ingredients': [{'id': self.flour.id, 'amount': 250}],
+             'name': 'Pancakes', 'text': 'Fry', 'cooking_time': 5},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        for user in (self.user, other):
+            self.assertEqual(self.totals(user), {'flour': 250})
+
+    def test_recipe_delete_updates_carts(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.pancakes)
+        ShoppingCart.objects.create(user=self.user, recipe=self.bread)
+        self.pancakes.delete()
+        self.assertEqual(self.totals(), {'flour': 500})
+        self.author.delete()
+        self.assertEqual(self.totals(), {})
+
+    def test_rebuild_command_repairs_drift(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.pancakes)
+        ShoppingListItem.objects.filter(ingredient=self.milk).update(
+            total_amount=1)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_shopping_lists', '--verify',
+                         stdout=io.StringIO())
+        call_command('rebuild_shopping_lists', stdout=io.StringIO())
+        call_command('rebuild_shopping_lists', '--verify',
+                     stdout=io.StringIO())
+        self.assertEqual(self.totals(), {'flour': 200, 'milk': 300})
+
+
+class CounterTests(APITestCase):
+    def setUp(self):
+        self.author = create_user('author')
+        self.fan = create_user('fan')
+        self.salt = Ingredient.objects.create(name='salt',
+                                              measurement_unit='g')
+        self.recipe = create_recipe(self.author, [(self.salt, 1)])
+
+    def assertCounters(self, favorites, carts, recipes, subscribers):
+        self.recipe.refresh_from_db()
+        profile = UserProfile.objects.get(user=self.author)
+        self.assertEqual(
+            (self.recipe.favorites_count, self.recipe.in_carts_count,
+             profile.recipes_count, profile.subscribers_count),
+            (favorites, carts, recipes, subscribers))
+
+    def test_counters_follow_api_actions(self):
+        self.client.force_authenticate(self.fan)
+        self.client.post(f'/api/recipes/{self.recipe.id}/favorite/')
+        self.client.post(f'/api/recipes/{self.recipe.id}/shopping_cart/')
+        self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.assertCounters(1, 1, 1, 1)
+
+        response = self.client.get('/api/users/subscriptions/')
+        self.assertEqual(response.data['results'][0]['recipes_count'], 1)
+
+        self.client.delete(f'/api/recipes/{self.recipe.id}/favorite/')
+        self.client.delete(f'/api/recipes/{self.recipe.id}/shopping_cart/')
+        self.client.delete(f'/api/users/{self.author.id}/subscribe/')
+        self.assertCounters(0, 0, 1, 0)
+
+    def test_cascades_and_stale_saves(self):
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        Favorite.objects.create(user=self.fan, recipe=self.recipe)
+        ShoppingCart.objects.create(user=self.fan, recipe=self.recipe)
+        Subscription.objects.create(user=self.fan, author=self.author)
+        stale.name = 'Renamed'
+        stale.save()
+        self.assertCounters(1, 1, 1, 1)
+
+        self.fan.delete()
+        self.assertCounters(0, 0, 1, 0)
+
+        create_recipe(self.author, [(self.salt, 1)], name='Second')
+        self.recipe.delete()
+        profile = UserProfile.objects.get(user=self.author)
+        self.assertEqual(profile.recipes_count, 1)
+
+    def test_queryset_deletes_skip_deleted_authors(self):
+        other = create_user('other')
+        Subscription.objects.create(user=self.fan, author=self.author)
+        Subscription.objects.create(user=self.author, author=other)
+        User.objects.filter(pk=self.author.pk).delete()
+        self.assertFalse(UserProfile.objects.filter(
+            user_id=self.author.pk).exists())
+        self.assertEqual(UserProfile.objects.get(
+            user=other).subscribers_count, 0)
+
+        # Nor is a profile made up for a user who is gone
+        counters.change_profile_counter(self.author.pk, 'recipes_count', -1)
+        self.assertFalse(UserProfile.objects.filter(
+            user_id=self.author.pk).exists())
+
+    def test_reconcile_repairs_drift(self):
+        Favorite.objects.bulk_create([Favorite(user=self.fan,
+                                               recipe=self.recipe)])
+        UserProfile.objects.filter(user=self.author).update(
+            subscribers_count=7)
+        output = io.StringIO()
+        call_command('reconcile_counters', stdout=output)
+        self.assertIn('Repaired 1 recipes', output.getvalue())
+        self.assertIn('Repaired 1 profiles', output.getvalue())
+        self.assertCounters(1, 0, 1, 0)
+
+
+class SubscriptionListTests(APITestCase):
+    def setUp(self):
+        self.user = create_user('reader')
+        salt = Ingredient.objects.create(name='salt', measurement_unit='g')
+        published = timezone.now()
+        self.authors = []
+        for index in range(4):
+            author = create_user(f'author{index}')
+            for number in range(index + 2):
+                create_recipe(author, [(salt, 1)], name=f'{index}-{number}',
+                              date_published=published - timedelta(
+                                  hours=number))
+            Subscription.objects.create(user=self.user, author=author)
+            self.authors.append(author)
+        self.client.force_authenticate(self.user)
+
+    def test_top_recipes_in_constant_queries(self):
+        # version, count, subscriptions with authors, windowed recipes
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/users/subscriptions/',
+                                       {'recipes_limit': 2})
+        self.assertEqual(response.data['count'], 4)
+        for index, author in enumerate(response.data['results']):
+            self.assertTrue(author['is_subscribed'])
+            self.assertEqual(author['recipes_count'], index + 2)
+            self.assertEqual([recipe['name'] for recipe in author['recipes']],
+                             [f'{index}-0', f'{index}-1'])
+            self.assertEqual(set(author['recipes'][0]),
+                             {'id', 'name', 'image', 'image_variants',
+                              'cooking_time'})
+
+    def test_without_limit_returns_every_recipe(self):
+        response = self.client.get('/api/users/subscriptions/')
+        self.assertEqual(
+            [len(author['recipes']) for author in response.data['results']],
+            [2, 3, 4, 5])
+
+    def test_subscribe_response_respects_limit(self):
+        Subscription.objects.filter(author=self.authors[3]).delete()
+        response = self.client.post(
+            f'/api/users/{self.authors[3].id}/subscribe/?recipes_limit=1')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['recipes']), 1)
+        self.assertTrue(response.data['is_subscribed'])
+
+
+def encode_image(size=(1600, 1200), image_format='JPEG', mode='RGB',
+                 **save_options):
+    buffer = io.BytesIO()
+    Image.new(mode, size, 'orange').save(buffer, image_format, **save_options)
+    mime = image_format.lower()
+    return (f'data:image/{mime};base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+class ImagePipelineTests(APITestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = create_user('cook')
+        self.salt = Ingredient.objects.create(name='salt',
+                                              measurement_unit='g')
+        self.client.force_authenticate(self.user)
+
+    def create(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/recipes/', {
+                'ingredients': [{'id': self.salt.id, 'amount': 1}],
+                'name': 'Soup', 'text': 'Boil', 'cooking_time': 5,
+                'image': image,
+            }, format='json')
+
+    def test_recipe_upload_is_normalized_with_variants(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'PhoneMaker'
+        response = self.create(encode_image(exif=exif.tobytes()))
+        self.assertEqual(response.status_code, 201, response.data)
+
+        recipe = Recipe.objects.get()
+        self.assertNotIn('avatar', recipe.image.name)
+        self.assertTrue(recipe.image.name.endswith('.jpg'))
+        with Image.open(recipe.image.path) as stored:
+            self.assertFalse(stored.getexif())
+            self.assertEqual(stored.size, (1600, 1200))
+
+        self.assertEqual(set(recipe.image_variants), {'card', 'detail'})
+        for label, side in (('card', 320), ('detail', 1024)):
+            for extension, image_format in (('webp', 'WEBP'),
+                                            ('jpeg', 'JPEG')):
+                path = os.path.join(self.media_root,
+                                    recipe.image_variants[label][extension])
+                with Image.open(path) as variant:
+                    self.assertEqual(variant.format, image_format)
+                    self.assertEqual(max(variant.size), side)
+
+        response = self.client.get(f'/api/recipes/{recipe.id}/')
+        self.assertTrue(response.data['image_variants']['card']['webp']
+                        .startswith('http://testserver/media/'))
+        response = self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.assertIn('detail', response.data['image_variants'])
+
+    def test_large_uploads_are_downscaled(self):
+        with override_settings(IMAGE_MAX_SIDE=1000):
+            self.create(encode_image(size=(3000, 1500),
+                                     image_format='PNG', mode='RGBA'))
+        recipe = Recipe.objects.get()
+        self.assertTrue(recipe.image.name.endswith('.png'))
+        with Image.open(recipe.image.path) as stored:
+            self.assertEqual(stored.size, (1000, 500))
+
+    def test_invalid_images_are_rejected(self):
+        response = self.create(encode_image(size=(4, 4)))
+        self.assertEqual(response.status_code, 400)
+        with override_settings(IMAGE_MAX_PIXELS=1000):
+            response = self.create(encode_image(size=(100, 100)))
+        self.assertEqual(response.status_code, 400)
+        response = self.create('data:image/png;base64,bm90IGFuIGltYWdl')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_avatar_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(
+                '/api/users/me/avatar/',
+                {'avatar': encode_image(size=(400, 400))}, format='json')
+        self.assertEqual(response.status_code, 200)
+        profile = UserProfile.objects.get(user=self.user)
+        path = os.path.join(self.media_root,
+                            profile.avatar_variants['avatar']['webp'])
+        with Image.open(path) as variant:
+            self.assertEqual(variant.size, (96, 96))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.delete('/api/users/me/avatar/')
+        # Kept until the transaction commits
+        self.assertTrue(os.path.exists(path))
+        for callback in callbacks:
+            callback()
+        profile.refresh_from_db()
+        self.assertEqual(profile.avatar_variants, {})
+        self.assertFalse(os.path.exists(path))
+
+    def variant_paths(self, variants):
+        return [os.path.join(self.media_root, path)
+                for paths in variants.values() for path in paths.values()]
+
+    def test_replaced_and_deleted_images_drop_their_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put('/api/users/me/avatar/',
+                            {'avatar': encode_image(size=(400, 400))},
+                            format='json')
+        old_avatar = self.variant_paths(
+            UserProfile.objects.get(user=self.user).avatar_variants)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put('/api/users/me/avatar/',
+                            {'avatar': encode_image(size=(300, 300))},
+                            format='json')
+        new_avatar = self.variant_paths(
+            UserProfile.objects.get(user=self.user).avatar_variants)
+        self.assertFalse(any(map(os.path.exists, old_avatar)))
+        self.assertTrue(all(map(os.path.exists, new_avatar)))
+
+        self.create(encode_image())
+        recipe = Recipe.objects.get()
+        old_image = self.variant_paths(recipe.image_variants)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/recipes/{recipe.id}/', {
+                'ingredients': [{'id': self.salt.id, 'amount': 1}],
+                'image': encode_image(size=(800, 600)),
+            }, format='json')
+        recipe.refresh_from_db()
+        new_image = self.variant_paths(recipe.image_variants)
+        self.assertFalse(any(map(os.path.exists, old_image)))
+        self.assertTrue(all(map(os.path.exists, new_image)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/recipes/{recipe.id}/')
+        self.assertFalse(any(map(os.path.exists, new_image)))
+
+
+class AnonymousResponseCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author = create_user('author')
+            self.salt = Ingredient.objects.create(name='salt',
+                                                  measurement_unit='g')
+            self.recipe = create_recipe(self.author, [(self.salt, 5)],
+                                        'Soup')
+
+    def test_anonymous_reads_are_cached_until_data_changes(self):
+        response = self.client.get('/api/recipes/', {'author': self.author.id})
+        self.assertEqual(response.json()['count'], 1)
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/recipes/',
+                                     {'author': str(self.author.id),
+                                      'is_favorited': 1})
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['Content-Type'], 'application/json')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_recipe(self.author, [(self.salt, 1)], 'Stew')
+        response = self.client.get('/api/recipes/', {'author': self.author.id})
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_detail_follows_ingredient_and_profile_changes(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.filter(recipe=self.recipe).update(
+                amount=7)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient = RecipeIngredient.objects.get(recipe=self.recipe)
+            ingredient.amount = 9
+            ingredient.save()
+        self.assertEqual(
+            self.client.get(url).json()['ingredients'][0]['amount'], 9)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Renamed'
+            self.author.save()
+        self.assertEqual(
+            self.client.get(url).json()['author']['first_name'], 'Renamed')
+
+    def test_authenticated_and_missing_are_not_cached(self):
+        self.client.get('/api/recipes/')
+        self.client.force_authenticate(create_user('reader'))
+        response = self.client.get('/api/recipes/')
+        self.assertFalse(response.data['results'][0]['is_favorited'])
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/recipes/0/').status_code, 404)
+        # version, recipe
+        with self.assertNumQueries(2):
+            self.client.get('/api/recipes/0/')
+
+    def test_evicted_generations_do_not_repeat(self):
+        # Responses cached under several generations
+        self.client.get('/api/recipes/')
+        generations = [get_generation('recipe-responses')]
+        generations += [bump_generation('recipe-responses')
+                        for _ in range(3)]
+        self.client.get('/api/recipes/')
+        cache.delete('generation:recipe-responses')
+        Recipe.objects.update(name='Renamed')
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.json()['results'][0]['name'], 'Renamed')
+        self.assertGreater(get_generation('recipe-responses'),
+                           max(generations))
+
+        cache.delete('generation:recipe-responses')
+        self.assertGreater(bump_generation('recipe-responses'),
+                           max(generations))
+
+    def test_responses_are_cached_per_host(self):
+        for host in ('localhost', '127.0.0.1'):
+            response = self.client.get('/api/recipes/', HTTP_HOST=host)
+            self.assertTrue(response.json()['results'][0]['image']
+                            .startswith(f'http://{host}/'))
+
+    def test_single_flight_runs_one_build(self):
+        calls = []
+        cache.add('flight:lock', 1)
+        with override_settings(RESPONSE_CACHE_POLL_INTERVAL=0.01):
+            cache.set('flight', {'content': b'ready'})
+            value = single_flight('flight', lambda: calls.append(1), 60)
+        self.assertEqual(value, {'content': b'ready'})
+        self.assertEqual(calls, [])
+
+        cache.clear()
+        value = single_flight('flight', lambda: 'built', 60)
+        self.assertEqual((value, cache.get('flight')), ('built', 'built'))
+        self.assertIsNone(cache.get('flight:lock'))
+
+
+class AtomicFileBasedCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = AtomicFileBasedCache(directory.name, {})
+
+    def race(self, function, threads=8):
+        results = []
+        barrier = threading.Barrier(threads)
+
+        def run():
+            barrier.wait()
+            results.extend(function())
+
+        workers = [threading.Thread(target=run) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def test_concurrent_increments_return_distinct_values(self):
+        self.cache.set('counter', 0, None)
+        values = self.race(
+            lambda: [self.cache.incr('counter') for _ in range(25)])
+        self.assertEqual(sorted(values), list(range(1, 201)))
+        self.assertEqual(self.cache.get('counter'), 200)
+
+    def test_one_concurrent_add_wins(self):
+        added = self.race(lambda: [self.cache.add('lock', 1, 60)])
+        self.assertEqual(added.count(True), 1)
+
+    def test_culling_spares_entries_without_timeout(self):
+        cache = AtomicFileBasedCache(
+            self.cache._dir, {'OPTIONS': {'MAX_ENTRIES': 10,
+                                          'CULL_FREQUENCY': 1}})
+        cache.set('generation', 1, None)
+        for index in range(20):
+            cache.set(f'response:{index}', index, 60)
+        self.assertEqual(cache.get('generation'), 1)
+        self.assertLess(len(cache._list_cache_files()), 12)
+
+
+@override_settings(REQUEST_TIMING=True, REQUEST_TIMING_SLOW_MS=10 ** 6)
+class ServerTimingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author = create_user('author')
+            salt = Ingredient.objects.create(name='salt', measurement_unit='g')
+            create_recipe(self.author, [(salt, 5)], 'Soup')
+
+    def test_header_and_log_report_each_phase(self):
+        with self.assertLogs('api.timing', 'INFO') as logs:
+            response = self.client.get('/api/recipes/')
+        phases = dict(
+            entry.strip().split(';', 1)
+            for entry in response['Server-Timing'].split(','))
+        self.assertEqual(set(phases), {
+            'db', 'serialize', 'render', 'view', 'total'})
+        self.assertIn('queries', phases['db'])
+        [record] = logs.records
+        self.assertEqual(record.timing['status'], 200)
+        self.assertEqual(record.timing['queries'],
+                         int(phases['db'].split('"')[1].split()[0]))
+        self.assertGreater(record.timing['queries'], 0)
+
+        # Served from the cache: no serializing and no rendering
+        with self.assertLogs('api.timing', 'INFO'):
+            response = self.client.get('/api/recipes/')
+        self.assertNotIn('serialize', response['Server-Timing'])
+
+    def test_slow_requests_log_statement_fingerprints(self):
+        with override_settings(REQUEST_TIMING_SLOW_MS=0), \
+                self.assertLogs('api.timing', 'INFO') as logs:
+            self.client.get(f'/api/recipes/?author={self.author.id}')
+        [record] = [record for record in logs.records
+                    if record.name == 'api.timing.slow']
+        self.assertTrue(record.timing['slowest'])
+        self.assertLessEqual(len(record.timing['slowest']), 3)
+        for entry in record.timing['slowest']:
+            self.assertIn(entry['fingerprint'], record.getMessage())
+
+    def test_fingerprint_ignores_values(self):
+        first = fingerprint(
+            "SELECT * FROM t WHERE a = 'x' AND b IN (%s, %s) LIMIT 10")
+        second = fingerprint(
+            "SELECT *  FROM t WHERE a = 'it''s' AND b IN (%s) LIMIT 20")
+        self.assertEqual(first, second)
+        self.assertEqual(first[0],
+                         'SELECT * FROM t WHERE a = ? AND b IN (?) LIMIT ?')
+        self.assertEqual(
+            fingerprint('INSERT INTO t VALUES (%s, %s), (%s, %s)')[0],
+            'INSERT INTO t VALUES (?)')
+
+
+@override_settings(METRICS=True)
+class MetricsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = use_temporary_path(self, 'METRICS_DIR', 'metrics')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author = create_user('author')
+            salt = Ingredient.objects.create(name='salt', measurement_unit='g')
+            create_recipe(self.author, [(salt, 5)], 'Soup')
+
+    def scrape(self, **extra):
+        response = self.client.get('/metrics', **extra)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        return dict(line.rsplit(' ', 1)
+                    for line in response.content.decode().splitlines()
+                    if not line.startswith('#'))
+
+    def test_scrape_after_traffic(self):
+        self.client.get('/api/recipes/')
+        self.client.get('/api/recipes/')
+        self.client.get('/api/recipes/0/')
+        token = Token.objects.create(user=self.author)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.client.get('/api/users/me/')
+        self.client.get('/api/users/me/')
+        self.client.credentials()
+
+        samples = self.scrape()
+        list_labels = 'route="recipe-list"'
+        self.assertEqual(samples[
+            'foodgram_http_requests_total{method="GET",'
+            f'{list_labels},status="200"}}'], '2')
+        self.assertEqual(samples[
+            'foodgram_http_requests_total{method="GET",'
+            'route="recipe-detail",status="404"}'], '1')
+        self.assertEqual(samples[
+            'foodgram_http_request_duration_seconds_bucket'
+            f'{{{list_labels},le="+Inf"}}'], '2')
+        self.assertEqual(samples[
+            f'foodgram_http_response_size_bytes_count{{{list_labels}}}'],
+            '2')
+        # The second read was served from the cache without SQL
+        self.assertEqual(samples[
+            f'foodgram_db_queries_per_request_bucket{{{list_labels},'
+            'le="0"}'], '1')
+        for cache_name, hits, misses in (('response', 1, 2),
+                                         ('token-local', 1, 1),
+                                         ('token-shared', 0, 1)):
+            self.assertEqual(samples.get(
+                f'foodgram_cache_requests_total{{cache="{cache_name}",'
+                f'result="hit"}}', '0'), str(hits))
+            self.assertEqual(samples[
+                f'foodgram_cache_requests_total{{cache="{cache_name}",'
+                f'result="miss"}}'], str(misses))
+        # The scrape itself
+        self.assertEqual(samples['foodgram_http_requests_in_flight'], '1')
+
+    def test_samples_of_all_workers_are_summed(self):
+        self.client.get('/api/recipes/')
+        # Another worker, since gone
+        pid = 99999999
+        worker = MmapDict(os.path.join(self.directory, f'counter_{pid}.db'))
+        worker.add(sample_key('foodgram_http_requests_total', {
+            'method': 'GET', 'route': 'recipe-list', 'status': '200'}), 3)
+        MmapDict(os.path.join(self.directory, f'gauge_{pid}.db')).add(
+            sample_key('foodgram_http_requests_in_flight', {}), 5)
+
+        samples = self.scrape()
+        self.assertEqual(samples[
+            'foodgram_http_requests_total{method="GET",route="recipe-list",'
+            'status="200"}'], '4')
+        self.assertEqual(samples['foodgram_http_requests_in_flight'], '1')
+
+        response = self.client.get('/metrics', HTTP_X_FORWARDED_FOR='1.2.3.4')
+        self.assertEqual(response.status_code, 404)
+
+
+def reload_urls():
+    for name in ('core.urls', 'api.urls', 'backend.urls'):
+        importlib.reload(sys.modules[name])
+    clear_url_caches()
+
+
+class AsyncReadTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        use_temporary_path(self, 'INGREDIENT_INDEX_PATH', 'idx')
+        live_recipes.generation = None
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = create_user('reader')
+            self.author = create_user('author')
+            salt = Ingredient.objects.create(name='salt', measurement_unit='g')
+            self.recipes = [
+                create_recipe(self.author, [(salt, number + 1)],
+                              f'Soup {number}') for number in range(3)]
+            Subscription.objects.create(user=self.user, author=self.author)
+            Favorite.objects.create(user=self.user, recipe=self.recipes[0])
+        self.token = Token.objects.create(user=self.user).key
+
+    def enable_async_reads(self):
+        settings_override = override_settings(ASYNC_READS=True)
+        settings_override.enable()
+        self.addCleanup(reload_urls)
+        self.addCleanup(settings_override.disable)
+        reload_urls()
+
+    def test_async_views_answer_like_sync_ones(self):
+        anonymous = ['/api/recipes/', '/api/recipes/?cursor=',
+                     f'/api/recipes/?author={self.author.id}',
+                     f'/api/recipes/{self.recipes[0].id}/', '/api/recipes/0/',
+                     '/api/ingredients/?name=sa']
+        authenticated = ['/api/recipes/?is_favorited=1',
+                         f'/api/recipes/{self.recipes[0].id}/',
+                         '/api/users/subscriptions/?recipes_limit=1']
+        requests = ([(path, {}) for path in anonymous]
+                    + [(path, {'HTTP_AUTHORIZATION': f'Token {self.token}'})
+                       for path in authenticated])
+
+        def responses():
+            results = []
+            for path, headers in requests:
+                cache.clear()
+                response = self.client.get(path, **headers)
+                results.append((path, response.status_code,
+                                response.get('ETag'), response.content))
+            return results
+
+        expected = responses()
+        self.enable_async_reads()
+        for path in ('/api/recipes/', '/api/recipes/1/',
+                     '/api/ingredients/', '/api/users/subscriptions/'):
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(path).func))
+        self.assertEqual(responses(), expected)
+
+    def test_writes_and_other_actions_stay_sync(self):
+        self.enable_async_reads()
+        self.assertFalse(asyncio.iscoroutinefunction(
+            resolve('/api/users/me/').func))
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        response = self.client.post(
+            f'/api/recipes/{self.recipes[1].id}/favorite/')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.delete(f'/api/recipes/{self.recipes[2].id}/')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(f'/api/recipes/{self.recipes[1].id}/')
+        self.assertTrue(response.data['is_favorited'])
+
+    def test_short_link(self):
+        self.enable_async_reads()
+        for code in (self.recipes[0].id,
+                     short_links.encode(self.recipes[0].id)):
+            response = self.client.get(f'/s/{code}/')
+            self.assertRedirects(response, f'/recipes/{self.recipes[0].id}',
+                                 fetch_redirect_response=False)
+        self.assertEqual(self.client.get('/s/0/').status_code, 404)
+        self.assertEqual(
+            self.client.post(f'/s/{self.recipes[0].id}/').status_code, 405)
+
+    async def test_export_streams_without_buffering(self):
+        await sync_to_async(ShoppingCart.objects.create)(
+            user=self.user, recipe=self.recipes[0])
+        with override_settings(ASYNC_READS=True):
+            response = await self.async_client.get(
+                '/api/recipes/download_shopping_cart/?format=txt',
+                headers={'Authorization': f'Token {self.token}'})
+            self.assertTrue(response.is_async)
+            content = b''.join([chunk async for chunk in
+                                response.streaming_content])
+        self.assertEqual(content.decode(), 'Shopping cart\n\nSalt (g) — 1\n')
+
+    async def test_queries_are_observed_on_the_event_loop(self):
+        await sync_to_async(self.enable_async_reads)()
+        statements = []
+        with observe_queries(lambda sql, duration: statements.append(sql)):
+            response = await self.async_client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)['results']), 3)
+        self.assertTrue(statements)
+
+
+class StandInConnection:
+    """Just enough of a psycopg connection for the pool, without a server."""
+    timezone = 'UTC'
+
+    def __init__(self):
+        self.autocommit = True
+        self.info = SimpleNamespace(
+            parameter_status=lambda name: self.timezone)
+        self.pgconn = SimpleNamespace(
+            transaction_status=psycopg.pq.TransactionStatus.IDLE)
+
+    @classmethod
+    def connect(cls, conninfo='', **kwargs):
+        return cls()
+
+    @property
+    def closed(self):
+        status = self.pgconn.transaction_status
+        return status == psycopg.pq.TransactionStatus.UNKNOWN
+
+    def execute(self, query):
+        if self.closed:
+            raise psycopg.OperationalError('the connection is closed')
+
+    def close(self):
+        self.pgconn.transaction_status = psycopg.pq.TransactionStatus.UNKNOWN
+
+
+@skipUnless(psycopg_pool, 'psycopg_pool is not installed')
+class ConnectionPoolTests(TestCase):
+    def setUp(self):
+        self.directory = use_temporary_path(self, 'METRICS_DIR', 'metrics')
+        # Configured by Django as the production pool is, but connecting to
+        # a stand-in
+        wrapper = ConnectionHandler({'default': {}, 'pooled': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': 'foodgram',
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {'pool': {
+                'min_size': 1, 'max_size': 2, 'timeout': 0.2,
+                'connection_class': StandInConnection}},
+        }})['pooled']
+        StandInConnection.timezone = wrapper.timezone_name
+        self.pool = wrapper.pool
+        self.addCleanup(wrapper.close_pool)
+        self.pool.open(wait=True)
+        self.store = Store(self.directory)
+
+    def samples(self):
+        record_pool(self.store, 'pooled', self.pool)
+        return dict(line.rsplit(' ', 1)
+                    for line in exposition(collect(self.directory))
+                    .splitlines() if not line.startswith('#'))
+
+    def test_exhaustion_and_recovery(self):
+        first, second = self.pool.getconn(), self.pool.getconn()
+        with self.assertRaises(psycopg_pool.PoolTimeout):
+            self.pool.getconn()
+        samples = self.samples()
+        self.assertEqual(samples['foodgram_db_pool_connections{'
+                                 'database="pooled",state="used"}'], '2')
+        self.assertEqual(samples['foodgram_db_pool_max_connections{'
+                                 'database="pooled"}'], '2')
+        self.assertEqual(samples['foodgram_db_pool_timeouts_total{'
+                                 'database="pooled"}'], '1')
+        self.assertGreaterEqual(float(samples[
+            'foodgram_db_pool_wait_seconds_total{database="pooled"}']), 0.2)
+
+        self.pool.putconn(first)
+        self.assertIs(self.pool.getconn(), first)
+        self.pool.putconn(first)
+        self.pool.putconn(second)
+        samples = self.samples()
+        self.assertEqual(samples['foodgram_db_pool_connections{'
+                                 'database="pooled",state="used"}'], '0')
+        # Counters keep their totals between samples
+        self.assertEqual(samples['foodgram_db_pool_timeouts_total{'
+                                 'database="pooled"}'], '1')
+
+    def test_broken_connections_are_replaced_on_checkout(self):
+        connection = self.pool.getconn()
+        self.pool.putconn(connection)
+        # The server went away while the connection sat in the pool
+        connection.close()
+        replacement = self.pool.getconn()
+        self.assertIsNot(replacement, connection)
+        self.assertFalse(replacement.closed)
+        self.pool.putconn(replacement)
+        self.assertEqual(self.samples()[
+            'foodgram_db_pool_connections_lost_total{database="pooled"}'],
+            '1')
+
+
+class ShortLinkTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        live_recipes.generation = None
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author = create_user('author')
+            self.salt = Ingredient.objects.create(name='salt',
+                                                  measurement_unit='g')
+            self.recipe = create_recipe(self.author, [(self.salt, 5)])
+
+    def test_codes_are_opaque_and_reversible(self):
+        codes = [short_links.encode(pk) for pk in (1, 2, 3, 2 ** 40 - 1)]
+        self.assertEqual(len(set(codes)), 4)
+        for pk, code in zip((1, 2, 3, 2 ** 40 - 1), codes):
+            self.assertRegex(code, r'^[A-Za-z][0-9A-Za-z]{6}$')
+            self.assertEqual(short_links.decode(code), pk)
+        for code in ('1234567', 'zzzzzzz', 'Ab-defg', 'Abc'):
+            self.assertIsNone(short_links.decode(code))
+
+    def test_links_resolve_without_queries(self):
+        response = self.client.get(f'/api/recipes/{self.recipe.id}/get-link/')
+        url = response.data['short-link']
+        code = short_links.encode(self.recipe.id)
+        self.assertEqual(url, f'http://testserver/s/{code}/')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+            # Links from before the codes
+            legacy = self.client.get(f'/s/{self.recipe.id}/')
+            missing = self.client.get(f'/s/{short_links.encode(10 ** 6)}/')
+            malformed = self.client.get('/s/not-a-code/')
+        for response in (response, legacy):
+            self.assertRedirects(response, f'/recipes/{self.recipe.id}',
+                                 fetch_redirect_response=False)
+            self.assertEqual(response['Cache-Control'],
+                             'public, max-age=300')
+        for response in (missing, malformed):
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+
+    def test_created_and_deleted_recipes_are_picked_up(self):
+        self.client.get('/s/0/')
+        code = short_links.encode(self.recipe.id)
+        link = f'/api/recipes/{self.recipe.id}/get-link/'
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = create_recipe(self.author, [(self.salt, 1)], 'Stew')
+            self.recipe.delete()
+        # Only the two changed recipes are read again
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                f'/s/{short_links.encode(recipe.id)}/')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.client.get(f'/s/{code}/').status_code, 404)
+        self.assertEqual(self.client.get(link).status_code, 404)
+
+        # A worker that missed the changes' log starts over
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.client.get(f'/s/{code}/')
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(APITestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        local_tokens.clear()
+        self.author = create_user('author')
+        salt = Ingredient.objects.create(name='salt', measurement_unit='g')
+        self.recipe = create_recipe(self.author, [(salt, 5)], 'Soup')
+        for model in (User, UserProfile, Ingredient, Recipe,
+                      RecipeIngredient):
+            model.objects.using('replica').bulk_create(model.objects.all())
+        # The replica has not caught up with the rename yet
+        Recipe.objects.filter(pk=self.recipe.pk).update(name='Stew')
+        # nor with the token
+        token = Token.objects.create(user=self.author)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def test_safe_requests_read_from_the_replica(self):
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual((response.status_code, response.data['name']),
+                         (200, 'Soup'))
+        self.assertTrue(queries.captured_queries)
+
+    def test_anonymous_responses_are_rendered_from_the_primary(self):
+        self.client.credentials()
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.json()['name'], 'Stew')
+        self.assertEqual(queries.captured_queries, [])
+
+    def test_counts_are_taken_on_the_primary(self):
+        create_recipe(self.author, [], 'Stew')
+        response = self.client.get('/api/recipes/')
+        # The page comes from the replica, the cached count from the primary
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['count'], 2)
+
+    def test_sessions_are_read_from_the_primary(self):
+        User.objects.filter(pk=self.author.pk).update(is_staff=True)
+        User.objects.using('replica').filter(pk=self.author.pk).update(
+            is_staff=True)
+        self.client.credentials()
+        self.client.login(username='author', password='Sup3r-secret')
+        self.assertEqual(self.client.get('/admin/').status_code, 200)
+
+    def test_clients_read_their_writes_from_the_primary(self):
+        self.assertEqual(
+            self.client.post(f'{self.url}favorite/').status_code, 201)
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['name'], 'Stew')
+        self.assertTrue(response.data['is_favorited'])
+
+        cache.clear()  # The sticky window is over
+        self.assertEqual(self.client.get(self.url).data['name'], 'Soup')
+
+
+class ConditionalRequestTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        use_temporary_path(self, 'INGREDIENT_INDEX_PATH', 'idx')
+        use_temporary_path(self, 'INGREDIENT_CATALOG_DIR', 'catalog')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author = create_user('author')
+            self.reader = create_user('reader')
+            self.salt = Ingredient.objects.create(name='salt',
+                                                  measurement_unit='g')
+            self.recipe = create_recipe(self.author, [(self.salt, 5)],
+                                        'Soup')
+
+    def revalidate(self, url, response, **params):
+        return self.client.get(url, params,
+                               HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_recipe_detail_and_list(self):
+        self.client.force_authenticate(self.reader)
+        for url in (f'/api/recipes/{self.recipe.id}/', '/api/recipes/'):
+            response = self.client.get(url)
+            self.assertTrue(response['ETag'].startswith('"'))
+            self.assertIn('Last-Modified', response)
+            with self.assertNumQueries(2 if url.endswith('s/') else 1):
+                revalidated = self.revalidate(url, response)
+            self.assertEqual(revalidated.status_code, 304)
+            self.assertEqual(revalidated['ETag'], response['ETag'])
+
+            # Per-user flags and shared rows both retire the ETag
+            favorite = Favorite.objects.create(user=self.reader,
+                                               recipe=self.recipe)
+            changed = self.revalidate(url, response)
+            self.assertEqual(changed.status_code, 200)
+            favorite.delete()
+            self.salt.name = 'sea salt'
+            self.salt.save()
+            self.assertEqual(
+                self.revalidate(url, changed).status_code, 200)
+
+    def test_anonymous_revalidation_is_served_from_cache(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            revalidated = self.revalidate(url, response)
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(self.revalidate(
+            '/api/recipes/', response).status_code, 200)
+
+    def test_ingredients_users_and_subscriptions(self):
+        self.client.force_authenticate(self.reader)
+        for url, params in (('/api/ingredients/', {}),
+                            ('/api/ingredients/', {'name': 'sa'}),
+                            ('/api/users/', {}),
+                            (f'/api/users/{self.author.id}/', {}),
+                            ('/api/users/me/', {}),
+                            ('/api/users/subscriptions/', {})):
+            response = self.client.get(url, params)
+            self.assertEqual(
+                self.revalidate(url, response, **params).status_code, 304,
+                url)
+
+        url = f'/api/users/{self.author.id}/'
+        response = self.client.get(url)
+        Subscription.objects.create(user=self.reader, author=self.author)
+        response = self.revalidate(url, response)
+        self.assertTrue(response.data['is_subscribed'])
+        self.author.first_name = 'Renamed'
+        self.author.save()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+        url = '/api/users/subscriptions/'
+        response = self.client.get(url)
+        create_recipe(self.author, [(self.salt, 1)], 'Stew')
+        self.assertEqual(
+            self.revalidate(url, response).data['results'][0]
+            ['recipes_count'], 2)
+
+    def test_if_match_rejects_stale_edits(self):
+        self.client.force_authenticate(self.author)
+        url = f'/api/recipes/{self.recipe.id}/'
+        etag = self.client.get(url)['ETag']
+        data = {'name': 'Borscht', 'text': 'Beets', 'cooking_time': 30,
+                'ingredients': [{'id': self.salt.id, 'amount': 2}]}
+
+        response = self.client.patch(url, data, format='json',
+                                     HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        response = self.client.patch(url, data, format='json',
+                                     HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(Recipe.objects.get().name, 'Borscht')
+        response = self.client.patch(url, data, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        self.client.force_authenticate(self.reader)
+        response = self.client.patch(url, data, format='json',
+                                     HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 403)
+
+
+class IngredientCatalogTests(APITestCase):
+    def setUp(self):
+        use_temporary_path(self, 'INGREDIENT_INDEX_PATH', 'idx')
+        self.catalog_dir = use_temporary_path(
+            self, 'INGREDIENT_CATALOG_DIR', 'catalog')
+        with self.captureOnCommitCallbacks(execute=True):
+            for name in ('соль', 'сахар', 'перец'):
+                Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def get(self, **extra):
+        return self.client.get('/api/ingredients/', **extra)
+
+    def test_catalog_is_served_pre_rendered(self):
+        ingredient_catalog.current()
+        with self.assertNumQueries(0):
+            response = self.get()
+        self.assertEqual(response.json(), IngredientSerializer(
+            Ingredient.objects.order_by('name'), many=True).data)
+        self.assertNotIn('Content-Encoding', response)
+
+        compressed = self.get(HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertEqual(gzip.decompress(compressed.content),
+                         response.content)
+        self.assertNotEqual(compressed['ETag'], response['ETag'])
+        self.assertEqual(self.get(
+            HTTP_ACCEPT_ENCODING='gzip',
+            HTTP_IF_NONE_MATCH=compressed['ETag']).status_code, 304)
+
+    @skipUnless(brotli, 'brotli is not installed')
+    def test_brotli_is_preferred(self):
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content),
+                         self.get().content)
+
+    def test_changes_rebuild_catalog_and_deltas(self):
+        version = self.get()['X-Catalog-Version']
+        pepper = Ingredient.objects.get(name='перец')
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.filter(name='соль').delete()
+            pepper.measurement_unit = 'щепотка'
+            pepper.save()
+        path = os.path.join(self.catalog_dir, 'new.csv')
+        with open(path, 'w', encoding='utf-8') as output:
+            output.write('мёд,г\n')
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient_loader.load(path)
+
+        response = self.get()
+        self.assertNotEqual(response['X-Catalog-Version'], version)
+        self.assertEqual([item['name'] for item in response.json()],
+                         ['мёд', 'перец', 'сахар'])
+
+        delta = self.client.get('/api/ingredients/', {'since': version})
+        self.assertEqual(
+            {item['name'] for item in delta.data['changed']},
+            {'мёд', 'перец'})
+        self.assertEqual(len(delta.data['deleted']), 1)
+        self.assertEqual(delta.data['version'],
+                         response['X-Catalog-Version'])
+        current = self.client.get('/api/ingredients/',
+                                  {'since': delta.data['version']})
+        self.assertEqual((current.data['changed'], current.data['deleted']),
+                         ([], []))
+
+        unknown = self.client.get('/api/ingredients/',
+                                  {'since': '../../etc/passwd'})
+        self.assertTrue(unknown.data['full'])
+        self.assertEqual(len(unknown.data['changed']), 3)
+
+
+class CachedTokenAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        local_tokens.clear()
+        self.user = create_user('reader')
+        response = self.client.post('/api/auth/token/login/', {
+            'email': 'reader@example.com', 'password': 'Sup3r-secret'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/users/me/')
+        return response, sum('authtoken_token' in query['sql']
+                             for query in queries.captured_queries)
+
+    def test_repeat_requests_skip_the_token_query(self):
+        response, queries = self.token_queries()
+        self.assertEqual((response.status_code, queries), (200, 1))
+        response, queries = self.token_queries()
+        self.assertEqual((response.status_code, queries), (200, 0))
+        self.assertEqual(response.data['username'], 'reader')
+
+        # Only the local copy is gone, as in another worker
+        local_tokens.clear()
+        self.assertEqual(self.token_queries()[1], 0)
+
+    def test_logout_password_change_and_deactivation(self):
+        self.token_queries()
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'Sup3r-secret',
+            'new_password': 'An0ther-secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.token_queries()[1], 1)
+
+        self.user.refresh_from_db()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.token_queries()[0].status_code, 401)
+
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.token_queries()[0].status_code, 200)
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.token_queries()[0].status_code, 401)
+
+    def test_lru_is_bounded(self):
+        lru = LRUCache(max_size=2)
+        lru.set('a', 1, 60)
+        lru.set('b', 2, 60)
+        lru.get('a')
+        lru.set('c', 3, 60)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')),
+                         (1, None, 3))
+        lru.set('d', 4, -1)
+        self.assertIsNone(lru.get('d'))
+
+
+class RecipeSearchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        recipe_index.generation = None
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author = create_user('author')
+            self.soup = self.create(
+                'Tomato soup', 'Ripe tomato, basil and garlic simmered.')
+            self.bread = self.create(
+                'Garlic bread', 'Bread rubbed with garlic and <b>butter</b>.')
+            self.create('Pancakes', 'Flour, milk and eggs.')
+
+    def create(self, name, text):
+        recipe = create_recipe(self.author, [], name)
+        Recipe.objects.filter(pk=recipe.pk).update(text=text)
+        return recipe
+
+    def search(self, query, **params):
+        return self.client.get('/api/recipes/', {'search': query, **params})
+
+    def test_matches_are_ranked_with_snippets(self):
+        results = self.search('GARLIC').json()['results']
+        self.assertEqual([item['id'] for item in results],
+                         [self.bread.id, self.soup.id])
+        self.assertIn('<mark>garlic</mark>', results[1]['search_snippet'])
+        self.assertIn('&lt;b&gt;butter', results[0]['search_snippet'])
+
+        response = self.search('garlic tomato')
+        self.assertEqual([item['id'] for item in response.json()['results']],
+                         [self.soup.id])
+        self.assertEqual(self.search('truffle').json()['count'], 0)
+        self.assertNotIn('search_snippet',
+                         self.client.get('/api/recipes/').json()['results'][0])
+
+    def test_search_uses_page_numbers(self):
+        response = self.search('garlic', cursor='')
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_index_follows_writes(self):
+        self.assertEqual(self.search('basil').json()['count'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create('Pesto', 'Basil, pine nuts and cheese.')
+        self.assertEqual(self.search('basil').json()['count'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.soup.delete()
+        self.assertEqual(self.search('basil').json()['count'], 1)
+
+
+class IngredientSetSearchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        ingredient_sets.generation = None
+        self.author = create_user('author')
+        self.flour, self.milk, self.eggs = (
+            Ingredient.objects.create(name=name, measurement_unit='g')
+            for name in ('flour', 'milk', 'eggs'))
+        self.pancakes = create_recipe(
+            self.author, [(self.flour, 200), (self.milk, 300),
+                          (self.eggs, 2)], 'Pancakes')
+        self.bread = create_recipe(self.author, [(self.flour, 500)], 'Bread')
+        self.omelette = create_recipe(
+            self.author, [(self.milk, 50), (self.eggs, 3)], 'Omelette')
+
+    def match(self, ingredients, mode=None):
+        params = {'ingredients': ','.join(str(item.id)
+                                          for item in ingredients)}
+        if mode:
+            params['match'] = mode
+        results = self.client.get('/api/recipes/', params).json()['results']
+        return [(item['id'], item.get('ingredient_coverage'))
+                for item in results]
+
+    def test_all_and_any(self):
+        self.assertEqual(self.match([self.milk, self.eggs]),
+                         [(self.omelette.id, None), (self.pancakes.id, None)])
+        self.assertEqual(self.match([self.flour, self.milk], 'all'),
+                         [(self.pancakes.id, None)])
+        self.assertEqual(
+            {pk for pk, _ in self.match([self.flour, self.eggs], 'any')},
+            {self.pancakes.id, self.bread.id, self.omelette.id})
+
+    def test_best_ranks_by_coverage(self):
+        self.assertEqual(self.match([self.flour, self.eggs], 'best'), [
+            (self.bread.id, 1.0),
+            (self.pancakes.id, 0.6667),
+            (self.omelette.id, 0.5),
+        ])
+        response = self.client.get('/api/recipes/', {
+            'ingredients': f'{self.milk.id},x', 'match': 'best',
+            'cursor': ''})
+        self.assertEqual(response.json()['count'], 2)
+
+    @override_settings(RECIPE_INGREDIENT_MATCH_LIMIT=1)
+    def test_other_filters_apply_before_the_limit(self):
+        other = create_user('other')
+        create_recipe(other, [(self.flour, 100)], 'Scones')
+        response = self.client.get('/api/recipes/', {
+            'ingredients': self.flour.id, 'author': self.author.id})
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']],
+            [self.bread.id, self.pancakes.id])
+        self.assertEqual(response.json()['count'], 2)
+        # The limit only cuts the ranking, of the author's recipes
+        response = self.client.get('/api/recipes/', {
+            'ingredients': f'{self.flour.id},{self.eggs.id}',
+            'match': 'best', 'author': self.author.id})
+        self.assertEqual(
+            [(item['id'], item['ingredient_coverage'])
+             for item in response.json()['results']],
+            [(self.bread.id, 1.0)])
+
+    def test_only_the_page_reaches_the_database(self):
+        for index in range(12):
+            create_recipe(self.author, [(self.flour, 1)], f'Bun {index}')
+        for params in ({}, {'author': self.author.id}):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/recipes/', {
+                    'ingredients': self.flour.id, 'page': 2, **params})
+            self.assertEqual(response.json()['count'], 14)
+            self.assertEqual(len(response.json()['results']), 4)
+            lists = [re.findall(r'IN \(([^)]*)\)', query['sql'])
+                     for query in queries]
+            self.assertLessEqual(
+                max(item.count(',') + 1 for found in lists for item in found),
+                4)
+
+    def test_index_replays_changes(self):
+        self.match([self.milk])
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{self.bread.id}/',
+                {'ingredients': [{'id': self.flour.id, 'amount': 500},
+                                 {'id': self.milk.id, 'amount': 100}],
+                 'name': 'Milk bread', 'text': 'Bake', 'cooking_time': 40},
+                format='json')
+            self.assertEqual(response.status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.omelette.delete()
+        with mock.patch.object(ingredient_sets, 'build') as build:
+            self.assertEqual(self.match([self.milk]), [
+                (self.bread.id, None), (self.pancakes.id, None)])
+        build.assert_not_called()
+
+
+class IngredientLoaderTests(APITestCase):
+    def setUp(self):
+        use_temporary_path(self, 'INGREDIENT_INDEX_PATH', 'idx')
+        self.directory = os.path.dirname(
+            use_temporary_path(self, 'INGREDIENT_CATALOG_DIR', 'catalog'))
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as output:
+            output.write(content)
+        return path
+
+    def load(self, path, *args):
+        output = io.StringIO()
+        call_command('load_ingredients', path, *args, stdout=output)
+        return output.getvalue()
+
+    def test_load_is_idempotent(self):
+        path = self.write('ingredients.csv', (
+            'name,measurement_unit\n'
+            'соль,г\n мёд ,г\nмёд,г\nмёд,ст. л.\n\n,г\n'
+            f'{"x" * 200},г\nперец\n'))
+        with self.captureOnCommitCallbacks(execute=True):
+            # Repeats in later chunks count as already present
+            self.assertIn('Inserted 2, unchanged 2, skipped 3',
+                          self.load(path, '--chunk-size', '2'))
+        self.assertIn('Inserted 0, unchanged 3, skipped 4', self.load(path))
+        self.assertEqual(Ingredient.objects.count(), 3)
+        self.assertEqual(
+            sorted(row['measurement_unit'] for row in
+                   ingredient_catalog.current().rows if row['name'] == 'мёд'),
+            ['г', 'ст. л.'])
+
+        with self.assertRaises(CommandError):
+            self.load(os.path.join(self.directory, 'missing.csv'))
+
+    def test_json_is_streamed(self):
+        rows = [{'name': f'ингредиент {index}', 'measurement_unit': 'г'}
+                for index in range(50)]
+        content = json.dumps(rows, ensure_ascii=False, indent=1)
+        self.assertEqual(
+            list(ingredient_loader.read_json(io.StringIO(content),
+                                             block_size=7)),
+            [(row['name'], row['measurement_unit']) for row in rows])
+        with self.assertRaises(ValueError):
+            list(ingredient_loader.read_json(io.StringIO(content[:-20])))
+
+        path = self.write('ingredients.json', content)
+        self.assertIn('Inserted 50, unchanged 0, skipped 0', self.load(path))
+
+    def test_admin_import_runs_the_loader(self):
+        admin = create_user('admin', is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        upload = io.BytesIO('name,measurement_unit\nмёд,г\n'.encode())
+        upload.name = 'ingredients.csv'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/admin/core/ingredient/import/',
+                {'import_file': upload, 'format': 0,
+                 'resource': 0})
+        self.assertRedirects(response, '/admin/core/ingredient/')
+        self.assertTrue(Ingredient.objects.filter(name='мёд').exists())
+
+
+class RecipeTransferTests(APITestCase):
+    def setUp(self):
+        use_temporary_path(self, 'INGREDIENT_INDEX_PATH', 'idx')
+        self.path = os.path.join(os.path.dirname(use_temporary_path(
+            self, 'INGREDIENT_CATALOG_DIR', 'catalog')), 'recipes.ndjson.gz')
+        self.salt = Ingredient.objects.create(name='соль',
+                                              measurement_unit='г')
+        self.milk = Ingredient.objects.create(name='молоко',
+                                              measurement_unit='мл')
+        self.author = create_user('cook', first_name='Анна')
+        for index in range(5):
+            create_recipe(self.author,
+                          [(self.salt, 5), (self.milk, index + 1)],
+                          f'Recipe {index}')
+        self.output = io.StringIO()
+        call_command('export_recipes', self.path, stdout=self.output)
+
+    def replace_database(self):
+        self.author.delete()
+        Ingredient.objects.all().delete()
+        Ingredient.objects.create(name='перец', measurement_unit='г')
+        self.milk = Ingredient.objects.create(name='молоко',
+                                              measurement_unit='мл')
+
+    def import_dump(self, *args):
+        call_command('import_recipes', self.path, *args,
+                     '--batch-size', '3', stdout=self.output)
+
+    def recipes(self):
+        return sorted(
+            (recipe.author.username, recipe.name, recipe.image.name,
+             sorted((item.ingredient.name, item.amount)
+                    for item in recipe.recipe_ingredients.all()))
+            for recipe in Recipe.objects.all())
+
+    def test_round_trip(self):
+        self.assertIn('Exported 5 recipes, 1 authors and 2 ingredients',
+                      self.output.getvalue())
+        expected = self.recipes()
+        self.replace_database()
+        self.import_dump()
+
+        self.assertEqual(self.recipes(), expected)
+        author = User.objects.get(username='cook')
+        self.assertTrue(author.check_password('Sup3r-secret'))
+        self.assertEqual(author.first_name, 'Анна')
+        self.assertEqual(author.profiles.recipes_count, 5)
+        self.assertEqual(Ingredient.objects.get(name='молоко'), self.milk)
+        self.assertEqual(
+            self.client.get('/api/recipes/').json()['count'], 5)
+        self.assertFalse(os.path.exists(f'{self.path}.checkpoint'))
+
+    def test_interrupted_import_resumes(self):
+        expected = self.recipes()
+        self.replace_database()
+        import_recipes = recipe_transfer.Importer.import_recipes
+        calls = []
+
+        def interrupted(importer, records):
+            calls.append(records)
+            if len(list(filter(None, calls))) == 2:
+                raise OSError('disk full')
+            import_recipes(importer, records)
+
+        with mock.patch.object(recipe_transfer.Importer, 'import_recipes',
+                               interrupted):
+            with self.assertRaises(CommandError):
+                self.import_dump()
+        self.assertEqual(Recipe.objects.count(), 2)
+
+        # Progress committed after the last checkpoint is not repeated
+        with open(f'{self.path}.checkpoint', 'w') as checkpoint:
+            json.dump({'line': 3}, checkpoint)
+        self.import_dump()
+        self.assertEqual(self.recipes(), expected)
+        self.assertEqual(
+            User.objects.get(username='cook').profiles.recipes_count, 5)
+
+
+class GenerateDatasetTests(APITestCase):
+    def setUp(self):
+        for name in ('соль', 'сахар', 'перец чёрный', 'мука пшеничная'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def generate(self):
+        first = Recipe.objects.count()
+        call_command('generate_dataset', '--users', '30', '--recipes', '60',
+                     '--seed', '7', '--ingredients', '', '--batch-size', '25',
+                     stdout=io.StringIO())
+        return [
+            (recipe.name, recipe.cooking_time, recipe.favorites_count,
+             sorted(recipe.recipe_ingredients.values_list(
+                 'ingredient_id', flat=True)))
+            for recipe in Recipe.objects.order_by('pk')[first:]
+        ]
+
+    def test_dataset_is_consistent_and_deterministic(self):
+        recipes = self.generate()
+        self.assertEqual(len(recipes), 60)
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(counters.reconcile(dry_run=True), {
+            'missing profiles': 0, 'recipes': 0, 'profiles': 0})
+        self.assertEqual(shopping_list.find_drift(), {})
+        self.assertEqual(self.generate(), recipes)
+
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.json()['count'], 120)
@@ -0,0 +1,27 @@
+"""Helpers for work deferred until the current transaction commits."""
+import threading
+
+from django.db import transaction
+
+_pending = threading.local()
+
+
+def on_commit_once(key, func):
+    """Run ``func`` once the current transaction commits.
+
+    Repeated calls with the same ``key`` inside one transaction, such as
+    one per row of an admin import, collapse into a single call.
+    """
+    callbacks = _pending.__dict__.setdefault('callbacks', {})
+    pending = callbacks.get(key)
+    connection = transaction.get_connection()
+    if pending and any(entry[1] is pending
+                       for entry in connection.run_on_commit):
+        return
+
+    def run():
+        callbacks.pop(key, None)
+        func()
+
+    callbacks[key] = run
+    transaction.on_commit(run)
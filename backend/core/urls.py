@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.urls import path
-from .views import short_link_redirect
+from .views import ashort_link_redirect, short_link_redirect
 
 urlpatterns = [
-    path('s/<int:pk>/', short_link_redirect, name='short-link')
+    path('s/<str:code>/',
+         ashort_link_redirect if settings.ASYNC_READS else short_link_redirect,
+         name='short-link')
 ]
@@ -1,16 +1,43 @@
+from django.conf import settings
 from django.shortcuts import redirect
-from .models import Recipe
+from django.utils.cache import patch_cache_control
+from .short_links import decode, live_recipes
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from django.http import HttpResponseNotFound
+from django.views.decorators.http import require_safe
+
+
+def recipe_id(code):
+    # Links handed out before the codes carry the id itself
+    if code.isdecimal():
+        return int(code)
+    return decode(code)
 
 
 @api_view(('GET',))
 @permission_classes((AllowAny,))
-def short_link_redirect(request, pk):
-    if Recipe.objects.filter(id=pk).exists():
-        return redirect(f'/recipes/{pk}')
-    return HttpResponseNotFound(
-        f'Recipe with id {pk} not found. \
-            Recipe deleted or not yet created',
-    )
+def short_link_redirect(request, code):
+    pk = recipe_id(code)
+    return short_link_response(
+        pk, pk is not None and pk in live_recipes.current())
+
+
+@require_safe
+async def ashort_link_redirect(request, code):
+    pk = recipe_id(code)
+    return short_link_response(
+        pk, pk is not None and pk in await live_recipes.acurrent())
+
+
+def short_link_response(pk, exists):
+    if exists:
+        response = redirect(f'/recipes/{pk}')
+        max_age = settings.SHORT_LINK_MAX_AGE
+    else:
+        response = HttpResponseNotFound(
+            'Recipe not found. Recipe deleted or not yet created')
+        # Bots walking ids are answered by the proxy for a while
+        max_age = settings.SHORT_LINK_MISS_MAX_AGE
+    patch_cache_control(response, public=True, max_age=max_age)
+    return response
@@ -12,5 +12,16 @@ else
     echo "Skipping test data loading."
 fi
 
-# Start Gunicorn server
+# Build the ingredient autocomplete snapshot shared by the workers
+python manage.py build_ingredient_index
+
+# Metrics of the previous run's workers
+rm -rf "${METRICS_DIR:-/tmp/foodgram-metrics}"
+
+# Start Gunicorn server; ASGI=1 serves the reads from coroutines under
+# uvicorn workers
+if [ "$ASGI" = "1" ]; then
+    exec gunicorn backend.asgi:application --bind 0.0.0.0:8000 --workers 3 \
+        --worker-class uvicorn.workers.UvicornWorker
+fi
 exec gunicorn backend.wsgi:application --bind 0.0.0.0:8000 --workers 3